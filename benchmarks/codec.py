@@ -0,0 +1,61 @@
+"""Encode/decode time and metadata size of the latent codecs in str_utils.
+
+Run from the extension root:  python -m benchmarks.codec [--num-ws 16] [--w-dim 512]
+"""
+import argparse
+import timeit
+
+import torch
+
+from lib_gan_extension import str_utils
+
+def sample_latents(num_ws: int, w_dim: int) -> dict:
+    torch.manual_seed(0)
+    w1 = torch.randn(1, 1, w_dim).repeat(1, num_ws, 1)
+    w2 = torch.randn(1, 1, w_dim).repeat(1, num_ws, 1)
+    mix = w1.clone()
+    mix[:, :num_ws // 2] = w2[:, :num_ws // 2]
+    return {
+        'seed': w1,                                 # one unique row, like every seed latent
+        'mix': mix,                                 # two unique rows
+        'random': torch.randn(1, num_ws, w_dim),    # worst case, no repeated rows
+    }
+
+def codecs() -> dict:
+    return {
+        'legacy': (str_utils.legacy_tensor2str, str_utils.legacy_str2tensor),
+        'float32': (lambda w: str_utils.tensor2str(w, dtype='float32'), str_utils.str2tensor),
+        'float16': (lambda w: str_utils.tensor2str(w, dtype='float16'), str_utils.str2tensor),
+        'int8': (lambda w: str_utils.tensor2str(w, dtype='int8'), str_utils.str2tensor),
+        'float32 (binary)': (lambda w: str_utils.tensor2bytes(w, dtype='float32'), str_utils.bytes2tensor),
+    }
+
+def run(num_ws: int, w_dim: int, number: int) -> list[dict]:
+    results = []
+    for latent_name, w in sample_latents(num_ws, w_dim).items():
+        for codec_name, (encode, decode) in codecs().items():
+            encoded = encode(w)
+            decoded = decode(encoded)
+            results.append({
+                'latent': latent_name,
+                'codec': codec_name,
+                'size': len(encoded),
+                'encode_us': timeit.timeit(lambda: encode(w), number=number) / number * 1e6,
+                'decode_us': timeit.timeit(lambda: decode(encoded), number=number) / number * 1e6,
+                'max_err': float((decoded.reshape(w.shape) - w).abs().max()),
+            })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--num-ws', type=int, default=16)
+    parser.add_argument('--w-dim', type=int, default=512)
+    parser.add_argument('--number', type=int, default=200, help="iterations per timing")
+    args = parser.parse_args()
+
+    print(f"{'latent':<8} {'codec':<18} {'bytes':>8} {'encode us':>10} {'decode us':>10} {'max err':>10}")
+    for r in run(args.num_ws, args.w_dim, args.number):
+        print(f"{r['latent']:<8} {r['codec']:<18} {r['size']:>8} {r['encode_us']:>10.1f} {r['decode_us']:>10.1f} {r['max_err']:>10.2e}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+"""Golden-output equivalence harness: a fixed seed/psi/mix matrix through the reference render path and every alternative.
+
+Run from the extension root:
+    python -m benchmarks.golden [--architectures stylegan2,stylegan3] [--resolution 64]
+    python -m benchmarks.golden --model /path/to/model.pkl
+    python -m benchmarks.golden --record golden.npz     # keep the reference renders
+    python -m benchmarks.golden --golden golden.npz     # fail when the reference renders change
+    python -m benchmarks.golden --paths batched,compiled
+
+Seeds are asset IDs, so the reference path (cpu, float32, one image per synthesis call, the
+reference torch_utils ops) defines the pixels of a seed. Every alternative path renders the same
+matrix and must stay within its max-abs / PSNR tolerance of the reference, and a --golden file
+from an earlier run pins the reference itself. Latents are held to a stricter standard: every
+cache and codec round trip of get_w_from_seed must give back the very same bits.
+"""
+from __future__ import annotations
+import argparse
+import copy
+import json
+import math
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from benchmarks import synthetic
+from benchmarks.suite import ARCHITECTURES
+
+SEEDS = (0, 1, 42, 0xFFFFFFFE)
+PSIS = (0.5, 1.0)
+MIX_PSI = 0.7
+MIXES = ( # seed1, seed2, mask, amount
+    (0, 42, 'coarse', 0.5),
+    (1, 0xFFFFFFFE, 'fine', -0.5),
+    (42, 1, 'mid', 1.0),
+    (0, 1, 'total', 0.0),
+)
+EXACT = (0, math.inf)
+
+def cases() -> list[dict]:
+    """The render matrix, as the params GanGenerator names its files with."""
+    return ([{'seed': seed, 'psi': psi} for psi in PSIS for seed in SEEDS] +
+            [{'seed1': seed1, 'seed2': seed2, 'psi1': MIX_PSI, 'psi2': MIX_PSI, 'mix': mix, 'interp': mask}
+             for seed1, seed2, mask, mix in MIXES])
+
+def case_name(case: dict) -> str:
+    if 'seed' in case:
+        return f"seed {case['seed']} psi {case['psi']}"
+    return f"mix {case['seed1']}+{case['seed2']} {case['interp']} {case['mix']}"
+
+def latents(model, matrix: list[dict]) -> torch.Tensor:
+    """[N, num_ws, w_dim] reference latents of the matrix."""
+    ws = []
+    for case in matrix:
+        if 'seed' in case:
+            ws.append(model.get_w_from_seed(case['seed'], case['psi']))
+        else:
+            w1 = model.get_w_from_seed(case['seed1'], case['psi1'])
+            w2 = model.get_w_from_seed(case['seed2'], case['psi2'])
+            ws.append(model.mixer.mix(w1, w2, case['mix'], case['interp'])[0])
+    return torch.cat(ws)
+
+def to_array(images) -> np.ndarray:
+    return np.stack([np.asarray(img.convert('RGB')) for img in images])
+
+def render_single(model, ws: torch.Tensor) -> np.ndarray:
+    return to_array([model.w_to_images(w.unsqueeze(0))[0] for w in ws])
+
+## Alternative paths: (render(ctx) -> uint8 [N, H, W, 3], (max abs, min PSNR), unavailable(args) -> reason or None)
+
+def render_batched(ctx) -> np.ndarray:
+    return to_array(ctx['model'].w_to_images(ctx['ws'], batch_size=len(ctx['ws'])))
+
+def render_channels_last(ctx) -> np.ndarray:
+    from lib_gan_extension import GanModel
+    G = copy.deepcopy(ctx['model'].G).to(memory_format=torch.channels_last)
+    return render_single(GanModel(G), ctx['ws'])
+
+def synthesize(G, ws: torch.Tensor, **kwargs) -> np.ndarray:
+    """One image per synthesis call outside GanModel, converted to uint8 like GanModel does (in float32)."""
+    images = [G.synthesis(w.unsqueeze(0), noise_mode='const', **kwargs).float() for w in ws]
+    return torch.cat(images).permute(0, 2, 3, 1).mul(127.5).add(128).clamp(0, 255).to(torch.uint8).cpu().numpy()
+
+def render_compiled(ctx) -> np.ndarray:
+    from lib_gan_extension import GanModel
+    model = GanModel(copy.deepcopy(ctx['model'].G))
+    model.G.synthesis.forward = torch.compile(model.G.synthesis.forward)
+    return render_single(model, ctx['ws'])
+
+def render_cuda(ctx) -> np.ndarray:
+    # what the extension does on cuda: the plugins, and the reduced precision (fp16) layers of the network
+    from lib_gan_extension import GanModel, GanGenerator
+    GanGenerator.init_plugins()
+    return render_single(GanModel(copy.deepcopy(ctx['model'].G), 'cuda'), ctx['ws'].to('cuda'))
+
+def render_cuda_fp32(ctx) -> np.ndarray:
+    from lib_gan_extension import GanGenerator
+    GanGenerator.init_plugins()
+    return synthesize(copy.deepcopy(ctx['model'].G).to('cuda'), ctx['ws'].to('cuda'), force_fp32=True)
+
+def render_generator(ctx) -> np.ndarray:
+    return ctx['generator']['images']
+
+def render_cache(ctx) -> np.ndarray:
+    return ctx['generator']['cached']
+
+def render_generator_batched(ctx) -> np.ndarray:
+    return ctx['generator']['batched']
+
+def no_cuda(args) -> str | None:
+    return None if torch.cuda.is_available() else "no cuda device"
+
+PATHS = {
+    'generator': (render_generator, EXACT, None),                   # GanGenerator single renders, saved to the cache
+    'cache': (render_cache, EXACT, None),                           # the same renders read back from the cache
+    'generator-batched': (render_generator_batched, (1, 50.0), None), # generate_base_images / generate_mixes
+    'batched': (render_batched, (1, 50.0), None),
+    'channels-last': (render_channels_last, (1, 50.0), None),
+    'compiled': (render_compiled, (1, 50.0), None),
+    'cuda': (render_cuda, (None, 35.0), no_cuda),
+    'cuda-fp32': (render_cuda_fp32, (2, 45.0), no_cuda),
+}
+DEFAULT_PATHS = [name for name in PATHS if name != 'compiled'] # torch.compile needs a compiler and minutes
+
+def compare_images(reference: np.ndarray, images: np.ndarray) -> list[tuple[int, float]]:
+    """(max abs difference, PSNR in dB) of each image."""
+    results = []
+    for ref, img in zip(reference, images):
+        diff = np.abs(ref.astype(np.int16) - img.astype(np.int16))
+        mse = float(np.mean(diff.astype(np.float64) ** 2))
+        results.append((int(diff.max()), math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)))
+    return results
+
+def verdict(failed: list[str], total: int, shown: int=3) -> str:
+    if not failed:
+        return "ok"
+    return f"FAIL {len(failed)}/{total}: {', '.join(failed[:shown])}" + (", ..." if len(failed) > shown else "")
+
+def within(result: tuple[int, float], tolerance: tuple) -> bool:
+    max_abs, min_psnr = tolerance
+    return (max_abs is None or result[0] <= max_abs) and result[1] >= min_psnr
+
+## Latents: every round trip must be bit-exact
+
+def latent_checks(model, matrix: list[dict], ws: torch.Tensor, tmp: Path, generator: dict) -> dict[str, list[str]]:
+    """{check: names of the cases whose latent changed}"""
+    from lib_gan_extension import metadata, output_cache, str_utils
+
+    checks = {name: [] for name in ('get_w_from_seed repeat', 'codec str', 'codec bytes', 'metadata png', 'metadata jpg',
+                                    'latent store', 'generator', 'generator cache', 'generator latent store')}
+    def expect(check, case, w, w_ref):
+        if w is None or w.dtype != w_ref.dtype or not torch.equal(w.reshape(w_ref.shape).cpu(), w_ref):
+            checks[check].append(case_name(case))
+
+    tmp.mkdir(parents=True, exist_ok=True)
+    again = latents(model, matrix)
+    for i, case in enumerate(matrix):
+        w = ws[i:i + 1]
+        expect('get_w_from_seed repeat', case, again[i:i + 1], w)
+        expect('codec str', case, str_utils.str2tensor(str_utils.tensor2str(w)), w)
+        expect('codec bytes', case, str_utils.bytes2tensor(str_utils.tensor2bytes(w)), w)
+        img = model.w_to_images(w)[0]
+        for image_format in ('png', 'jpg'):
+            path = tmp / f"latent-{i}.{image_format}"
+            metadata.save_image(img, path, case, {'tensor': w})
+            expect(f'metadata {image_format}', case, metadata.parse_latents_from_image(path).get('tensor'), w)
+        output_cache.save_latents(tmp / 'store', f"latent-{i}.png", {'tensor': str_utils.tensor2bytes(w)})
+        blob = output_cache.load_latents(tmp / 'store', f"latent-{i}.png").get('tensor')
+        expect('latent store', case, str_utils.bytes2tensor(blob) if blob else None, w)
+        for check in ('generator', 'generator cache', 'generator latent store'):
+            expect(check, case, generator[check][i], w)
+    return checks
+
+def run_generator(model_path: Path, matrix: list[dict], outputs: Path, batch_size: int) -> dict:
+    """Render the matrix through GanGenerator twice (cache miss, then hit), then once more batched into a fresh cache."""
+    from lib_gan_extension import GanGenerator, global_state, output_cache
+
+    global_state.device = 'cpu'
+    global_state.batch_size = batch_size
+    generator = GanGenerator(outputs / 'single')
+    generator.set_model(str(model_path))
+    def render(case):
+        if 'seed' in case:
+            img, w = generator.find_or_generate_base_image(case['seed'], case['psi'])
+            return img, w
+        _, _, img, _, _, w = generator.generate_image_mix(case['seed1'], case['psi1'], case['seed2'], case['psi2'],
+                                                         case['interp'], case['mix'], 1.0, None, None)
+        return img, w
+    first = [render(case) for case in matrix]
+    cached = [render(case) for case in matrix]
+
+    # evict the renders but keep their latents, as the disk budget does
+    stored = []
+    for case in matrix:
+        filename = generator.image_path_with_params(case, base='base' if 'seed' in case else 'mix')
+        path = generator.image_file(filename)
+        generator.cache.keep_latents(path)
+        output_cache.remove(path)
+        stored.append(generator.find_latents(filename).get('tensor'))
+
+    batched_generator = GanGenerator(outputs / 'batched')
+    batched_generator.set_model(str(model_path))
+    batched = []
+    for psi in PSIS:
+        images = batched_generator.generate_base_images(list(SEEDS), psi)
+        batched += [images[seed][0] for seed in SEEDS]
+    for seed1, seed2, mask, mix in MIXES:
+        batched += batched_generator.generate_mixes([(seed1, seed2)], MIX_PSI, mask, mix)
+
+    return {
+        'images': to_array(img for img, _ in first),
+        'cached': to_array(img for img, _ in cached),
+        'batched': to_array(batched),
+        'generator': [w for _, w in first],
+        'generator cache': [w for _, w in cached],
+        'generator latent store': stored,
+    }
+
+## Driver
+
+def models(args, folder: Path) -> list[tuple[str, Path]]:
+    """(label, checkpoint path) of the models to check, synthetic ones written into folder."""
+    if args.model:
+        return [(path.stem, path.resolve()) for path in args.model]
+    results = []
+    for architecture in args.architectures:
+        G = synthetic.build(architecture, args.resolution, channel_base=args.channel_base, channel_max=args.channel_max)
+        label = f"{architecture}-{args.resolution}"
+        results.append((label, synthetic.save(G, folder / f"{label}.pkl")))
+    return results
+
+def check_model(label: str, path: Path, args, tmp: Path, golden: dict, record: dict) -> bool:
+    from lib_gan_extension import GanModel
+
+    torch.backends.cudnn.allow_tf32 = False # tf32 would already fail the cuda tolerance
+    torch.backends.cuda.matmul.allow_tf32 = False
+    model = GanModel(str(path), 'cpu')
+    matrix = cases()
+    with torch.no_grad():
+        ws = latents(model, matrix)
+        reference = render_single(model, ws)
+        generator = run_generator(path, matrix, tmp / f"outputs-{label}", args.batch_size)
+        ctx = {'model': model, 'ws': ws, 'generator': generator}
+        record[f'{label}.images'], record[f'{label}.ws'] = reference, ws.numpy()
+
+        print(f"\n{label}: {len(matrix)} renders at {model.img_resolution}px")
+        print(f"{'path':<24} {'max abs':>8} {'min PSNR':>10} {'tolerance':>14}  result")
+        ok = True
+        rows = []
+        if golden:
+            if f'{label}.images' not in golden:
+                rows.append(('golden', None, EXACT, "not in the golden file"))
+            else:
+                rows.append(('golden', compare_images(golden[f'{label}.images'], reference), EXACT, None))
+        for name in args.paths:
+            render, tolerance, unavailable = PATHS[name]
+            reason = unavailable(args) if unavailable is not None else None
+            if reason is None:
+                try:
+                    rows.append((name, compare_images(reference, render(ctx)), tolerance, None))
+                except Exception as e:
+                    rows.append((name, None, tolerance, f"failed: {type(e).__name__}: {e}"))
+                    ok = False
+            else:
+                rows.append((name, None, tolerance, f"skipped ({reason})"))
+        for name, results, tolerance, note in rows:
+            limit = f"{'-' if tolerance[0] is None else tolerance[0]} / {tolerance[1]:g}"
+            if results is None:
+                print(f"{name:<24} {'-':>8} {'-':>10} {limit:>14}  {note}")
+                continue
+            worst_abs, worst_psnr = max(r[0] for r in results), min(r[1] for r in results)
+            failed = [case_name(case) for case, r in zip(matrix, results) if not within(r, tolerance)]
+            ok &= not failed
+            print(f"{name:<24} {worst_abs:>8} {worst_psnr:>10.2f} {limit:>14}  " + verdict(failed, len(matrix)))
+
+        checks = latent_checks(model, matrix, ws, tmp / f"latents-{label}", generator)
+        if golden and f'{label}.ws' in golden:
+            checks['golden'] = [case_name(case) for case, w, w_golden in zip(matrix, record[f'{label}.ws'], golden[f'{label}.ws'])
+                                if w.tobytes() != w_golden.tobytes()]
+        print(f"{'latents':<24} {'bit-exact':>34}  result")
+        for name, failed in checks.items():
+            ok &= not failed
+            print(f"{name:<24} {'':>34}  " + verdict(failed, len(matrix)))
+    return ok
+
+def csv(cast):
+    return lambda value: [cast(item) for item in value.split(',') if item]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model', type=csv(Path), help="checkpoint pickles to check instead of the synthetic generators")
+    parser.add_argument('--architectures', type=csv(str), default=list(ARCHITECTURES))
+    parser.add_argument('--resolution', type=int, default=64)
+    parser.add_argument('--channel-base', type=int, default=4096)
+    parser.add_argument('--channel-max', type=int, default=128)
+    parser.add_argument('--batch-size', type=int, default=4, help="batch size of the generator-batched path")
+    parser.add_argument('--paths', type=csv(str), default=DEFAULT_PATHS, help=f"any of {', '.join(PATHS)}")
+    parser.add_argument('--record', type=Path, help="write the reference renders and latents to this .npz")
+    parser.add_argument('--golden', type=Path, help="compare the reference renders and latents against this .npz")
+    args = parser.parse_args()
+    unknown = [name for name in args.paths if name not in PATHS]
+    if unknown:
+        parser.error(f"unknown paths: {', '.join(unknown)}")
+
+    golden = dict(np.load(args.golden)) if args.golden else {}
+    record = {}
+    ok = True
+    with tempfile.TemporaryDirectory(prefix='gan-golden-') as tmp:
+        tmp = Path(tmp)
+        for label, path in models(args, tmp / 'models'):
+            ok &= check_model(label, path, args, tmp, golden, record)
+    if args.record:
+        record['config'] = np.array(json.dumps({'seeds': SEEDS, 'psis': PSIS, 'mixes': MIXES, 'torch': torch.__version__}))
+        np.savez_compressed(args.record, **record)
+        print(f"\nReference renders written to {args.record}")
+    if not ok:
+        print("\nOutputs differ beyond tolerance")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
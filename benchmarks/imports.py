@@ -0,0 +1,75 @@
+"""Import time of the extension modules, from `python -X importtime`, with a load-time regression check.
+
+Run from the extension root:  python -m benchmarks.imports [--check] [--budget-ms 50]
+
+Each target is imported in a fresh interpreter after the --preload modules, which the WebUI has
+imported anyway by the time it loads extensions, so only the extension's own cost is counted.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+TARGETS = ('lib_gan_extension', 'lib_gan_extension.gan_generator', 'lib_gan_extension.api')
+PRELOAD = ('torch', 'numpy', 'PIL.Image', 'PIL.PngImagePlugin', 'fastapi', 'pydantic')
+# deferred until a model is loaded; importing any of these at extension load is a regression
+DEFERRED = ('dnnlib', 'torch_utils', 'requests', 'torch.utils.cpp_extension')
+
+def import_times(target: str, preload: tuple[str, ...]) -> dict[str, (int, int)]:
+    """{module: (self us, cumulative us)} of the modules newly imported by target."""
+    code = "".join(f"import {module}\n" for module in preload) + "import sys; sys.stderr.write('--\\n')\n" + f"import {target}\n"
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {target} failed:\n{proc.stderr[-2000:]}")
+    times = {}
+    for line in proc.stderr.split('--\n', 1)[-1].splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+def run(targets: tuple[str, ...], preload: tuple[str, ...], repeat: int) -> list[dict]:
+    results = []
+    for target in targets:
+        runs = [import_times(target, preload) for _ in range(repeat)]
+        totals = [times[target][1] for times in runs]
+        best = runs[totals.index(min(totals))]
+        results.append({
+            'target': target,
+            'median_ms': statistics.median(totals) / 1000,
+            'min_ms': min(totals) / 1000,
+            'top': sorted(best.items(), key=lambda kv: kv[1][0], reverse=True),
+            'deferred': [name for name in DEFERRED if name in best],
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', action='append', help="module to import, may be repeated (default: the extension entry points)")
+    parser.add_argument('--preload', default=','.join(PRELOAD), help="comma separated modules imported first, '' for a cold start")
+    parser.add_argument('--repeat', type=int, default=5, help="interpreters started per target")
+    parser.add_argument('--top', type=int, default=10, help="modules listed per target, by self time")
+    parser.add_argument('--check', action='store_true', help="exit with an error if a deferred module is imported or a target exceeds the budget")
+    parser.add_argument('--budget-ms', type=float, default=50.0, help="import time budget per target for --check (median)")
+    args = parser.parse_args()
+
+    preload = tuple(module for module in args.preload.split(',') if module)
+    failures = []
+    for r in run(tuple(args.target or TARGETS), preload, args.repeat):
+        print(f"{r['target']}: median {r['median_ms']:.1f} ms, min {r['min_ms']:.1f} ms")
+        print(f"  {'self ms':>8} {'cumul ms':>9}  module")
+        for name, (own, cumulative) in r['top'][:args.top]:
+            print(f"  {own / 1000:>8.1f} {cumulative / 1000:>9.1f}  {name}")
+        if r['deferred']:
+            failures.append(f"{r['target']} imports {', '.join(r['deferred'])}")
+        if r['median_ms'] > args.budget_ms:
+            failures.append(f"{r['target']} takes {r['median_ms']:.1f} ms, budget {args.budget_ms:.0f} ms")
+
+    if args.check:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
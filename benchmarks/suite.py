@@ -0,0 +1,181 @@
+"""Offline benchmark suite: torch_utils ops and GanGenerator paths on synthetic StyleGAN2/3 generators.
+
+Run from the extension root:
+    python -m benchmarks.suite run [--device cpu] [--resolutions 64,256] [--output baseline.json]
+    python -m benchmarks.suite compare baseline.json new.json [--threshold 0.15]
+    python -m benchmarks.suite run --output new.json --baseline baseline.json
+
+No checkpoints are needed: the generators come from benchmarks.synthetic with random weights,
+pickled into a temporary models folder so GanGenerator loads them like real ones. Every result
+is the median of --repeat timings; compare flags results whose median grew beyond the threshold.
+"""
+from __future__ import annotations
+import argparse
+import itertools
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import torch
+
+from benchmarks import synthetic
+from torch_utils.ops import bias_act, conv2d_resample, filtered_lrelu, upfirdn2d
+
+SCHEMA = 1
+ARCHITECTURES = ('stylegan2', 'stylegan3')
+
+def measure(fn, repeat: int, device: str, warmup: int=1) -> dict:
+    """Median and min milliseconds of fn() over repeat calls, synchronizing cuda around each."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        if device.startswith('cuda'):
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        fn()
+        if device.startswith('cuda'):
+            torch.cuda.synchronize(device)
+        times.append((time.perf_counter() - start) * 1000)
+    return {'median_ms': statistics.median(times), 'min_ms': min(times), 'repeat': repeat}
+
+def op_cases(device: str, size: int, channels: int, batch: int) -> dict:
+    """The ops at one feature map size, shaped like a synthesis layer of that resolution."""
+    x = torch.randn([batch, channels, size, size], device=device)
+    b = torch.randn([channels], device=device)
+    f = upfirdn2d.setup_filter([1, 3, 3, 1], device=device)
+    w = torch.randn([channels, channels, 3, 3], device=device)
+    return {
+        f'upfirdn2d.upsample2d/{size}': lambda: upfirdn2d.upsample2d(x, f),
+        f'upfirdn2d.filter2d/{size}': lambda: upfirdn2d.filter2d(x, f),
+        f'bias_act.lrelu/{size}': lambda: bias_act.bias_act(x, b, act='lrelu'),
+        f'filtered_lrelu.critical/{size}': lambda: filtered_lrelu.filtered_lrelu(x, f, f, b, up=2, down=2, padding=3),
+        f'filtered_lrelu.up/{size}': lambda: filtered_lrelu.filtered_lrelu(x, f, f, b, up=2, down=1, padding=3),
+        f'conv2d_resample.conv3x3/{size}': lambda: conv2d_resample.conv2d_resample(x, w, padding=1),
+        f'conv2d_resample.up2/{size}': lambda: conv2d_resample.conv2d_resample(x, w, f=f, up=2, padding=1),
+    }
+
+def run_ops(args) -> dict:
+    results = {}
+    for size in args.op_sizes:
+        channels = min(args.channel_base // size, args.channel_max)
+        with torch.no_grad():
+            for name, fn in op_cases(args.device, size, channels, args.batch_size).items():
+                results[f'op/{name}'] = measure(fn, args.repeat, args.device)
+    return results
+
+def run_generator(args, models: Path, outputs: Path) -> dict:
+    from lib_gan_extension import GanGenerator, global_state
+
+    global_state.device = args.device
+    global_state.batch_size = args.batch_size
+    generator = GanGenerator(outputs)
+    seeds = itertools.count(1000) # fresh seeds, so nothing but cache_hit is served from disk
+    results = {}
+    for architecture, resolution in itertools.product(args.architectures, args.resolutions):
+        G = synthetic.build(architecture, resolution, channel_base=args.channel_base, channel_max=args.channel_max)
+        path = synthetic.save(G, models / f"{architecture}-{resolution}.pkl")
+        key = f'{architecture}/{resolution}'
+        with torch.no_grad():
+            results[f'load/{key}'] = measure(lambda: (setattr(generator, 'model_name', None), generator.set_model(str(path))),
+                                              max(1, args.repeat // 3), args.device, warmup=0)
+            results[f'single/{key}'] = measure(lambda: generator.generate_image(next(seeds), 0.7), args.repeat, args.device)
+            results[f'mix/{key}'] = measure(lambda: generator.generate_image_mix(next(seeds), 0.7, next(seeds), 0.7, 'coarse (0xFF00)', 0.5, 1.0, None, None),
+                                             args.repeat, args.device)
+            results[f'batch{args.batch_size}/{key}'] = measure(lambda: generator.generate_base_images([next(seeds) for _ in range(args.batch_size)], 0.7),
+                                                               args.repeat, args.device)
+            results[f'cache_hit/{key}'] = measure(lambda: generator.generate_image(1, 0.7), args.repeat, args.device)
+    return results
+
+def environment(args) -> dict:
+    return {
+        'schema': SCHEMA,
+        'python': platform.python_version(),
+        'torch': torch.__version__,
+        'platform': platform.platform(),
+        'device': args.device if not args.device.startswith('cuda') else torch.cuda.get_device_name(args.device),
+        'threads': torch.get_num_threads(),
+        'config': {key: getattr(args, key) for key in ('architectures', 'resolutions', 'op_sizes', 'channel_base', 'channel_max', 'batch_size', 'repeat')},
+    }
+
+def run(args) -> dict:
+    results = {}
+    if not args.skip_ops:
+        results.update(run_ops(args))
+    if not args.skip_generator:
+        with tempfile.TemporaryDirectory(prefix='gan-bench-') as tmp:
+            results.update(run_generator(args, Path(tmp) / 'models', Path(tmp) / 'outputs'))
+    return {'environment': environment(args), 'results': results}
+
+def compare(base: dict, new: dict, threshold: float) -> list[str]:
+    """Print a comparison table and return the names of the regressed results."""
+    if base['environment'].get('config') != new['environment'].get('config'):
+        print("warning: the runs used different configurations")
+    if (base['environment'].get('device'), base['environment'].get('torch')) != (new['environment'].get('device'), new['environment'].get('torch')):
+        print("warning: the runs used different devices or torch versions")
+    regressions = []
+    print(f"{'benchmark':<44} {'base ms':>10} {'new ms':>10} {'change':>8}")
+    for name in sorted(set(base['results']) | set(new['results'])):
+        old, cur = base['results'].get(name), new['results'].get(name)
+        if old is None or cur is None:
+            print(f"{name:<44} {'-' if old is None else format(old['median_ms'], '.2f'):>10} {'-' if cur is None else format(cur['median_ms'], '.2f'):>10}")
+            continue
+        change = cur['median_ms'] / old['median_ms'] - 1 if old['median_ms'] > 0 else 0.0
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<44} {old['median_ms']:>10.2f} {cur['median_ms']:>10.2f} {change:>+8.1%}{flag}")
+    return regressions
+
+def csv(cast):
+    return lambda value: [cast(item) for item in value.split(',') if item]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="run the benchmarks and write a JSON result")
+    run_parser.add_argument('--device', default='cpu')
+    run_parser.add_argument('--architectures', type=csv(str), default=list(ARCHITECTURES))
+    run_parser.add_argument('--resolutions', type=csv(int), default=[64, 256])
+    run_parser.add_argument('--op-sizes', type=csv(int), default=[32, 128], help="feature map sizes of the op benchmarks")
+    run_parser.add_argument('--channel-base', type=int, default=4096, help="32768 for the real network widths")
+    run_parser.add_argument('--channel-max', type=int, default=128, help="512 for the real network widths")
+    run_parser.add_argument('--batch-size', type=int, default=4)
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('--skip-ops', action='store_true')
+    run_parser.add_argument('--skip-generator', action='store_true')
+    run_parser.add_argument('--output', type=Path, help="JSON file to write, e.g. benchmarks/baseline.json")
+    run_parser.add_argument('--baseline', type=Path, help="compare against this result when done")
+    run_parser.add_argument('--threshold', type=float, default=0.15, help="relative slowdown counted as a regression")
+
+    compare_parser = commands.add_parser('compare', help="compare two JSON results")
+    compare_parser.add_argument('base', type=Path)
+    compare_parser.add_argument('new', type=Path)
+    compare_parser.add_argument('--threshold', type=float, default=0.15)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        result = run(args)
+        if args.output:
+            args.output.write_text(json.dumps(result, indent=1))
+        if not args.baseline:
+            for name, r in result['results'].items():
+                print(f"{name:<44} {r['median_ms']:>10.2f} ms")
+            return
+        base, new = json.loads(args.baseline.read_text()), result
+    else:
+        base, new = json.loads(args.base.read_text()), json.loads(args.new.read_text())
+
+    regressions = compare(base, new, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""Randomly initialized StyleGAN2- and StyleGAN3-shaped generators built from torch_utils.ops.
+
+The layer structure, style counts (num_ws) and ops follow NVlabs' networks closely enough for
+timing: modulated/demodulated convolutions through conv2d_resample, bias_act activations and
+upfirdn2d skip upsampling (StyleGAN2), Fourier feature input and filtered_lrelu layers
+(StyleGAN3). The attribute layout (b<res> blocks, layer_names) matches too, for code that walks
+the synthesis network, like the previews. Weights are random, so the images are noise. channel_base/channel_max shrink the
+networks for cpu-only machines.
+"""
+from __future__ import annotations
+import math
+import pickle
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from torch_utils.ops import bias_act, conv2d_resample, filtered_lrelu, upfirdn2d
+
+def modulated_conv2d(x, weight, styles, up=1, padding=0, resample_filter=None, demodulate=True):
+    """Grouped (fused) modulated convolution, one group per sample."""
+    batch_size = x.shape[0]
+    out_channels, in_channels, kh, kw = weight.shape
+    w = weight.unsqueeze(0) * styles.reshape(batch_size, 1, -1, 1, 1)
+    if demodulate:
+        w = w * (w.square().sum(dim=[2, 3, 4]) + 1e-8).rsqrt().reshape(batch_size, -1, 1, 1, 1)
+    x = x.reshape(1, -1, *x.shape[2:])
+    w = w.reshape(-1, in_channels, kh, kw)
+    x = conv2d_resample.conv2d_resample(x=x, w=w, f=resample_filter, up=up, padding=padding, groups=batch_size, flip_weight=(up == 1))
+    return x.reshape(batch_size, -1, *x.shape[2:])
+
+class FullyConnectedLayer(nn.Module):
+    def __init__(self, in_features, out_features, activation='linear', lr_multiplier=1, bias_init=0):
+        super().__init__()
+        self.activation = activation
+        self.weight = nn.Parameter(torch.randn([out_features, in_features]) / lr_multiplier)
+        self.bias = nn.Parameter(torch.full([out_features], float(bias_init)))
+        self.weight_gain = lr_multiplier / np.sqrt(in_features)
+        self.bias_gain = lr_multiplier
+
+    def forward(self, x):
+        w = self.weight.to(x.dtype) * self.weight_gain
+        b = self.bias.to(x.dtype) * self.bias_gain
+        if self.activation == 'linear':
+            return torch.addmm(b.unsqueeze(0), x, w.t())
+        return bias_act.bias_act(x.matmul(w.t()), b, act=self.activation)
+
+class MappingNetwork(nn.Module):
+    def __init__(self, z_dim, w_dim, num_ws, num_layers=8):
+        super().__init__()
+        self.z_dim = z_dim
+        self.c_dim = 0
+        self.w_dim = w_dim
+        self.num_ws = num_ws
+        self.fcs = nn.ModuleList([FullyConnectedLayer(z_dim if i == 0 else w_dim, w_dim, activation='lrelu', lr_multiplier=0.01)
+                                  for i in range(num_layers)])
+        self.register_buffer('w_avg', torch.zeros([w_dim]))
+
+    def forward(self, z, c, truncation_psi=1, truncation_cutoff=None, update_emas=False):
+        x = z * (z.square().mean(dim=1, keepdim=True) + 1e-8).rsqrt()
+        for fc in self.fcs:
+            x = fc(x)
+        x = x.unsqueeze(1).repeat([1, self.num_ws, 1])
+        if truncation_psi != 1:
+            x = self.w_avg.lerp(x, truncation_psi)
+        return x
+
+#----------------------------------------------------------------------------
+# StyleGAN2
+
+class SynthesisLayer2(nn.Module):
+    def __init__(self, in_channels, out_channels, w_dim, resolution, up=1, kernel_size=3):
+        super().__init__()
+        self.up = up
+        self.padding = kernel_size // 2
+        self.affine = FullyConnectedLayer(w_dim, in_channels, bias_init=1)
+        self.weight = nn.Parameter(torch.randn([out_channels, in_channels, kernel_size, kernel_size]))
+        self.bias = nn.Parameter(torch.zeros([out_channels]))
+        self.register_buffer('resample_filter', upfirdn2d.setup_filter([1, 3, 3, 1]))
+        self.register_buffer('noise_const', torch.randn([resolution, resolution]))
+        self.noise_strength = nn.Parameter(torch.zeros([]))
+
+    def forward(self, x, w, noise_mode='const', force_fp32=False):
+        styles = self.affine(w)
+        x = modulated_conv2d(x, self.weight, styles, up=self.up, padding=self.padding, resample_filter=self.resample_filter)
+        if noise_mode == 'const':
+            x = x.add_(self.noise_const * self.noise_strength)
+        return bias_act.bias_act(x, self.bias.to(x.dtype), act='lrelu', clamp=256)
+
+class ToRGBLayer(nn.Module):
+    def __init__(self, in_channels, out_channels, w_dim):
+        super().__init__()
+        self.affine = FullyConnectedLayer(w_dim, in_channels, bias_init=1)
+        self.weight = nn.Parameter(torch.randn([out_channels, in_channels, 1, 1]))
+        self.bias = nn.Parameter(torch.zeros([out_channels]))
+        self.weight_gain = 1 / np.sqrt(in_channels)
+
+    def forward(self, x, w):
+        styles = self.affine(w) * self.weight_gain
+        x = modulated_conv2d(x, self.weight, styles, demodulate=False)
+        return bias_act.bias_act(x, self.bias.to(x.dtype), clamp=256)
+
+class SynthesisBlock2(nn.Module):
+    def __init__(self, in_channels, out_channels, w_dim, resolution, img_channels):
+        super().__init__()
+        self.in_channels = in_channels
+        self.resolution = resolution
+        self.architecture = 'skip'
+        self.register_buffer('resample_filter', upfirdn2d.setup_filter([1, 3, 3, 1]))
+        if in_channels == 0:
+            self.const = nn.Parameter(torch.randn([out_channels, resolution, resolution]))
+        else:
+            self.conv0 = SynthesisLayer2(in_channels, out_channels, w_dim, resolution, up=2)
+        self.conv1 = SynthesisLayer2(out_channels, out_channels, w_dim, resolution)
+        self.torgb = ToRGBLayer(out_channels, img_channels, w_dim)
+        self.num_conv = 1 if in_channels == 0 else 2
+        self.num_torgb = 1
+
+    def forward(self, x, img, ws, force_fp32=False, noise_mode='const'):
+        w_iter = iter(ws.unbind(dim=1))
+        if self.in_channels == 0:
+            x = self.const.unsqueeze(0).repeat([ws.shape[0], 1, 1, 1])
+        else:
+            x = self.conv0(x, next(w_iter), noise_mode)
+        x = self.conv1(x, next(w_iter), noise_mode)
+        if img is not None:
+            img = upfirdn2d.upsample2d(img, self.resample_filter)
+        y = self.torgb(x, next(w_iter))
+        img = img.add_(y) if img is not None else y
+        return x, img
+
+class SynthesisNetwork2(nn.Module):
+    def __init__(self, w_dim, img_resolution, img_channels=3, channel_base=32768, channel_max=512):
+        super().__init__()
+        self.w_dim = w_dim
+        self.img_resolution = img_resolution
+        self.block_resolutions = [2 ** i for i in range(2, int(math.log2(img_resolution)) + 1)]
+        channels = {res: min(channel_base // res, channel_max) for res in self.block_resolutions}
+        self.num_ws = 0
+        for res in self.block_resolutions:
+            block = SynthesisBlock2(channels[res // 2] if res > 4 else 0, channels[res], w_dim, res, img_channels)
+            setattr(self, f'b{res}', block)
+            self.num_ws += block.num_conv
+        self.num_ws += block.num_torgb
+
+    def forward(self, ws, noise_mode='const', force_fp32=False):
+        x = img = None
+        w_idx = 0
+        for res in self.block_resolutions:
+            block = getattr(self, f'b{res}')
+            x, img = block(x, img, ws.narrow(1, w_idx, block.num_conv + block.num_torgb), force_fp32=force_fp32, noise_mode=noise_mode)
+            w_idx += block.num_conv
+        return img
+
+#----------------------------------------------------------------------------
+# StyleGAN3
+
+class SynthesisInput(nn.Module):
+    def __init__(self, w_dim, channels, size, bandwidth=2):
+        super().__init__()
+        self.size = size
+        freqs = torch.randn([channels, 2])
+        freqs /= freqs.square().sum(dim=1, keepdim=True).sqrt() * freqs.square().sum(dim=1, keepdim=True).exp().pow(0.25)
+        self.register_buffer('freqs', freqs * bandwidth)
+        self.register_buffer('phases', torch.rand([channels]) - 0.5)
+        self.affine = FullyConnectedLayer(w_dim, 4, bias_init=0)
+        self.weight = nn.Parameter(torch.randn([channels, channels]))
+
+    def forward(self, w):
+        t = self.affine(w) # rotation and translation of the Fourier features
+        t = t / t[:, :2].norm(dim=1, keepdim=True).clamp(min=1e-8)
+        rotation = torch.stack([torch.stack([t[:, 0], -t[:, 1]], dim=1), torch.stack([t[:, 1], t[:, 0]], dim=1)], dim=1)
+        freqs = self.freqs.unsqueeze(0) @ rotation # [N, C, 2]
+        phases = self.phases.unsqueeze(0) + (freqs @ t[:, 2:].unsqueeze(2)).squeeze(2)
+        grid = torch.stack(torch.meshgrid(*[torch.linspace(-0.5, 0.5, self.size, device=w.device)] * 2, indexing='ij'), dim=2)
+        x = (grid.reshape(1, -1, 2) @ freqs.transpose(1, 2)) + phases.unsqueeze(1) # [N, H*W, C]
+        x = torch.sin(x * (2 * np.pi)) @ (self.weight / np.sqrt(self.weight.shape[1])).t()
+        return x.transpose(1, 2).reshape(w.shape[0], -1, self.size, self.size)
+
+class SynthesisLayer3(nn.Module):
+    def __init__(self, in_channels, out_channels, w_dim, in_size, out_size, kernel_size=3, is_torgb=False):
+        super().__init__()
+        self.is_torgb = is_torgb
+        self.out_sampling_rate = out_size # no margins, the whole feature map is image content
+        self.padding = kernel_size // 2
+        self.affine = FullyConnectedLayer(w_dim, in_channels, bias_init=1)
+        self.weight = nn.Parameter(torch.randn([out_channels, in_channels, kernel_size, kernel_size]))
+        self.bias = nn.Parameter(torch.zeros([out_channels]))
+        # critically sampled layers run the nonlinearity at 2x and come back down, growing ones only go up
+        self.up = 2
+        self.down = 1 if out_size > in_size else 2
+        taps = [1, 3, 3, 1]
+        self.register_buffer('up_filter', upfirdn2d.setup_filter(taps))
+        self.register_buffer('down_filter', upfirdn2d.setup_filter(taps))
+        pad = out_size * self.down + 2 * (len(taps) - 1) - in_size * self.up
+        self.filter_padding = [pad // 2, pad - pad // 2] * 2
+
+    def forward(self, x, w, noise_mode='const', force_fp32=False):
+        styles = self.affine(w)
+        x = modulated_conv2d(x, self.weight, styles, padding=self.padding, demodulate=not self.is_torgb)
+        if self.is_torgb:
+            return bias_act.bias_act(x, self.bias.to(x.dtype), clamp=256)
+        return filtered_lrelu.filtered_lrelu(x, self.up_filter, self.down_filter, self.bias.to(x.dtype),
+                                             up=self.up, down=self.down, padding=self.filter_padding, clamp=256)
+
+class SynthesisNetwork3(nn.Module):
+    def __init__(self, w_dim, img_resolution, img_channels=3, channel_base=32768, channel_max=512, num_layers=14, input_size=16):
+        super().__init__()
+        self.w_dim = w_dim
+        self.img_resolution = img_resolution
+        self.num_ws = num_layers + 2
+        growth = math.log2(img_resolution / input_size)
+        sizes = [input_size] + [int(input_size * 2 ** round(growth * min(i / (num_layers - 2), 1))) for i in range(num_layers)]
+        channels = [min(channel_base // (2 * size), channel_max) for size in sizes]
+        self.input = SynthesisInput(w_dim, channels[0], input_size)
+        self.layer_names = []
+        for i in range(num_layers + 1):
+            if i < num_layers:
+                layer = SynthesisLayer3(channels[i], channels[i + 1], w_dim, sizes[i], sizes[i + 1])
+            else:
+                layer = SynthesisLayer3(channels[-1], img_channels, w_dim, sizes[-1], sizes[-1], kernel_size=1, is_torgb=True)
+            name = f'L{i}_{sizes[min(i + 1, num_layers)]}_{channels[i + 1] if i < num_layers else img_channels}'
+            setattr(self, name, layer)
+            self.layer_names.append(name)
+
+    def forward(self, ws, noise_mode='const', force_fp32=False):
+        ws = ws.unbind(dim=1)
+        x = self.input(ws[0])
+        for name, w in zip(self.layer_names, ws[1:]):
+            x = getattr(self, name)(x, w, noise_mode=noise_mode, force_fp32=force_fp32)
+        return x
+
+#----------------------------------------------------------------------------
+
+class Generator(nn.Module):
+    def __init__(self, architecture, img_resolution, z_dim=512, w_dim=512, img_channels=3, channel_base=32768, channel_max=512):
+        super().__init__()
+        self.architecture = architecture
+        self.z_dim = z_dim
+        self.c_dim = 0
+        self.w_dim = w_dim
+        self.img_resolution = img_resolution
+        self.img_channels = img_channels
+        network = {'stylegan2': SynthesisNetwork2, 'stylegan3': SynthesisNetwork3}[architecture]
+        self.synthesis = network(w_dim, img_resolution, img_channels, channel_base=channel_base, channel_max=channel_max)
+        self.mapping = MappingNetwork(z_dim, w_dim, self.synthesis.num_ws)
+
+    def forward(self, z, c, truncation_psi=1, noise_mode='const'):
+        return self.synthesis(self.mapping(z, c, truncation_psi), noise_mode)
+
+def build(architecture: str, resolution: int, channel_base: int=32768, channel_max: int=512, w_dim: int=512, seed: int=0) -> Generator:
+    torch.manual_seed(seed)
+    G = Generator(architecture, resolution, z_dim=w_dim, w_dim=w_dim, channel_base=channel_base, channel_max=channel_max).eval()
+    with torch.no_grad(): # a plausible w_avg, so truncation has something to pull towards
+        G.mapping.w_avg.copy_(G.mapping(torch.randn([256, w_dim]), None)[:, 0].mean(dim=0))
+    return G
+
+def save(G: Generator, path: Path) -> Path:
+    """Write G as a checkpoint pickle the extension can load ({'G_ema': G})."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'wb') as f:
+        pickle.dump({'G_ema': G}, f)
+    return path
@@ -4,7 +4,22 @@ from . import str_utils
 from . import metadata
 
 from .global_state import logger
-from .gan_model import GanModel
-from .gan_generator import GanGenerator
 
-from . import ui
\ No newline at end of file
+# The model classes pull in the network code (and with it dnnlib and torch_utils), so they are only
+# imported when first used: loading the extension with the WebUI should not pay for a tab never opened.
+_LAZY = {
+    'MixEngine': '.mix_engine',
+    'GanModel': '.gan_model',
+    'GanGenerator': '.gan_generator',
+}
+
+def __getattr__(name: str):
+    if name in _LAZY:
+        import importlib
+        value = getattr(importlib.import_module(_LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY))
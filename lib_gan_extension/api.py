@@ -0,0 +1,381 @@
+from __future__ import annotations
+from typing import Union, List, Optional, Literal
+import uuid
+
+import torch
+from fastapi import APIRouter, FastAPI, HTTPException
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
+
+from lib_gan_extension import global_state, str_utils, metadata, profiling, metrics, seed_bank
+from .gan_generator import GanGenerator
+from .scheduler import INTERACTIVE, PRIORITIES
+from .model_catalog import ModelCatalog
+from .global_state import logger
+from .timing import stage
+
+# Local HTTP API, mounted on the webui's FastAPI app:
+#   POST /gan-generator/v1/generate     one seed or w            -> image/png | latent
+#   POST /gan-generator/v1/mix          two seeds or ws          -> image/png | latent
+#   POST /gan-generator/v1/batch        many seeds or ws         -> multipart/mixed stream | latent
+#   POST /gan-generator/v1/interpolate  sweep between two parents -> multipart/mixed stream | latent
+#   POST /gan-generator/v1/preview      many seeds, low resolution -> multipart/mixed stream
+#   POST /gan-generator/v1/similar      one seed or w            -> nearest seeds of the seed bank (json)
+#   GET  /gan-generator/v1/models       checkpoints with their cached metadata
+#   GET  /gan-generator/v1/scheduler    queue wait and service time statistics
+#   GET  /gan-generator/v1/metrics      counters, histograms and gauges in the Prometheus text format
+# Latents in requests are either str_utils codec strings ("GW1:...") or nested float arrays
+# ([w_dim], [num_ws, w_dim] or [1, num_ws, w_dim]); latent responses use the binary codec.
+API_PREFIX = '/gan-generator/v1'
+PNG_TYPE = 'image/png'
+LATENT_TYPE = 'application/octet-stream'
+
+Latent = Union[str, List[float], List[List[float]], List[List[List[float]]]]
+
+class GenerateRequest(BaseModel):
+    model: str
+    seed: Optional[int] = Field(None, description="-1 for a random seed, ignored when w is given")
+    psi: float = 0.7
+    w: Optional[Latent] = None
+    format: Literal['png', 'latent'] = 'png'
+    profile: bool = Field(False, description="capture a torch.profiler trace into the profiles output folder")
+
+class MixRequest(BaseModel):
+    model: str
+    seed1: Optional[int] = None
+    seed2: Optional[int] = None
+    psi1: float = 0.7
+    psi2: float = 0.7
+    w1: Optional[Latent] = None
+    w2: Optional[Latent] = None
+    mask: Union[str, int] = 'total'
+    mix: float = 0.0
+    format: Literal['png', 'latent'] = 'png'
+    profile: bool = Field(False, description="capture a torch.profiler trace into the profiles output folder")
+
+class BatchRequest(BaseModel):
+    model: str
+    seeds: Union[str, List[int]] = Field([], description="list of seeds or a str2seeds string like '1-10, 0x20'")
+    ws: List[Latent] = []
+    psi: float = 0.7
+    batch_size: Optional[int] = Field(None, description="images per streamed batch, defaults to the batch size setting")
+    format: Literal['multipart', 'latent'] = 'multipart'
+    profile: bool = Field(False, description="capture a torch.profiler trace into the profiles output folder")
+
+class PreviewRequest(BaseModel):
+    model: str
+    seeds: Union[str, List[int]] = Field(..., description="list of seeds or a str2seeds string like '1-10, 0x20'")
+    psi: float = 0.7
+    size: Optional[int] = Field(None, ge=16, le=1024, description="preview size in pixels, defaults to the preview size setting")
+    batch_size: Optional[int] = None
+    profile: bool = Field(False, description="capture a torch.profiler trace into the profiles output folder")
+
+class SimilarRequest(BaseModel):
+    model: str
+    seed: Optional[int] = Field(None, description="ignored when w is given")
+    w: Optional[Latent] = None
+    psi: float = Field(0.7, description="truncation of the query seed and of the seeds found")
+    k: int = Field(10, ge=1, le=1000)
+    mask: Union[str, int] = Field('total', description="layers compared, like the mix masks")
+    nprobe: int = Field(seed_bank.NPROBE, ge=1, description="index lists searched, more is slower and more accurate")
+    exact: bool = Field(False, description="scan the whole bank instead of using the index")
+
+class InterpolateRequest(BaseModel):
+    model: str
+    seed1: Optional[int] = None
+    seed2: Optional[int] = None
+    psi: float = 0.7
+    w1: Optional[Latent] = None
+    w2: Optional[Latent] = None
+    mask: Union[str, int] = 'total'
+    steps: int = Field(8, ge=2, le=1024)
+    batch_size: Optional[int] = None
+    format: Literal['multipart', 'latent'] = 'multipart'
+    profile: bool = Field(False, description="capture a torch.profiler trace into the profiles output folder")
+
+def parse_latent(value: Latent, generator: GanGenerator) -> torch.Tensor:
+    """A request latent as a [1, num_ws, w_dim] tensor on the generator's device."""
+    try:
+        w = str_utils.str2tensor(value) if isinstance(value, str) else torch.tensor(value, dtype=torch.float32)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid latent: {e}")
+    num_ws, w_dim = generator.GAN.num_ws, generator.GAN.w_dim
+    if w.shape[-1] != w_dim or w.numel() not in (w_dim, num_ws * w_dim):
+        raise HTTPException(status_code=422, detail=f"Latent of shape {list(w.shape)} does not fit {num_ws}x{w_dim}")
+    return w.reshape(1, -1, w_dim).expand(1, num_ws, w_dim).contiguous().to(generator.device)
+
+def request_seed(seed: Union[int, None]) -> int:
+    """A request seed, where None and -1 stand for a random one."""
+    if seed is None or seed == -1:
+        return GanGenerator.newSeed()
+    if not 0 <= seed <= 0xFFFFFFFF:
+        raise HTTPException(status_code=422, detail=f"Seed {seed} is not between 0 and {0xFFFFFFFF}, or -1 for a random one")
+    return seed
+
+def parent_latent(generator: GanGenerator, seed: Union[int, None], psi: float, w: Union[Latent, None]) -> torch.Tensor:
+    """The latent of a parent given by w, or by a seed resolved with request_seed."""
+    if w is not None:
+        return parse_latent(w, generator)
+    return generator.GAN.get_w_from_seed(seed, psi)
+
+def seed_list(seeds: Union[str, List[int]]) -> list[int]:
+    if isinstance(seeds, str):
+        try:
+            return str_utils.str2seeds(seeds)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    return list(seeds)
+
+def latent_response(ws: torch.Tensor) -> Response:
+    return Response(content=str_utils.tensor2bytes(ws), media_type=LATENT_TYPE)
+
+def encode_png(generator: GanGenerator, image, params: dict, w: torch.Tensor) -> bytes:
+    """In-memory PNG with the same metadata as a cached file."""
+    with stage('encode'):
+        return metadata.encode_image(image, 'png', generator.image_info(params), {'tensor': w.reshape(1, *w.shape[-2:])})
+
+def cached_png(generator: GanGenerator, filename: str, image, params: dict, w: torch.Tensor) -> bytes:
+    """Serve a freshly cached render as written, unless the cache is configured for another format."""
+    if global_state.image_format == 'png':
+        return generator.read_output_bytes(filename)
+    return encode_png(generator, image, params, w)
+
+def multipart_part(boundary: str, data: bytes, name: str, headers: dict = None) -> bytes:
+    lines = [f'--{boundary}', f'Content-Type: {PNG_TYPE}', f'Content-Disposition: inline; name="{name}"; filename="{name}.png"']
+    lines += [f'{key}: {value}' for key, value in (headers or {}).items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + data + b'\r\n'
+
+def multipart_response(parts) -> StreamingResponse:
+    """Stream (name, png bytes, headers) parts as they are produced, one multipart/mixed body."""
+    boundary = uuid.uuid4().hex
+    def body():
+        for name, data, headers in parts:
+            yield multipart_part(boundary, data, name, headers)
+        yield f'--{boundary}--\r\n'.encode('latin-1')
+    return StreamingResponse(body(), media_type=f'multipart/mixed; boundary={boundary}')
+
+def register_gauges(generator: GanGenerator) -> None:
+    stats = generator.scheduler.stats
+    metrics.registry.gauge('gan_scheduler_waiting', "Requests waiting for the renderer", ['priority'],
+                           lambda: {(name,): stats()[name]['waiting'] for name in PRIORITIES})
+    metrics.registry.gauge('gan_scheduler_wait_seconds_max', "Longest queue wait so far", ['priority'],
+                           lambda: {(name,): stats()[name]['wait_max'] for name in PRIORITIES})
+    metrics.registry.gauge('gan_bulk_batch_size', "Batch size bulk streams use next", [],
+                           lambda: {(): stats()['bulk_batch_size']})
+    metrics.registry.gauge('gan_model_loaded', "The model in memory", ['model'],
+                           lambda: {(generator.model_name,): 1} if generator.GAN is not None else {})
+    metrics.registry.gauge('gan_cache_bytes', "Estimated size of the image cache, known once a budget is set", [],
+                           lambda: {(): generator.cache.size})
+
+def create_router(generator: GanGenerator) -> APIRouter:
+    router = APIRouter(prefix=API_PREFIX, tags=['GAN Generator'])
+    register_gauges(generator)
+
+    def load(model: str) -> None:
+        try:
+            generator.set_model(model)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail=f"Model not found: {model}")
+
+    def profiled(label: str, req):
+        return profiling.render(generator.profile_path(), label, force=req.profile)
+
+    @router.post('/generate')
+    def generate(req: GenerateRequest):
+        with generator.scheduler.slot(INTERACTIVE), profiled('api-generate', req):
+            load(req.model)
+            if req.w is not None:
+                w = parse_latent(req.w, generator)
+                if req.format == 'latent':
+                    return latent_response(w)
+                params = {'seed': f"V{str_utils.latent_hash(w)}", 'psi': req.psi}
+                img, _ = generator.generate_base_image(None, req.psi, w)
+                return Response(content=encode_png(generator, img, params, w), media_type=PNG_TYPE)
+
+            seed = request_seed(req.seed)
+            if req.format == 'latent':
+                return latent_response(generator.GAN.get_w_from_seed(seed, req.psi))
+            params = {'seed': seed, 'psi': req.psi}
+            img, w = generator.generate_base_images([seed], req.psi)[seed]
+            data = cached_png(generator, generator.image_path_with_params(params), img, params, w)
+            return Response(content=data, media_type=PNG_TYPE, headers={'X-Seed': str(seed)})
+
+    @router.post('/mix')
+    def mix(req: MixRequest):
+        with generator.scheduler.slot(INTERACTIVE), profiled('api-mix', req):
+            load(req.model)
+            try:
+                mask = generator.GAN.mixer.parse_mask(req.mask)
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=str(e))
+            interp = generator.GAN.mixer.mask_label(mask) # named like the UI names it, so both share cached mixes
+            seed1 = request_seed(req.seed1) if req.w1 is None else None
+            seed2 = request_seed(req.seed2) if req.w2 is None else None
+            w1 = parent_latent(generator, seed1, req.psi1, req.w1)
+            w2 = parent_latent(generator, seed2, req.psi2, req.w2)
+            w = generator.GAN.mixer.mix(w1, w2, req.mix, mask)[0]
+            if req.format == 'latent':
+                return latent_response(w)
+            headers = {f'X-Seed{i}': str(seed) for i, seed in ((1, seed1), (2, seed2)) if seed is not None}
+            if req.w1 is None and req.w2 is None and req.psi1 == req.psi2 and seed1 != seed2:
+                # seed pairs go through the disk cache like the UI
+                params = {'seed1': seed1, 'seed2': seed2, 'psi1': req.psi1, 'psi2': req.psi2, 'mix': req.mix, 'interp': interp}
+                img, = generator.generate_mixes([(seed1, seed2)], req.psi1, interp, req.mix)
+                data = cached_png(generator, generator.image_path_with_params(params, base="mix"), img, params, w)
+                return Response(content=data, media_type=PNG_TYPE, headers=headers)
+            params = {'seed1': seed1 if req.w1 is None else f"V{str_utils.latent_hash(w1)}",
+                      'seed2': seed2 if req.w2 is None else f"V{str_utils.latent_hash(w2)}",
+                      'psi1': req.psi1, 'psi2': req.psi2, 'mix': req.mix, 'interp': interp}
+            img = generator.GAN.w_to_image(w)
+            return Response(content=encode_png(generator, img, params, w), media_type=PNG_TYPE, headers=headers)
+
+    @router.post('/batch')
+    def batch(req: BatchRequest):
+        seeds = seed_list(req.seeds)
+        if not seeds and not req.ws:
+            raise HTTPException(status_code=422, detail="Nothing to render, give seeds or ws")
+        with generator.scheduler.slot(INTERACTIVE):
+            load(req.model)
+            ws = [parse_latent(w, generator) for w in req.ws]
+            if req.format == 'latent':
+                seed_ws = [generator.GAN.get_w_from_seed(seed, req.psi) for seed in seeds]
+                return latent_response(torch.cat(seed_ws + ws))
+            view = generator.pinned() # the whole stream renders with this model, even if the tab switches
+
+        size = req.batch_size or global_state.batch_size
+
+        def render_seeds(group):
+            with profiled('api-batch', req): # one capture per batch
+                results = view.generate_base_images(group, req.psi)
+                files = []
+                for seed in group:
+                    params = {'seed': seed, 'psi': req.psi}
+                    img, w = results[seed]
+                    files.append(cached_png(view, view.image_path_with_params(params), img, params, w))
+                return files
+
+        def render_ws(group):
+            with profiled('api-batch', req):
+                w = torch.cat([w_i for _, w_i in group]).to(view.device)
+                batch = view.GAN.w_to_batch(w, batch_size=len(group))
+                return [encode_png(view, batch.image(k), {'seed': f"V{str_utils.latent_hash(w_k)}", 'psi': req.psi}, w_k)
+                            for k, w_k in enumerate(w)]
+
+        def parts():
+            # bulk slots are taken per batch, so clicks in the tab go ahead of the rest of the stream
+            for group, files in generator.scheduler.batches(seeds, size, render_seeds):
+                for seed, data in zip(group, files):
+                    yield f"seed-{seed}", data, {'X-Seed': str(seed)}
+            for group, files in generator.scheduler.batches(list(enumerate(ws)), size, render_ws):
+                for (i, _), data in zip(group, files):
+                    yield f"w-{i}", data, {}
+            logger(f"API batch streamed {len(seeds) + len(ws)} images")
+        return multipart_response(parts())
+
+    @router.post('/interpolate')
+    def interpolate(req: InterpolateRequest):
+        with generator.scheduler.slot(INTERACTIVE):
+            load(req.model)
+            try:
+                mask = generator.GAN.mixer.parse_mask(req.mask)
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=str(e))
+            interp = generator.GAN.mixer.mask_label(mask)
+            seed1 = request_seed(req.seed1) if req.w1 is None else None
+            seed2 = request_seed(req.seed2) if req.w2 is None else None
+            w1 = parent_latent(generator, seed1, req.psi, req.w1)
+            w2 = parent_latent(generator, seed2, req.psi, req.w2)
+            ws = generator.GAN.mixer.mix_sweep(w1, w2, req.steps, mask).reshape(req.steps, *w1.shape[-2:])
+            if req.format == 'latent':
+                return latent_response(ws)
+            view = generator.pinned()
+        amounts = torch.linspace(-1.0, 1.0, req.steps).tolist()
+        seed1 = seed1 if req.w1 is None else f"V{str_utils.latent_hash(w1)}"
+        seed2 = seed2 if req.w2 is None else f"V{str_utils.latent_hash(w2)}"
+
+        def render_steps(group):
+            with profiled('api-interpolate', req):
+                batch = view.GAN.w_to_batch(ws[group[0]:group[-1] + 1].to(view.device), batch_size=len(group))
+                return [encode_png(view, batch.image(i), {'seed1': seed1, 'seed2': seed2, 'psi1': req.psi, 'psi2': req.psi,
+                                                          'mix': amounts[k], 'interp': interp}, ws[k])
+                            for i, k in enumerate(group)]
+
+        def parts():
+            steps = list(range(req.steps))
+            for group, files in generator.scheduler.batches(steps, req.batch_size or global_state.batch_size, render_steps):
+                for k, data in zip(group, files):
+                    yield f"step-{k}", data, {'X-Mix': f"{amounts[k]:.6f}"}
+        return multipart_response(parts())
+
+    @router.post('/preview')
+    def preview(req: PreviewRequest):
+        seeds = seed_list(req.seeds)
+        if not seeds:
+            raise HTTPException(status_code=422, detail="Nothing to render, give seeds")
+        size = req.size or global_state.preview_size
+        with generator.scheduler.slot(INTERACTIVE):
+            load(req.model)
+            view = generator.pinned()
+
+        def render_previews(group):
+            with profiled('api-preview', req):
+                results = view.generate_previews(group, req.psi, size)
+                files = []
+                for seed in group:
+                    filename = view.preview_filename(seed, req.psi, size)
+                    if global_state.image_format == 'png':
+                        files.append(view.read_output_bytes(filename))
+                    else:
+                        with stage('encode'):
+                            files.append(metadata.encode_image(results[seed], 'png', view.image_info({'seed': seed, 'psi': req.psi, 'size': size})))
+                return files
+
+        def parts():
+            for group, files in generator.scheduler.batches(seeds, req.batch_size or global_state.batch_size, render_previews):
+                for seed, data in zip(group, files):
+                    yield f"seed-{seed}", data, {'X-Seed': str(seed)}
+        return multipart_response(parts())
+
+    @router.post('/similar')
+    def similar(req: SimilarRequest):
+        with generator.scheduler.slot(INTERACTIVE):
+            load(req.model)
+            try:
+                mask = generator.GAN.mixer.parse_mask(req.mask)
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=str(e))
+            w = parent_latent(generator, request_seed(req.seed) if req.w is None else None, req.psi, req.w)
+            try:
+                results = generator.find_similar_seeds(w, req.psi, req.k, mask, nprobe=req.nprobe, exact=req.exact)
+            except FileNotFoundError as e:
+                raise HTTPException(status_code=404, detail=str(e))
+            except ValueError as e:
+                raise HTTPException(status_code=422, detail=str(e))
+        return {'psi': req.psi, 'seeds': [{'seed': seed, 'distance': distance} for seed, distance in results]}
+
+    @router.get('/models')
+    def models():
+        """Model files, most recently used first, with resolution, num_ws etc. once indexed."""
+        catalog = ModelCatalog.shared()
+        return [{'name': name, 'info': catalog.info(name)} for name in catalog.models()]
+
+    @router.get('/scheduler')
+    def scheduler_stats():
+        """Queue wait and service time per priority class, in seconds."""
+        return generator.scheduler.stats()
+
+    @router.get('/metrics')
+    def metrics_text():
+        """Metrics in the Prometheus text exposition format."""
+        return Response(content=metrics.registry.render(), media_type=metrics.PROMETHEUS_TYPE)
+
+    return router
+
+def on_app_started(demo, app: FastAPI) -> None:
+    app.include_router(create_router(GanGenerator.shared()))
+
+try:
+    from modules import script_callbacks
+    script_callbacks.on_app_started(on_app_started)
+except ImportError: # running outside of the webui, mount create_router() yourself
+    pass
@@ -0,0 +1,282 @@
+"""Headless batch renderer. Writes the same cache layout and metadata as the WebUI tab, without
+importing any webui modules. Run from the extension root, e.g.
+
+    python -m lib_gan_extension.batch --model stylegan3-r-ffhq.pkl --seeds 0-999 --psi 0.5,0.7 --workers 4
+    python -m lib_gan_extension.batch --model stylegan3-r-ffhq.pkl --mix "1-4:10-12:coarse:-0.5,0.5"
+
+With --manifest the job is recorded in a JSON manifest with per-shard completion bitmaps. Rerunning
+the same command resumes where it stopped, and several processes can work on one manifest.
+
+With --share-weights (cpu only) the parent loads the model once and places its parameters in shared
+memory; workers attach to that storage instead of unpickling their own copy of G_ema.
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+import time
+from dataclasses import dataclass
+
+import torch
+import torch.multiprocessing as mp # registers the reductions that pass shared tensors by handle
+
+try:
+    import resource
+except ImportError: # windows
+    resource = None
+
+from lib_gan_extension import global_state, file_utils, str_utils, GanGenerator, GanModel, logger
+from lib_gan_extension.manifest import JobManifest, str2bitmap, bitmap_get
+from lib_gan_extension.model_catalog import ModelCatalog
+
+@dataclass
+class MixSpec:
+    seeds1: list[int]
+    seeds2: list[int]
+    mask: str
+    amounts: list[float]
+
+    @classmethod
+    def parse(cls, spec: str) -> MixSpec:
+        # SEEDS1:SEEDS2:MASK:AMOUNTS, e.g. "1-4:10,12:coarse:-0.5,0.5"
+        try:
+            seeds1, seeds2, mask, amounts = spec.split(':')
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"mix spec should be SEEDS1:SEEDS2:MASK:AMOUNTS, got {spec!r}")
+        return cls(str_utils.str2seeds(seeds1), str_utils.str2seeds(seeds2), mask, [float(x) for x in amounts.split(',')])
+
+def job_items(seeds: list[int], psis: list[float], mixes: list[MixSpec]) -> list[tuple]:
+    """Flatten a job into work items: ('base', seed, psi) and ('mix', seed1, seed2, psi, mask, amount)."""
+    items = [('base', seed, psi) for psi in psis for seed in seeds]
+    for spec in mixes:
+        items += [('mix', seed1, seed2, psi, spec.mask, amt)
+                    for psi in psis for amt in spec.amounts for seed1 in spec.seeds1 for seed2 in spec.seeds2]
+    return items
+
+def job_spec(model: str, seeds: str, psis: list[float], mixes: list[str], outputRoot: str, image_format: str) -> dict:
+    """Job description as stored in a manifest (seed ranges are kept unexpanded)."""
+    return {'model': model, 'seeds': seeds, 'psi': psis, 'mix': mixes, 'output': outputRoot, 'format': image_format}
+
+def job_items_from_spec(job: dict) -> list[tuple]:
+    return job_items(str_utils.str2seeds(job['seeds']), job['psi'], [MixSpec.parse(spec) for spec in job['mix']])
+
+def shard(items: list[tuple], size: int) -> list[list[tuple]]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+## worker process
+
+_generator = None
+
+def init_worker(model: str, outputRoot: str, device: str, threads: int, image_format: str, batch_size: int,
+                    G: torch.nn.Module=None) -> None:
+    global _generator
+    torch.set_num_threads(threads)
+    global_state.device = device
+    global_state.image_format = image_format
+    global_state.batch_size = batch_size
+    _generator = GanGenerator(outputRoot)
+    _generator.set_model(model, G)
+
+def peak_rss_mb() -> float:
+    if resource is None:
+        return float('nan')
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KB on linux
+
+def render_group(items: list[tuple]) -> dict[int, torch.Tensor]:
+    """Render work items, batching those that share psi (and mask/amount). Returns {position: w row} of base items."""
+    groups = {}
+    for k, item in enumerate(items):
+        key = ('base', item[2]) if item[0] == 'base' else ('mix', *item[3:])
+        groups.setdefault(key, []).append(k)
+    rows = {}
+    with torch.no_grad():
+        for key, group in groups.items():
+            if key[0] == 'base':
+                results = _generator.generate_base_images([items[k][1] for k in group], psi=key[1])
+                for k in group:
+                    rows[k] = results[items[k][1]][1][0, 0] # seed latents repeat one row over num_ws
+            else:
+                _, psi, mask, amt = key
+                _generator.generate_mixes([items[k][1:3] for k in group], psi, mask, amt)
+    return rows
+
+def render_shard(items: list[tuple]) -> (int, int, float, float):
+    """Render a shard of work items. Returns (number of items, pid, seconds spent, peak RSS in MB)."""
+    start = time.perf_counter()
+    render_group(items)
+    return len(items), os.getpid(), time.perf_counter() - start, peak_rss_mb()
+
+def work_manifest(path: str) -> (int, int, float, float):
+    """Claim and render shards of a manifest until none are left. Same return values as render_shard."""
+    start = time.perf_counter()
+    manifest = JobManifest(path)
+    items = job_items_from_spec(manifest.job)
+    chunk = global_state.batch_size * 4
+    rendered = 0
+    while (claim := manifest.claim(_generator.GAN.num_ws, _generator.GAN.w_dim, _generator.fingerprint)) is not None:
+        index, shard = claim
+        bitmap = str2bitmap(shard['done'])
+        todo = [i for i in range(shard['count']) if not bitmap_get(bitmap, i)]
+        try:
+            for n in range(0, len(todo), chunk):
+                part = todo[n:n + chunk]
+                rows = render_group([items[shard['start'] + i] for i in part])
+                manifest.write_latents(shard, {part[k]: row for k, row in rows.items()})
+                manifest.checkpoint(index, part)
+                rendered += len(part)
+        except BaseException:
+            manifest.release(index)
+            raise
+    return rendered, os.getpid(), time.perf_counter() - start, peak_rss_mb()
+
+def render_items(items: list[tuple]) -> list:
+    """Render items in the current worker and return the images, for comparisons."""
+    images = []
+    with torch.no_grad():
+        for item in items:
+            if item[0] == 'base':
+                images.append(_generator.generate_base_images([item[1]], item[2])[item[1]][0])
+            else:
+                images += _generator.generate_mixes([item[1:3]], *item[3:])
+    return [img.tobytes() for img in images]
+
+## main process
+
+def load_shared(model: str) -> torch.nn.Module:
+    G = GanModel(file_utils.model_path / model, 'cpu').share_memory().G
+    logger(f"Loaded model {model} into shared memory")
+    return G
+
+def run(items: list[tuple], model: str, outputRoot: str, device: str='cpu', workers: int=1, threads: int=None,
+        image_format: str='png', batch_size: int=4, shard_size: int=None, share_weights: bool=False) -> dict:
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    shard_size = shard_size or batch_size * 4
+    if share_weights and device != 'cpu':
+        raise ValueError("shared weights are only supported on the cpu")
+    ModelCatalog.shared().fingerprint(model) # hashed once here, workers find it memoized
+    G = load_shared(model) if share_weights else None
+    initargs = (model, outputRoot, device, threads, image_format, batch_size, G)
+    shards = shard(items, shard_size)
+    logger(f"Rendering {len(items)} items in {len(shards)} shards on {workers} worker(s) x {threads} thread(s)")
+
+    done = 0
+    busy = {}
+    rss = {}
+    start = time.perf_counter()
+    # spawn (not fork) so workers never inherit a half-initialized torch thread pool
+    with mp.get_context('spawn').Pool(workers, initializer=init_worker, initargs=initargs) as pool:
+        for count, pid, seconds, peak_rss in pool.imap_unordered(render_shard, shards):
+            done += count
+            busy[pid] = busy.get(pid, 0.0) + seconds
+            rss[pid] = peak_rss
+            elapsed = time.perf_counter() - start
+            print(f"\r[GAN Generator] {done}/{len(items)} ({100 * done / len(items):.0f}%) "
+                  f"{done / elapsed:.1f} items/s", end='', file=sys.stderr, flush=True)
+    print(file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        'items': len(items),
+        'seconds': elapsed,
+        'items_per_second': len(items) / elapsed if elapsed > 0 else 0.0,
+        'worker_utilization': sum(busy.values()) / (elapsed * workers) if elapsed > 0 else 0.0,
+        'worker_peak_rss_mb': max(rss.values(), default=float('nan')),
+    }
+    logger(f"Done: {summary['items']} items in {summary['seconds']:.1f}s ({summary['items_per_second']:.2f} items/s, "
+           f"{100 * summary['worker_utilization']:.0f}% worker utilization, {summary['worker_peak_rss_mb']:.0f} MB peak worker RSS)")
+    return summary
+
+def run_manifest(path: str, device: str='cpu', workers: int=1, threads: int=None, batch_size: int=4,
+                    share_weights: bool=False) -> dict:
+    manifest = JobManifest(path)
+    job = manifest.job
+    threads = threads or max(1, (os.cpu_count() or 1) // workers)
+    ModelCatalog.shared().fingerprint(job['model'])
+    G = load_shared(job['model']) if share_weights else None
+    initargs = (job['model'], job['output'], device, threads, job['format'], batch_size, G)
+    done, total = manifest.progress()
+    logger(f"Resuming {path}: {done}/{total} items done, {workers} worker(s) x {threads} thread(s)")
+
+    start = time.perf_counter()
+    with mp.get_context('spawn').Pool(workers, initializer=init_worker, initargs=initargs) as pool:
+        results = [pool.apply_async(work_manifest, (path,)) for _ in range(workers)]
+        while not all(r.ready() for r in results):
+            time.sleep(1.0)
+            now_done, _ = manifest.progress()
+            elapsed = time.perf_counter() - start
+            print(f"\r[GAN Generator] {now_done}/{total} ({100 * now_done / total:.0f}%) "
+                  f"{(now_done - done) / elapsed:.1f} items/s", end='', file=sys.stderr, flush=True)
+        results = [r.get() for r in results]
+    print(file=sys.stderr)
+
+    elapsed = time.perf_counter() - start
+    rendered = sum(r[0] for r in results)
+    summary = {
+        'items': rendered,
+        'seconds': elapsed,
+        'items_per_second': rendered / elapsed if elapsed > 0 else 0.0,
+        'worker_utilization': sum(r[2] for r in results) / (elapsed * workers) if elapsed > 0 else 0.0,
+        'worker_peak_rss_mb': max(r[3] for r in results),
+        'complete': manifest.progress()[0] == total,
+    }
+    logger(f"Done: {rendered} items in {elapsed:.1f}s ({summary['items_per_second']:.2f} items/s), "
+           f"job {'complete' if summary['complete'] else 'incomplete (other workers still running?)'}")
+    return summary
+
+def verify_shared_weights(items: list[tuple], model: str, outputRoot: str, threads: int=1) -> bool:
+    """Render items in this process and in a worker attached to shared weights, and compare the pixels."""
+    # separate output folders, so both sides really synthesize instead of reading each other's cache
+    init_worker(model, os.path.join(outputRoot, 'single'), 'cpu', threads, 'png', 1)
+    expected = render_items(items)
+    initargs = (model, os.path.join(outputRoot, 'shared'), 'cpu', threads, 'png', 1, load_shared(model))
+    with mp.get_context('spawn').Pool(1, initializer=init_worker, initargs=initargs) as pool:
+        actual = pool.apply(render_items, (items,))
+    same = expected == actual
+    logger(f"Shared weights render {'matches' if same else 'DIFFERS FROM'} the single-process render ({len(items)} items)")
+    return same
+
+def main(argv: list[str]=None):
+    parser = argparse.ArgumentParser(description="Render StyleGAN seeds and style mixes without the WebUI.")
+    parser.add_argument('--model', required=True, help="checkpoint in the models folder, or a path to one")
+    parser.add_argument('--seeds', default="", help="seeds or ranges, e.g. 0-999,1234")
+    parser.add_argument('--psi', type=lambda s: [float(x) for x in s.split(',')], default=[0.7], help="comma-separated truncation values")
+    parser.add_argument('--mix', action='append', default=[], help="SEEDS1:SEEDS2:MASK:AMOUNTS, may be repeated")
+    parser.add_argument('--output', default=None, help="output root (default: the webui's stylegan-images folder)")
+    parser.add_argument('--device', default=global_state.device)
+    parser.add_argument('--format', default=global_state.image_format, choices=['png', 'jpg'])
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=None, help="torch threads per worker (default: cpus / workers)")
+    parser.add_argument('--batch-size', type=int, default=global_state.batch_size)
+    parser.add_argument('--shard-size', type=int, default=None, help="items per work unit (default: 4 batches, or 1000 per shard with --manifest)")
+    parser.add_argument('--share-weights', action='store_true', help="load the model once into shared memory (cpu only)")
+    parser.add_argument('--manifest', default=None, help="job manifest to create, or to resume if it exists")
+    parser.add_argument('--verify-shared', action='store_true', help="check that a shared-weights worker renders the first items identically, then exit")
+    args = parser.parse_args(argv)
+
+    if args.manifest is not None and JobManifest(args.manifest).exists():
+        run_manifest(args.manifest, device=args.device, workers=args.workers, threads=args.threads,
+                     batch_size=args.batch_size, share_weights=args.share_weights)
+        return
+
+    try:
+        items = job_items(str_utils.str2seeds(args.seeds), args.psi, [MixSpec.parse(spec) for spec in args.mix])
+    except (ValueError, argparse.ArgumentTypeError) as e:
+        parser.error(str(e))
+    if not items:
+        parser.error("nothing to render, pass --seeds and/or --mix")
+    outputRoot = args.output or str(GanGenerator().outputRoot)
+    if args.manifest is not None:
+        job = job_spec(args.model, args.seeds, args.psi, args.mix, outputRoot, args.format)
+        JobManifest.create(args.manifest, job, len(items), args.shard_size or 1000)
+        run_manifest(args.manifest, device=args.device, workers=args.workers, threads=args.threads,
+                     batch_size=args.batch_size, share_weights=args.share_weights)
+        return
+    if args.verify_shared:
+        import tempfile
+        with tempfile.TemporaryDirectory() as scratch:
+            sys.exit(0 if verify_shared_weights(items[:4], args.model, scratch) else 1)
+    run(items, args.model, outputRoot, device=args.device, workers=args.workers, threads=args.threads,
+        image_format=args.format, batch_size=args.batch_size, shard_size=args.shard_size, share_weights=args.share_weights)
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,16 @@
 import os
 import platform
 import subprocess as sp
+import tempfile
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
-from modules import shared
+try:
+    import fcntl
+except ImportError: # windows
+    fcntl = None
+    import msvcrt
 
 model_path = Path(__file__).resolve().parents[1] / "models"
 
@@ -11,7 +18,48 @@ def touch(filename: str) -> None:
     with open(filename, 'a'):
         os.utime(filename, None)  # Update the modification timestamp
 
+def atomic_write(filename: str, data: bytes, fsync: bool=True) -> None:
+    # write to a temp file in the same folder, then rename over the target
+    folder = os.path.dirname(os.path.abspath(filename))
+    fd, tmp = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.chmod(tmp, os.stat(filename).st_mode if os.path.exists(filename) else 0o644) # mkstemp creates 0600
+        os.replace(tmp, filename)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+@contextmanager
+def file_lock(filename: str):
+    # exclusive inter-process lock on a (separate) lock file
+    with open(filename, 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
 def open_folder(f, images=None, index=None):
+    from modules import shared
+
     if shared.cmd_opts.hide_ui_dir_config:
         return
 
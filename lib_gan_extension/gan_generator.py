@@ -3,25 +3,52 @@ from typing import Union
 from pathlib import Path
 import numpy as np
 from PIL import Image
+import copy
+import functools
 import random
-import sys
+import threading
+import time
 import torch
 
-from modules.images import save_image_with_geninfo
-from modules.paths_internal import default_output_dir
+try:
+    from modules.paths_internal import default_output_dir
+except ImportError: # running outside of the webui
+    default_output_dir = Path(__file__).resolve().parents[1] / "outputs"
 
-from lib_gan_extension import GanModel, global_state, file_utils, str_utils, metadata
+from lib_gan_extension import GanModel, global_state, file_utils, str_utils, metadata, output_cache, views, profiling, metrics
 from .global_state import logger
+from .scheduler import Scheduler, INTERACTIVE
+from .model_catalog import ModelCatalog
+from .seed_bank import SeedBank
+from .timing import stage
+
+def interactive(method):
+    # run a GanGenerator method in an interactive scheduler slot, profiled if armed
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        start = time.perf_counter()
+        with self.scheduler.slot(INTERACTIVE), profiling.render(self.profile_path(), method.__name__):
+            result = method(self, *args, **kwargs)
+        metrics.request_seconds.observe(time.perf_counter() - start, method.__name__)
+        return result
+    return wrapper
 
 class GanGenerator:
-    def __init__(self):
+    _shared = None
+
+    def __init__(self, outputRoot: Union[str, Path, None]=None):
         self.device = None
         self.model_name = None
+        self.fingerprint = None # content hash of the model file, keys its output folder
         self.GAN = None
-        self.outputRoot = Path(__file__) / default_output_dir / "stylegan-images"
+        self.scheduler = Scheduler() # one render at a time, UI clicks ahead of bulk batches
+        self.outputRoot = Path(outputRoot) if outputRoot is not None else Path(__file__) / default_output_dir / "stylegan-images"
         self.outputRoot.mkdir(parents=True, exist_ok=True)
+        self.cache = output_cache.OutputCache(self.outputRoot)
+        self._seed_bank = None # (folder, file stamps, SeedBank) of the current model
 
     ## methods called by UI
+    @interactive
     def generate_image_from_ui(self, model_name: str, seed: int,
                                      psi: float) -> (Image.Image, str):
         self.set_model(model_name)
@@ -35,6 +62,7 @@ class GanGenerator:
         return img, seedTxt
         
 
+    @interactive
     def generate_mix_from_ui(self, model_name: str, seed1: int,  psi1: float, seed2: int,
                                      psi2: float, interpType: str, mix: float, w1: str, w2: str) -> (Image.Image, Image.Image, Image.Image, str, str, str, str, str):
         w1 = None if w1 == "" else w1
@@ -57,8 +85,9 @@ class GanGenerator:
                 w2 = None
             seedTxt2 = f"Seed 1: {seed2} ({str_utils.num2hex(seed2)})"
     
-        w1 = str_utils.str2tensor(w1).to(self.device) if w1 is not None else None
-        w2 = str_utils.str2tensor(w2).to(self.device) if w2 is not None else None
+        with stage('decode'):
+            w1 = str_utils.str2tensor(w1).to(self.device) if w1 is not None else None
+            w2 = str_utils.str2tensor(w2).to(self.device) if w2 is not None else None
 
         img1, img2, img3, w1, w2, w3 = self.generate_image_mix(seed1, psi1, seed2, psi2, interpType, mix, global_state.image_pad, w1, w2)
 
@@ -68,40 +97,160 @@ class GanGenerator:
 
         return img1, img2, img3, seedTxt1, seedTxt2, w1, w2, w3
 
-    def set_model(self, model_name: str) -> None:
+    @interactive
+    def generate_mix_grid_from_ui(self, model_name: str, seeds1: str, seeds2: str, psi: float,
+                                        interpType: str, mix: float) -> (Image.Image, list[Image.Image], str):
+        self.set_model(model_name)
+        seeds1 = str_utils.str2seeds(seeds1)
+        seeds2 = str_utils.str2seeds(seeds2)
+        if len(seeds1) == 0 or len(seeds2) == 0:
+            raise ValueError("Both seed lists need at least one seed")
+
+        sheet, cells = self.generate_mix_grid(seeds1, seeds2, psi, interpType, mix)
+        gridTxt = f"Grid: {len(seeds1)} × {len(seeds2)} seeds"
+
+        return sheet, [img for row in cells for img in row], gridTxt
+
+    @interactive
+    def generate_gallery_from_ui(self, model_name: str, start: int, page: int, page_size: int, psi: float,
+                                        mode: str) -> (list[(Image.Image, str)], list[int], str):
+        self.set_model(model_name)
+        page = max(int(page or 0), 0)
+        seeds = self.gallery_seeds(int(start or 0), page, int(page_size), mode == "Random")
+        previews = self.generate_previews(seeds, psi)
+        tiles = [(previews[seed], str(seed)) for seed in seeds]
+        if mode == "Random":
+            galleryTxt = f"Page {page + 1} of random seeds (key {start}), {len(seeds)} previews"
+        else:
+            galleryTxt = f"Page {page + 1}: seeds {seeds[0]}-{seeds[-1]}" if seeds else f"Page {page + 1}: past the last seed"
+        return tiles, seeds, galleryTxt
+
+    @interactive
+    def find_similar_from_ui(self, model_name: str, source: str, seed1: int, psi1: float, seed2: int, psi2: float,
+                                    w1: str, w2: str, w3: str, mask: str, k: int, psi: float) -> (list[(Image.Image, str)], list[int], str):
+        self.set_model(model_name)
+        seed, seed_psi, w = {"Seed 1": (seed1, psi1, w1), "Seed 2": (seed2, psi2, w2), "Style Mixed": (None, None, w3)}[source]
+        if w:
+            with stage('decode'):
+                w = str_utils.str2tensor(w)
+        elif seed is not None and seed != -1:
+            w = self.GAN.get_w_from_seed(seed, seed_psi)
+        else:
+            return [], [], f"Generate a mix first, {source} has no latent yet"
+        try:
+            results = self.find_similar_seeds(w, psi, int(k), mask)
+        except (FileNotFoundError, ValueError) as e:
+            return [], [], str(e)
+        previews = self.generate_previews([seed for seed, _ in results], psi)
+        tiles = [(previews[seed], f"{seed} ({distance:.3f})") for seed, distance in results]
+        first, last = self.seed_bank().seeds
+        return tiles, [seed for seed, _ in results], f"Nearest seeds to {source} among seeds {first}-{last} (distance in W)"
+
+    @interactive
+    def export_image_from_ui(self, model_name: str, seedTxt: str, psi: float) -> str:
+        seed = str_utils.str2num(seedTxt or "")
+        if seed is None:
+            return "Generate an image first"
+        self.set_model(model_name)
+        self.find_or_generate_base_image(seed, psi)
+        path = self.export_image({'seed': seed, 'psi': psi}, view={'pad': global_state.image_pad})
+        return f"Exported {path.name}"
+
+    @interactive
+    def export_mix_from_ui(self, model_name: str, seedTxt1: str, psi1: float, seedTxt2: str, psi2: float,
+                                interpType: str, mix: float, w1: str, w2: str) -> str:
+        self.set_model(model_name)
+        seed1, seed2 = str_utils.str2num(seedTxt1 or ""), str_utils.str2num(seedTxt2 or "")
+        w1 = str_utils.str2tensor(w1) if seed1 is None and w1 else None
+        w2 = str_utils.str2tensor(w2) if seed2 is None and w2 else None
+        if (seed1 is None and w1 is None) or (seed2 is None and w2 is None):
+            return "Generate a style mix first"
+        params, _ = self.mix_params(seed1, psi1, seed2, psi2, interpType, mix, w1, w2)
+        try:
+            path = self.export_image(params, base="mix", view={'pad': global_state.image_pad})
+        except FileNotFoundError:
+            return "Nothing to export, the mixed image is one of the seeds"
+        return f"Exported {path.name}"
+
+    def set_model(self, model_name: str, G: Union[torch.nn.Module, None]=None) -> None:
         self.device = global_state.device
 
-        if model_name != self.model_name:
+        fingerprint = ModelCatalog.shared().fingerprint(model_name)
+        if (model_name, fingerprint) != (self.model_name, self.fingerprint):
+            if self.GAN is not None:
+                metrics.model_unloads.inc(self.model_name)
             self.model_name = model_name
-            self.output_path().mkdir(parents=True, exist_ok=True)
+            self.fingerprint = fingerprint
             path = file_utils.model_path / model_name
-            self.GAN = GanModel(path, self.device)
-            logger(f"Loaded model {model_name}")
+            start = time.perf_counter()
+            with stage('load', self.device):
+                self.GAN = GanModel(G if G is not None else path, self.device, name=model_name)
+            output_cache.adopt(self.output_path(), self.outputRoot / Path(model_name).stem, self.made_image)
+            self.output_path().mkdir(parents=True, exist_ok=True)
+            output_cache.migrate(self.output_path())
+            output_cache.label(self.output_path(), model_name)
+            metrics.model_loads.inc(model_name)
+            metrics.model_load_seconds.observe(time.perf_counter() - start, model_name)
+            logger(f"Loaded model {model_name}" + (" (attached)" if G is not None else ""))
+
+
+    def warm_up(self, model_name: str) -> dict[str, float]:
+        """
+        Pay the first-click costs up front: fingerprint and load the model, initialize the custom op
+        plugins and render one throwaway image and batch. Holds an interactive slot throughout, so
+        clicks arriving meanwhile wait for it instead of loading the model a second time.
+        Returns the seconds spent per step.
+        """
+        timings = {}
+        def step(name, fn):
+            start = time.perf_counter()
+            fn()
+            timings[name] = time.perf_counter() - start
+
+        with self.scheduler.slot(INTERACTIVE):
+            step('fingerprint', lambda: ModelCatalog.shared().fingerprint(model_name))
+            step('load', lambda: self.set_model(model_name))
+            if 'cuda' in self.device:
+                step('plugins', self.init_plugins)
+            w = self.GAN.get_w_from_mean_w()
+            with torch.no_grad():
+                step('render', lambda: self.GAN.w_to_images(w))
+                if global_state.batch_size > 1:
+                    step('render_batch', lambda: self.GAN.w_to_images(w.expand(global_state.batch_size, -1, -1)))
+        logger(f"Warmed up {model_name}: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()))
+        return timings
+
+    def start_warm_up(self, model_name: str) -> threading.Thread:
+        def work():
+            try:
+                self.warm_up(model_name)
+            except Exception as e: # the first click will report it properly
+                logger(f"Warm-up of {model_name} failed: {e}")
+        thread = threading.Thread(target=work, name='gan-warm-up', daemon=True)
+        thread.start()
+        return thread
 
+    @classmethod
+    def init_plugins(cls) -> None:
+        # build or load the cuda plugins now rather than on the first synthesis
+        from torch_utils.ops import bias_act, upfirdn2d, filtered_lrelu
+        for op in (bias_act, upfirdn2d, filtered_lrelu):
+            try:
+                op._init()
+            except Exception as e: # the ops fall back to their reference implementation
+                logger(f"Could not initialize {op.__name__} plugin: {e}")
 
     ## Image generation methods
 
     def generate_image(self, seed: int, psi: float, pad: float=1.0) -> Image.Image:
-        params = {'seed': seed, 'psi': psi}
-        output, _ = self.find_or_generate_base_image(**params)
-        if pad != 1.0:
-            output = self.pad_image(output, pad)
-            padded_path = self.image_path_with_params({**params, 'pad': pad})
-            self.save_image_to_file(output, padded_path, params)
-        return output
+        output, _ = self.find_or_generate_base_image(seed, psi)
+        return views.apply(output, {'pad': pad})
 
     def generate_image_mix(self, seed1: int, psi1: float, seed2: int, psi2: float, interpType: str, mix: float, pad: float,
                             w1: Union[torch.Tensor,None], w2: Union[torch.Tensor,None]) -> (
                                     Image.Image, Image.Image, Image.Image,
                                     Union[torch.Tensor,None], Union[torch.Tensor,None], Union[torch.Tensor,None]):
-        params = {'seed1': seed1, 'seed2': seed2, 'psi1': psi1, 'psi2': psi2, 'mix': mix, 'interp': interpType}
-        vparams = {}
-        if seed1 is None and w1 is not None:
-            vparams['tensor1'] = str_utils.tensor2str(w1)
-            params['seed1'] = f"V{str_utils.crc_hash(vparams['tensor1'])}"
-        if seed2 is None and w2 is not None:
-            vparams['tensor2'] = str_utils.tensor2str(w2)
-            params['seed2'] = f"V{str_utils.crc_hash(vparams['tensor2'])}"
+        params, latents = self.mix_params(seed1, psi1, seed2, psi2, interpType, mix, w1, w2)
 
         img1, w1 = self.find_or_generate_base_image(seed1, psi1, w1)
         if seed1 == seed2 and torch.equal(w1,w2):
@@ -113,28 +262,217 @@ class GanGenerator:
         if img3 is None:
             w_mix = self.mix_weights(w1, w2, mix, interpType)
             img3 = self.GAN.w_to_image(w_mix)
-            vparams["tensor"] = str_utils.tensor2str(w_mix)
-            self.save_image_to_file(img3, filename, {**params, **vparams})
+            latents['tensor'] = w_mix
+            self.save_image_to_file(img3, filename, params, latents)
         else:
-            p = metadata.parse_params_from_image(img3)
-            w_mix = p.get('tensor')
-            vparams["tensor"] = str_utils.tensor2str(w_mix)
+            w_mix = metadata.parse_latents_from_image(img3).get('tensor')
+            if w_mix is None:
+                w_mix = self.mix_weights(w1, w2, mix, interpType)
+            w_mix = w_mix.to(self.device)
+            latents['tensor'] = w_mix
 
-        if pad != 1.0:
-            img3 = self.pad_image(img3,pad)
-            params['pad'] = pad
-            filename = self.image_path_with_params(params, base="mix")
-            self.save_image_to_file(img3, filename, {**params, **vparams})
+        return img1, img2, views.apply(img3, {'pad': pad}), w1, w2, w_mix
 
-        return img1, img2, img3, w1, w2, w_mix
+    def mix_params(self, seed1: int, psi1: float, seed2: int, psi2: float, interpType: str, mix: float,
+                    w1: Union[torch.Tensor,None], w2: Union[torch.Tensor,None]) -> (dict, dict):
+        """Params naming a mix, and the parent latents that are stored with it (those not given by a seed)."""
+        params = {'seed1': seed1, 'seed2': seed2, 'psi1': psi1, 'psi2': psi2, 'mix': mix, 'interp': interpType}
+        latents = {}
+        if seed1 is None and w1 is not None:
+            latents['tensor1'] = w1
+            params['seed1'] = f"V{str_utils.latent_hash(w1)}"
+        if seed2 is None and w2 is not None:
+            latents['tensor2'] = w2
+            params['seed2'] = f"V{str_utils.latent_hash(w2)}"
+        return params, latents
         
+    def generate_mix_grid(self, seeds1: list[int], seeds2: list[int], psi: float, interpType: str, mix: float,
+                            tile_size: int=256) -> (Image.Image, list[list[Image.Image]]):
+        # parents are resolved (and cached) once per seed instead of once per cell
+        parents = self.generate_base_images(seeds1 + seeds2, psi)
+        parents1 = [parents[seed] for seed in seeds1]
+        parents2 = [parents[seed] for seed in seeds2]
+
+        cells = [[None] * len(seeds2) for _ in seeds1]
+        filenames = {}
+        for i, seed1 in enumerate(seeds1):
+            for j, seed2 in enumerate(seeds2):
+                if seed1 == seed2:
+                    cells[i][j] = parents1[i][0]
+                    continue
+                params = {'seed1': seed1, 'seed2': seed2, 'psi1': psi, 'psi2': psi, 'mix': mix, 'interp': interpType}
+                filenames[(i, j)] = (self.image_path_with_params(params, base="mix"), params)
+                cells[i][j] = self.find_output_image(filenames[(i, j)][0])
+
+        missing = [(i, j) for i, row in enumerate(cells) for j, img in enumerate(row) if img is None]
+        if missing:
+            w1 = torch.cat([w.reshape(1, *w.shape[-2:]) for _, w in parents1])
+            w2 = torch.cat([w.reshape(1, *w.shape[-2:]) for _, w in parents2])
+            w_grid = self.mix_weights_grid(w1, w2, mix, interpType)
+            rows, cols = (torch.tensor(x, device=w_grid.device) for x in zip(*missing))
+            w_mix = w_grid[rows, cols]
+            images = self.render_and_save(w_mix, [filenames[ij] for ij in missing])
+            for (i, j), img in zip(missing, images):
+                cells[i][j] = img
+        logger(f"Rendered mix grid {len(seeds1)}x{len(seeds2)} ({len(missing)} new)")
+
+        sheet = self.contact_sheet([img for img, _ in parents1], [img for img, _ in parents2], cells, tile_size)
+        params = {'seeds1': str_utils.crc_hash(str(seeds1)), 'seeds2': str_utils.crc_hash(str(seeds2)),
+                  'psi': psi, 'mix': mix, 'interp': interpType}
+        self.save_image_to_file(sheet, self.image_path_with_params(params, base="grid"),
+                                {**params, 'seeds1': seeds1, 'seeds2': seeds2})
+        return sheet, cells
+
+    def generate_base_images(self, seeds: list[int], psi: float) -> dict[int, (Image.Image, torch.Tensor)]:
+        """
+        Batched find_or_generate_base_image: cached seeds are read from disk, the others are
+        mapped and synthesized in batches. Returns {seed: (image, w)}.
+        """
+        results = {}
+        missing = []
+        for seed in dict.fromkeys(seeds):
+            filename = self.image_path_with_params({'seed': seed, 'psi': psi})
+            img = self.find_output_image(filename)
+            w = self.find_latents(filename).get('tensor') if img is not None else None
+            if w is None:
+                missing.append(seed)
+            else:
+                results[seed] = (img, w.to(self.device))
+
+        if missing:
+            ws = torch.cat([self.GAN.get_w_from_seed(seed, psi) for seed in missing])
+            entries = [(self.image_path_with_params(params), params) for params in ({'seed': seed, 'psi': psi} for seed in missing)]
+            images = self.render_and_save(ws, entries)
+            for seed, img, w in zip(missing, images, ws):
+                results[seed] = (img, w.unsqueeze(0))
+        logger(f"Rendered {len(missing)} base images with psi {psi} ({len(results) - len(missing)} cached on disk)")
+
+        return results
+
+    def generate_mixes(self, pairs: list[(int, int)], psi: float, interpType: str, mix: float) -> list[Image.Image]:
+        """Batched style mixes of many (seed1, seed2) pairs sharing psi, mask and mix amount."""
+        parents = self.generate_base_images([seed for pair in pairs for seed in pair], psi)
+
+        images = [None] * len(pairs)
+        entries = {}
+        for k, (seed1, seed2) in enumerate(pairs):
+            if seed1 == seed2:
+                images[k] = parents[seed1][0]
+                continue
+            params = {'seed1': seed1, 'seed2': seed2, 'psi1': psi, 'psi2': psi, 'mix': mix, 'interp': interpType}
+            entries[k] = (self.image_path_with_params(params, base="mix"), params)
+            images[k] = self.find_output_image(entries[k][0])
+
+        missing = [k for k, img in enumerate(images) if img is None]
+        if missing:
+            w1 = torch.cat([parents[pairs[k][0]][1] for k in missing])
+            w2 = torch.cat([parents[pairs[k][1]][1] for k in missing])
+            w_mix = self.GAN.mixer.mix(w1, w2, mix, interpType)[0]
+            for k, img in zip(missing, self.render_and_save(w_mix, [entries[k] for k in missing])):
+                images[k] = img
+        logger(f"Rendered {len(missing)} mixes ({len(pairs) - len(missing)} cached on disk)")
+
+        return images
+
+    def generate_previews(self, seeds: list[int], psi: float, size: int=None) -> dict[int, Image.Image]:
+        """
+        Low resolution previews of seeds (see preview.py), cached apart from full renders. Missing
+        ones are mapped and synthesized in batches. Returns {seed: image}.
+        """
+        size = size or global_state.preview_size
+        results = {}
+        missing = []
+        for seed in dict.fromkeys(seeds):
+            img = self.find_output_image(self.preview_filename(seed, psi, size))
+            if img is None:
+                missing.append(seed)
+            else:
+                results[seed] = img
+
+        if missing:
+            ws = torch.cat([self.GAN.get_w_from_seed(seed, psi) for seed in missing])
+            batch = self.GAN.w_to_previews(ws, size, batch_size=global_state.batch_size)
+            for i, seed in enumerate(missing):
+                results[seed] = batch.image(i)
+                self.save_image_to_file(results[seed], self.preview_filename(seed, psi, size), {'seed': seed, 'psi': psi, 'size': size})
+        logger(f"Rendered {len(missing)} previews with psi {psi} ({len(results) - len(missing)} cached on disk)")
+
+        return results
+
+    def preview_filename(self, seed: int, psi: float, size: int) -> str:
+        return self.image_path_with_params({'seed': seed, 'psi': psi, 'size': size}, base="preview")
+
+    def seed_bank_path(self) -> Path:
+        return self.output_path() / output_cache.SEED_BANK_DIR
+
+    def seed_bank(self) -> Union[SeedBank, None]:
+        """The seed bank of the current model, reopened when a build has changed it. None if it has none."""
+        folder = self.seed_bank_path()
+        if not SeedBank.exists(folder):
+            return None
+        stamp = SeedBank.stamp(folder)
+        if self._seed_bank is None or self._seed_bank[:2] != (folder, stamp):
+            self._seed_bank = (folder, stamp, SeedBank(folder))
+        return self._seed_bank[2]
+
+    def find_similar_seeds(self, w: torch.Tensor, psi: float, k: int=10, mask: Union[str,int]="total",
+                                **search_kwargs) -> list[(int, float)]:
+        """
+        The k seeds of the seed bank whose latents with psi are nearest to w, over the layers of the
+        mask. Returns (seed, distance) pairs, see SeedBank.search.
+        """
+        bank = self.seed_bank()
+        if bank is None:
+            raise FileNotFoundError(f"No seed bank for {self.model_name}, build one with "
+                                    f"`python -m lib_gan_extension.seed_bank build --model {self.model_name}`")
+        w = w.reshape(-1, self.GAN.w_dim).expand(self.GAN.num_ws, -1).detach().float().cpu().numpy()
+        weights = self.GAN.mixer.layer_mask(mask).float().cpu().numpy()
+        start = time.perf_counter()
+        results = bank.search(w, psi, k, weights, **search_kwargs)
+        metrics.seed_search_seconds.observe(time.perf_counter() - start, self.model_name)
+        return results
+
+    def render_and_save(self, ws: torch.Tensor, entries: list[(str, dict)]) -> list[Image.Image]:
+        """Synthesize [N, num_ws, w_dim] in batches and save each image with its (filename, params)."""
+        images = self.GAN.w_to_images(ws, batch_size=global_state.batch_size)
+        for img, w, (filename, params) in zip(images, ws, entries):
+            self.save_image_to_file(img, filename, params, {'tensor': w.unsqueeze(0)})
+        return images
+
+    @classmethod
+    def contact_sheet(cls, headers1: list[Image.Image], headers2: list[Image.Image],
+                        cells: list[list[Image.Image]], tile_size: int=256) -> Image.Image:
+        # first row holds the column parents, first column holds the row parents
+        sheet = Image.new('RGB', (tile_size * (len(headers2) + 1), tile_size * (len(headers1) + 1)), (0, 0, 0))
+        def paste(img, row, col):
+            sheet.paste(img.convert('RGB').resize((tile_size, tile_size), Image.LANCZOS), box=(col * tile_size, row * tile_size))
+        for j, img in enumerate(headers2):
+            paste(img, 0, j + 1)
+        for i, img in enumerate(headers1):
+            paste(img, i + 1, 0)
+            for j, cell in enumerate(cells[i]):
+                paste(cell, i + 1, j + 1)
+        return sheet
+
     def pad_image(self, image: Image.Image, factor: float=1.0) -> Image.Image:
-        resolution = self.GAN.img_resolution
-        new_size = int(resolution*factor)
-        padImage = Image.new(image.mode, (new_size, new_size), (0, 0, 0))
-        padding = int((new_size-resolution)/2)
-        padImage.paste(image, box=(padding, padding))
-        return padImage
+        return views.pad(image, factor)
+
+    def export_image(self, params: dict, base: str="base", view: dict=None) -> Path:
+        """
+        Persist a derived view of a cached render into the model's exports folder (which the disk
+        budget leaves alone), named after the params and the view. Returns the exported file.
+        """
+        view = views.normalize(view)
+        filename = self.image_path_with_params(params, base=base)
+        img = self.find_output_image(filename)
+        if img is None:
+            raise FileNotFoundError(f"Not in the cache: {filename}")
+        params = {**params, **view}
+        path = self.output_path() / output_cache.EXPORT_DIR / self.image_path_with_params(params, base=base)
+        path.parent.mkdir(exist_ok=True)
+        metadata.save_image(views.apply(img, view), path, self.image_info(params), self.find_latents(filename))
+        logger(f"Exported {path.name}")
+        return path
 
     def image_path_with_params(self, dictionary: dict, include_key: bool=False, base: str="base") -> str:
         args_str = '-'.join(f"{key}_{value}" for key, value in dictionary.items())
@@ -142,8 +480,21 @@ class GanGenerator:
             args_str += '-' + '-'.join(f"{key}_{value}" for key, value in dictionary.items())
         return f"{base}-{args_str}.{global_state.image_format}"
 
+    def pinned(self) -> GanGenerator:
+        """A view of the generator bound to the model loaded now, for streams that span many scheduler
+        slots. It shares the scheduler and the cache; set_model on either one leaves the other alone."""
+        return copy.copy(self)
+
     def output_path(self):
-        return self.outputRoot / ".".join(self.model_name.split(".")[:-1])
+        return self.outputRoot / self.fingerprint[:16]
+
+    def profile_path(self) -> Path:
+        return self.outputRoot / profiling.PROFILE_DIR
+
+    def image_file(self, filename: str) -> Path:
+        if filename.startswith("preview-"): # previews have their own tree
+            return output_cache.shard_path(self.output_path() / output_cache.PREVIEW_DIR, filename)
+        return output_cache.shard_path(self.output_path(), filename)
 
     def find_or_generate_base_image(self, seed: int, psi: float, w: Union[torch.Tensor, None]=None) -> (Image.Image, torch.Tensor):
         params = {'seed': seed, 'psi': psi}
@@ -154,10 +505,10 @@ class GanGenerator:
                 img, w = self.generate_base_image(seed=seed, psi=psi)
             else:
                 # load vector weights from image metadata
-                p = metadata.parse_params_from_image(img)
-                w = p.get('tensor')
+                w = metadata.parse_latents_from_image(img).get('tensor')
+                metrics.cache_requests.inc('latent', 'miss' if w is None else 'hit')
                 if w is not None:
-                    w = str_utils.str2tensor(w).to(self.device)
+                    w = w.to(self.device)
                     logger(f"Tensor found in metadata: {w.shape}")
                 else:
                     logger("Tensor not found... regenerating")
@@ -165,17 +516,23 @@ class GanGenerator:
                 msg += " (cached on disk)"
         else:
             img, w = self.generate_base_image(seed=seed, psi=psi, w=w)
-            vstr = str_utils.tensor2str(w)
-            msg = f"Rendered from encoded Tensor V{str_utils.crc_hash(vstr)}"
+            msg = f"Rendered from encoded Tensor V{str_utils.latent_hash(w)}"
 
         logger(msg)
 
         return img, w
 
     def find_output_image(self, filename: str) -> Union[None, Image.Image]:
-        path = self.output_path() / filename
+        path = self.image_file(filename)
         if path.exists():
-            return Image.open(path)
+            output_cache.touch(path)
+            try:
+                img = Image.open(path)
+                metrics.cache_requests.inc('image', 'hit')
+                return img
+            except (OSError, ValueError) as e:
+                logger(f"Ignoring unreadable cached image {filename}: {e}")
+        metrics.cache_requests.inc('image', 'miss')
 
     # Make note that there are two return values here!
     def generate_base_image(self, seed: int, psi: float, w: Union[torch.Tensor,None]=None) -> (Image.Image, torch.Tensor):
@@ -187,59 +544,93 @@ class GanGenerator:
         w = self.GAN.get_w_from_seed(**params)
         img = self.GAN.w_to_image(w)
         path = self.image_path_with_params(params)
-        params['tensor'] = str_utils.tensor2str(w)
-        self.save_image_to_file(img, path, params)
+        self.save_image_to_file(img, path, params, {'tensor': w})
         return img, w
 
-    def save_image_to_file(self, image: Image.Image, filename: str, params: dict = None):
-        path = self.output_path() / filename
-        info = {
+    def save_image_to_file(self, image: Image.Image, filename: str, params: dict = None, latents: dict = None):
+        path = self.image_file(filename)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with stage('save'):
+            size = metadata.save_image(image, path, self.image_info(params), latents)
+        metrics.cache_written_bytes.inc(amount=size)
+        self.cache.added(size)
+
+    def find_latents(self, filename: str) -> dict[str, torch.Tensor]:
+        """Latents of a cached image, or those kept after it was evicted."""
+        path = self.image_file(filename)
+        if path.exists():
+            latents = metadata.parse_latents_from_image(path)
+            metrics.cache_requests.inc('latent', 'hit' if latents else 'miss')
+            return latents
+        latents = output_cache.load_latents(self.output_path(), filename)
+        metrics.cache_requests.inc('latent_store', 'hit' if latents else 'miss')
+        with stage('decode'):
+            return {key: str_utils.bytes2tensor(blob) for key, blob in latents.items()}
+
+    def image_info(self, params: dict) -> dict:
+        return {
             'model': self.model_name,
+            'fingerprint': self.fingerprint, # also stamped into the latent headers
             **params,
-            'extension': 'gan-generator',
+            'extension': metadata.EXTENSION,
         }
-        save_image_with_geninfo(image, str(info), str(path))
+
+    def made_image(self, path: Path) -> Union[bool, None]:
+        """Whether a cached image was rendered by the loaded model: by its fingerprint or, for images
+        from before fingerprints, by mapping its seed again. None if the image tells neither."""
+        try:
+            params = metadata.parse_params_from_image(path)
+            if params.get('fingerprint'):
+                return params['fingerprint'] == self.fingerprint
+            if 'seed2' in params or not {'seed', 'psi'} <= params.keys():
+                return None
+            w = metadata.parse_latents_from_image(path).get('tensor')
+        except (OSError, ValueError) as e:
+            logger(f"Ignoring unreadable cached image {path.name}: {e}")
+            return None
+        if w is None:
+            return None
+        expected = self.GAN.get_w_from_seed(int(params['seed']), float(params['psi'])).detach().cpu()
+        return tuple(w.shape) == tuple(expected.shape) and torch.allclose(w.float(), expected.float(), atol=1e-4)
+
+    def read_output_bytes(self, filename: str) -> bytes:
+        with open(self.image_file(filename), 'rb') as f:
+            return f.read()
 
     ### Class Methods
 
+    @classmethod
+    def shared(cls) -> GanGenerator:
+        """The instance shared by the UI tab and the API."""
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
     @classmethod
     def newSeed(cls) -> int:
         return random.randint(0, 0xFFFFFFFF - 1)
 
     @classmethod
-    def xfade(cls, a,b,x):
-        return a*(1.0-x) + b*x # basic linear interpolation
+    def gallery_seeds(cls, start: int, page: int, page_size: int, at_random: bool=False) -> list[int]:
+        """Seeds of a gallery page: consecutive from start, or drawn at random with start as the key (same key, same pages)."""
+        if at_random:
+            return np.random.default_rng([start, page]).integers(0, 0xFFFFFFFF - 1, size=page_size, endpoint=True).tolist()
+        first = start + page * page_size
+        return list(range(first, min(first + page_size, 0xFFFFFFFF)))
 
     @classmethod
-    def mix_weights(cls, w1: torch.Tensor, w2: torch.Tensor, amt: float, mask: Union[str,int]) -> torch.Tensor:
-        if isinstance(mask, str):
-            match mask:
-                case "coarse":
-                    mask = 0xFF00
-                case "mid":
-                    mask = 0x0FF0
-                case "fine":
-                    mask = 0x00FF
-                case "total":
-                    mask = 0xFFFF
-                case _:
-                    mask = str_utils.str2num(mask)
-
-        w_mix = w1.clone() # transfer onto L image as default
-
-        if mask == 0xFFFF:
-            amt = cls.jmap(amt, -1.0, 1.0, 0.0, 1.0) # make unipolar
-        else:
-            if amt > 0: # transfer L onto R
-                w_mix = w2.clone()
-            else: # transfer R onto L
-                amt = abs(amt)
-                w1,w2 = w2,w1 # swap L and R
+    def xfade(cls, a,b,x):
+        return a*(1.0-x) + b*x # basic linear interpolation
 
-        mask = cls.num2mask(mask)
-        w_mix[:,mask,:] = cls.xfade(w1[:,mask,:], w2[:,mask,:], amt)
+    def mix_weights(self, w1: torch.Tensor, w2: torch.Tensor, amt: float, mask: Union[str,int]) -> torch.Tensor:
+        return self.GAN.mixer.mix(w1, w2, amt, mask)[0]
 
-        return w_mix
+    def mix_weights_grid(self, w1: torch.Tensor, w2: torch.Tensor, amt: float, mask: Union[str,int]) -> torch.Tensor:
+        """
+        Mix every pair: w1 [M, num_ws, w_dim] and w2 [N, num_ws, w_dim] are broadcast against
+        each other into a [M, N, num_ws, w_dim] tensor.
+        """
+        return self.GAN.mixer.mix(w1.unsqueeze(1), w2.unsqueeze(0), amt, mask)[0]
 
     # experimental function to control weighting vector
     @classmethod
@@ -1,30 +1,60 @@
 from __future__ import annotations
-from typing import Union
+from typing import Union, List
 
 import torch
 import torch.nn as nn
-import torch_utils
-import dnnlib
 import pickle
+import time
+from pathlib import Path
 
 import numpy as np
 from PIL import Image
 
+from .mix_engine import MixEngine
+from .image_batch import ImageBatch
+from .preview import Preview
+from .timing import stage
+from . import metrics
+
 class GanModel:
-    def __init__(self, model: str, device: str='cpu'):
+    def __init__(self, model: Union[str, nn.Module], device: str='cpu', name: str=None):
         # WARNING: Verify StyleGAN3 checkpoints before loading.
         # Safety check needs to be disabled because required classes
         # in StyleGAN3 (e.g. torch_utils) are not included in 
         # sd-webui approved class list. Use of this extension is
         # at your own risk.
-        with open(model, 'rb') as f:
-            self.G = pickle.load(f)['G_ema']
+        if isinstance(model, nn.Module): # already loaded, e.g. attached from shared memory
+            self.G = model
+        else:
+            import torch_utils, dnnlib # the pickled networks need them, imported on first load only
+            with open(model, 'rb') as f:
+                self.G = pickle.load(f)['G_ema']
         self.G.eval()
+        self.name = name or (Path(model).name if isinstance(model, (str, Path)) else type(model).__name__)
         self.set_device(device)
 
+    def share_memory(self) -> GanModel:
+        """
+        Move parameters and buffers into shared memory, so worker processes that receive self.G
+        through torch.multiprocessing attach to the same storage instead of copying it.
+        """
+        assert self.device == 'cpu', "shared memory weights are only supported on the cpu"
+        self.G.share_memory()
+        return self
+
     def set_device(self, device: str):
         self.device = device
         self.G.to(device)
+        self.mixer = MixEngine(self.num_ws, device)
+        self.previews = {} # size -> Preview, their projections live on the device
+
+    @property
+    def num_ws(self) -> int:
+        return self.G.mapping.num_ws
+
+    @property
+    def w_dim(self) -> int:
+        return self.G.mapping.w_dim
 
     @property
     def img_resolution(self) -> int:
@@ -35,18 +65,52 @@ class GanModel:
         Get an image/np.ndarray from a dlatent W using G and the selected noise_mode. The final shape of the
         returned image will be [len(dlatents), G.img_resolution, G.img_resolution, G.img_channels].
         """
+        images = self.w_to_images(dlatents, noise_mode)
+        return images[0] if len(images) == 1 else images
+
+    def w_to_images(self, dlatents: torch.Tensor, noise_mode: str = 'const', batch_size: int = None) -> List[Image.Image]:
+        """
+        Same as w_to_image, but always returns a list. If batch_size is given, the dlatents are
+        synthesized in chunks of at most that many images.
+        """
+        return self.w_to_batch(dlatents, noise_mode, batch_size).images()
+
+    def w_to_previews(self, dlatents: torch.Tensor, size: int, noise_mode: str = 'const', batch_size: int = None) -> ImageBatch:
+        """Low resolution previews of dlatents from the first layers of the network, see preview.py."""
+        return self.w_to_batch(dlatents, noise_mode, batch_size, preview=size)
+
+    def preview(self, size: int) -> Preview:
+        if size not in self.previews:
+            self.previews[size] = Preview(self.G, size)
+        return self.previews[size]
+
+    def w_to_batch(self, dlatents: torch.Tensor, noise_mode: str = 'const', batch_size: int = None, preview: int = None) -> ImageBatch:
+        """
+        Synthesize dlatents in chunks of at most batch_size into one host ImageBatch. Chunks are
+        copied out without waiting for the device, so callers that only encode or write the
+        images skip the per-image PIL conversion. preview is a preview size, see w_to_previews.
+        """
         assert isinstance(dlatents, torch.Tensor), f'dlatents should be a torch.Tensor!: "{type(dlatents)}"'
         if len(dlatents.shape) == 2:
             dlatents = dlatents.unsqueeze(0)  # An individual dlatent => [1, G.mapping.num_ws, G.mapping.w_dim]
-        try:
-            img = self.G.synthesis(dlatents, noise_mode=noise_mode)
-        except:
-            img = self.G.synthesis(dlatents, noise_mode=noise_mode, force_fp32=True)
-        img = (img.permute(0, 2, 3, 1) * 127.5 + 128).clamp(0, 255).to(torch.uint8)
-
-        img = img.cpu().numpy()
-        images = [Image.fromarray(i) for i in img]
-        return images[0] if len(images) == 1 else images
+        synthesis = self.G.synthesis if preview is None else self.preview(preview)
+        batch = None
+        start = 0
+        for chunk in dlatents.split(batch_size or len(dlatents)):
+            t0 = time.perf_counter()
+            with stage('synthesis', self.device):
+                try:
+                    img = synthesis(chunk, noise_mode=noise_mode)
+                except:
+                    img = synthesis(chunk, noise_mode=noise_mode, force_fp32=True)
+            with stage('to_pil', self.device):
+                if batch is None:
+                    batch = ImageBatch(len(dlatents), img.shape[2], img.shape[3], img.shape[1], img.device)
+                batch.write(start, img)
+            start += len(chunk)
+            metrics.synthesis_seconds.observe(time.perf_counter() - t0, self.name)
+            metrics.images_rendered.inc(self.name, amount=len(chunk))
+        return batch
 
     def random_z_dim(self, seed: int) -> np.ndarray:
         return np.random.RandomState(seed).randn(1, self.G.z_dim).astype(np.float32)
@@ -54,7 +118,8 @@ class GanModel:
     def get_w_from_seed(self, seed: int, psi: float) -> torch.Tensor:
         """Get the dlatent from a random seed, using the truncation trick (this could be optional)"""
         z = torch.from_numpy( self.random_z_dim(seed) ).to(self.device)
-        w = self.G.mapping(z, None)
+        with stage('mapping', self.device):
+            w = self.G.mapping(z, None)
         return self.blend_w_with_mean(w, psi)
 
     def get_w_from_mean_z(self, psi: float) -> torch.Tensor:
@@ -65,7 +130,7 @@ class GanModel:
     def get_w_from_mean_w(self) -> torch.Tensor:
         """Get the dlatent of the mean w space"""
         # how is this different than self.get_w_from_mean_z(0) ?
-        w = self.G.mapping.w_avg.unsqueeze(0).unsqueeze(0).repeat(1, 16, 1).to(self.device)
+        w = self.G.mapping.w_avg.unsqueeze(0).unsqueeze(0).repeat(1, self.num_ws, 1).to(self.device)
         return w
 
     def blend_w_with_mean(self, w: torch.Tensor, psi: float=0.7) -> torch.Tensor:
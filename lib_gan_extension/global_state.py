@@ -1,12 +1,23 @@
-
-gen_device: "cpu"
-image_format: "png"
-image_pad: 1.0
+device = "cpu"
+image_format = "png"
+image_pad = 1.0
+batch_size = 4
+interactive_target = 0.5 # seconds an interactive request may wait behind a bulk batch
+cache_budget = 0.0 # GB of rendered images to keep, 0 for no limit
+warm_up = False # load and exercise the default model when the webui starts
+stage_timing = False # time the stages of each render, see timing.py
+preview_size = 256 # pixels, see preview.py
 
 def init():
-  global gen_device
+  global device
   global image_format
   global image_pad
+  global batch_size
+  global interactive_target
+  global cache_budget
+  global warm_up
+  global stage_timing
+  global preview_size
 
 def logger(*args):
     msg = " ".join(map(str, args))
@@ -0,0 +1,76 @@
+from __future__ import annotations
+from typing import Union, List
+import numpy as np
+import torch
+from PIL import Image
+
+# Output stage of a batched render. Synthesized batches are converted to uint8 NHWC on their device
+# and copied into one contiguous host buffer. On cuda the buffer is pinned and the copies run on a
+# side stream, so the copy of a batch overlaps the synthesis of the next one and the host only
+# waits when pixels are first read. Images are handed out as views of the buffer: pixels() and
+# view() never copy, and image() maps the buffer into PIL for 'L' and 'RGBA' (PIL stores RGB as 4
+# bytes per pixel, so an RGB image is unpacked once, as Image.fromarray did). Callers that only encode or write files take
+# image(i) one at a time instead of holding a PIL image per render.
+MODES = {1: 'L', 3: 'RGB', 4: 'RGBA'}
+_streams = {} # device -> copy stream
+
+def copy_stream(device: torch.device) -> torch.cuda.Stream:
+    if device not in _streams:
+        _streams[device] = torch.cuda.Stream(device)
+    return _streams[device]
+
+class ImageBatch:
+    def __init__(self, count: int, height: int, width: int, channels: int, device: Union[str, torch.device]='cpu'):
+        if channels not in MODES:
+            raise ValueError(f"Unsupported number of image channels: {channels}")
+        self.device = torch.device(device)
+        self.pinned = self.device.type == 'cuda' and torch.cuda.is_available()
+        # pinned blocks come from torch's caching host allocator, so repeated batches reuse them
+        self.tensor = torch.empty((count, height, width, channels), dtype=torch.uint8, pin_memory=self.pinned)
+        self.array = self.tensor.numpy() # shares the memory of self.tensor
+        self.mode = MODES[channels]
+        self._event = None
+
+    def __len__(self) -> int:
+        return len(self.tensor)
+
+    def write(self, start: int, images: torch.Tensor) -> None:
+        """Queue the copy of synthesis output ([N, C, H, W] in [-1, 1]) into images start..start+N."""
+        images = (images.permute(0, 2, 3, 1) * 127.5 + 128).clamp(0, 255)
+        out = self.tensor[start:start + len(images)]
+        if images.device.type == 'cpu':
+            out.copy_(images) # truncates to uint8 like .to(torch.uint8), without an intermediate tensor
+            return
+        images = images.to(torch.uint8)
+        if not self.pinned:
+            out.copy_(images)
+            return
+        stream = copy_stream(images.device)
+        stream.wait_stream(torch.cuda.current_stream(images.device))
+        with torch.cuda.stream(stream):
+            out.copy_(images, non_blocking=True)
+        images.record_stream(stream) # not reused by the caching allocator before the copy is done
+        self._event = torch.cuda.Event()
+        self._event.record(stream)
+
+    def wait(self) -> None:
+        """Block until the queued copies have landed in the buffer."""
+        if self._event is not None:
+            self._event.synchronize()
+            self._event = None
+
+    def pixels(self, i: int) -> np.ndarray:
+        """uint8 [H, W, C] view of image i."""
+        self.wait()
+        return self.array[i]
+
+    def view(self, i: int) -> memoryview:
+        """Raw bytes of image i (rows of interleaved channels), without a copy."""
+        return memoryview(self.pixels(i)).cast('B')
+
+    def image(self, i: int) -> Image.Image:
+        height, width = self.array.shape[1:3]
+        return Image.frombuffer(self.mode, (width, height), self.view(i), 'raw', self.mode, 0, 1)
+
+    def images(self) -> List[Image.Image]:
+        return [self.image(i) for i in range(len(self))]
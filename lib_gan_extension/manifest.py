@@ -0,0 +1,172 @@
+from __future__ import annotations
+from typing import Union
+import base64
+import json
+import os
+import socket
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from . import file_utils
+
+MANIFEST_VERSION = 1
+CLAIM_TIMEOUT = 600 # seconds without a checkpoint before another worker may take over a shard
+
+class JobManifest:
+    """
+    Resumable batch job. The manifest is a JSON file holding the job spec, its shards (contiguous
+    item ranges) with a completion bitmap and owner each, and the layout of the latent store: a
+    flat file with one fixed-size float32 w record per item at latent_offset + index * record_size.
+    All updates happen under a file lock and are written atomically, so several local worker
+    processes can claim shards from the same manifest.
+    """
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + '.lock')
+        self.latent_path = self.path.with_name(self.path.stem + '.latents')
+
+    @classmethod
+    def create(cls, path: Union[str, Path], job: dict, num_items: int, shard_size: int) -> JobManifest:
+        manifest = cls(path)
+        shards = [{
+            'start': start,
+            'count': min(shard_size, num_items - start),
+            'done': bitmap2str(bytearray((min(shard_size, num_items - start) + 7) // 8)),
+            'complete': False,
+            'owner': None,
+            'latent_offset': None,
+        } for start in range(0, num_items, shard_size)]
+        data = {
+            'version': MANIFEST_VERSION,
+            'job': job,
+            'num_items': num_items,
+            'shards': shards,
+            'latents': {'file': manifest.latent_path.name, 'num_ws': None, 'w_dim': None, 'record_size': None, 'fingerprint': None},
+        }
+        with file_utils.file_lock(manifest.lock_path):
+            if manifest.path.exists():
+                raise FileExistsError(f"Manifest already exists: {manifest.path}")
+            manifest.write(data)
+        return manifest
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def read(self) -> dict:
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported manifest version: {data.get('version')}")
+        return data
+
+    def write(self, data: dict) -> None:
+        file_utils.atomic_write(self.path, json.dumps(data, indent=1).encode('utf-8'))
+
+    @contextmanager
+    def update(self):
+        """Read-modify-write the manifest under the lock."""
+        with file_utils.file_lock(self.lock_path):
+            data = self.read()
+            yield data
+            self.write(data)
+
+    @property
+    def job(self) -> dict:
+        return self.read()['job']
+
+    def claim(self, num_ws: int, w_dim: int, fingerprint: str=None) -> Union[tuple[int, dict], None]:
+        """Claim the next incomplete shard that nobody else is working on. Returns (index, shard) or None."""
+        now = time.time()
+        with self.update() as data:
+            self.init_latents(data, num_ws, w_dim, fingerprint)
+            for index, shard in enumerate(data['shards']):
+                if shard['complete'] or not self.claimable(shard['owner'], now):
+                    continue
+                shard['owner'] = owner(now)
+                return index, shard
+        return None
+
+    @classmethod
+    def claimable(cls, shard_owner: Union[dict, None], now: float) -> bool:
+        if shard_owner is None or now - shard_owner['time'] > CLAIM_TIMEOUT:
+            return True
+        if shard_owner['host'] == socket.gethostname():
+            return not pid_alive(shard_owner['pid'])
+        return False
+
+    def init_latents(self, data: dict, num_ws: int, w_dim: int, fingerprint: str=None) -> None:
+        latents = data['latents']
+        if latents['record_size'] is None:
+            latents.update(num_ws=num_ws, w_dim=w_dim, record_size=w_dim * 4, fingerprint=fingerprint)
+            for shard in data['shards']:
+                shard['latent_offset'] = shard['start'] * latents['record_size']
+            with open(self.latent_path, 'ab') as f:
+                f.truncate(data['num_items'] * latents['record_size']) # sparse where supported
+        elif (latents['num_ws'], latents['w_dim']) != (num_ws, w_dim):
+            raise ValueError(f"Model does not match the job's latent store: {num_ws}x{w_dim} vs {latents['num_ws']}x{latents['w_dim']}")
+        elif None not in (latents.get('fingerprint'), fingerprint) and latents['fingerprint'] != fingerprint:
+            raise ValueError(f"Model file changed since the job started: fingerprint {fingerprint[:16]} vs {latents['fingerprint'][:16]}")
+
+    def checkpoint(self, index: int, done: list[int]) -> dict:
+        """Mark items (indices within the shard) as done and renew the claim. Returns the shard."""
+        with self.update() as data:
+            shard = data['shards'][index]
+            bitmap = str2bitmap(shard['done'])
+            for i in done:
+                bitmap[i // 8] |= 1 << (i % 8)
+            shard['done'] = bitmap2str(bitmap)
+            shard['complete'] = all(bitmap_get(bitmap, i) for i in range(shard['count']))
+            shard['owner'] = None if shard['complete'] else owner(time.time())
+        return shard
+
+    def release(self, index: int) -> None:
+        with self.update() as data:
+            data['shards'][index]['owner'] = None
+
+    def progress(self) -> (int, int):
+        data = self.read()
+        done = sum(bin(b).count('1') for shard in data['shards'] for b in str2bitmap(shard['done']))
+        return done, data['num_items']
+
+    def write_latents(self, shard: dict, rows: dict[int, torch.Tensor]) -> None:
+        """Store w rows ({index within shard: [w_dim]}) into the shard's slots of the latent store."""
+        with open(self.latent_path, 'r+b') as f:
+            for i, row in rows.items():
+                record = row.detach().cpu().numpy().astype('<f4').tobytes()
+                f.seek(shard['latent_offset'] + i * len(record))
+                f.write(record)
+
+    def read_latent(self, item: int) -> torch.Tensor:
+        """The [1, num_ws, w_dim] w of a completed item from the latent store."""
+        latents = self.read()['latents']
+        with open(self.latent_path, 'rb') as f:
+            f.seek(item * latents['record_size'])
+            row = np.frombuffer(f.read(latents['record_size']), dtype='<f4')
+        return torch.from_numpy(row.copy()).view(1, 1, -1).repeat(1, latents['num_ws'], 1)
+
+def owner(now: float) -> dict:
+    return {'pid': os.getpid(), 'host': socket.gethostname(), 'time': now}
+
+def pid_alive(pid: int) -> bool:
+    if os.name == 'nt': # os.kill would terminate the process, rely on CLAIM_TIMEOUT instead
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        pass # exists (or cannot be probed on this platform)
+    return True
+
+def bitmap2str(bitmap: bytearray) -> str:
+    return base64.b64encode(bytes(bitmap)).decode('ascii')
+
+def str2bitmap(encoded: str) -> bytearray:
+    return bytearray(base64.b64decode(encoded))
+
+def bitmap_get(bitmap: bytearray, i: int) -> bool:
+    return bool(bitmap[i // 8] & (1 << (i % 8)))
@@ -1,22 +1,205 @@
 from __future__ import annotations
 from typing import Union
 import ast
-from PIL import Image
+import io
+import json
+import struct
+from pathlib import Path
+from PIL import Image, PngImagePlugin
+import torch
 from .global_state import logger
+from . import str_utils, file_utils
+from .timing import stage
 
-import modules
-from modules.images import read_info_from_image
+try:
+    from modules.images import read_info_from_image
+except ImportError: # running outside of the webui
+    read_info_from_image = None
+
+# Params are stored as JSON in a text chunk, latents as raw codec blobs in their own chunks, so
+# reading them never decodes pixels nor parses a 40 KB literal.
+#   PNG:  tEXt 'parameters' (JSON, shown in the webui's PNG Info tab), private chunk 'gaNw' per
+#         latent (key \0 blob), and tEXt 'gan-latents' with the latents as codec strings (JSON). PIL
+#         keeps only text chunks in img.info, so the text copy survives re-encoding (e.g. by gradio).
+#         Files of the previous layout have the JSON in tEXt 'gan-generator' instead.
+#   JPEG: COM segments 'gan-generator\0' + JSON and 'gan-latent\0' + key \0 blob, after APP0. A
+#         payload over the 64 KB segment limit continues in further segments with the same prefix.
+EXTENSION = 'gan-generator'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_LATENT_CHUNK = b'gaNw'
+PNG_LATENT_TEXT = 'gan-latents'
+JPEG_PARAMS_PREFIX = b'gan-generator\0'
+JPEG_LATENT_PREFIX = b'gan-latent\0'
+JPEG_SEGMENT_MAX = 0xFFFF - 2 # payload bytes of one segment
+JPEG_QUALITY = 95
+LATENT_KEYS = ('tensor', 'tensor1', 'tensor2')
+
+def save_image(image: Image.Image, path: Union[str, Path], params: dict, latents: dict = None) -> int:
+    with stage('encode'):
+        data = encode_image(image, Path(path).suffix[1:], params, latents)
+    # an interrupted render never leaves a truncated file behind in the cache
+    file_utils.atomic_write(path, data, fsync=False)
+    return len(data)
+
+def encode_image(image: Image.Image, image_format: str, params: dict, latents: dict = None) -> bytes:
+    info = json.dumps(params)
+    latents = {key: str_utils.tensor2bytes(w, fingerprint=params.get('fingerprint'))
+                for key, w in (latents or {}).items() if w is not None}
+    if image_format.lower() == 'png':
+        pnginfo = PngImagePlugin.PngInfo()
+        pnginfo.add_text('parameters', info)
+        for key, blob in latents.items():
+            pnginfo.add(PNG_LATENT_CHUNK, key.encode('ascii') + b'\0' + blob)
+        if latents:
+            pnginfo.add_text(PNG_LATENT_TEXT, json.dumps({key: str_utils.bytes2str(blob) for key, blob in latents.items()}))
+        with io.BytesIO() as f:
+            image.save(f, format='PNG', pnginfo=pnginfo)
+            data = f.getvalue()
+    else:
+        with io.BytesIO() as f:
+            image.convert('RGB').save(f, format='JPEG', quality=JPEG_QUALITY)
+            data = f.getvalue()
+        segments = jpeg_segments(JPEG_PARAMS_PREFIX, info.encode('utf-8'))
+        for key, blob in latents.items():
+            segments += jpeg_segments(JPEG_LATENT_PREFIX + key.encode('ascii') + b'\0', blob)
+        start = 2 # after SOI, and after APP0 which JFIF requires to come first
+        if data[2:4] == b'\xff\xe0':
+            start += 2 + struct.unpack_from('>H', data, 4)[0]
+        data = data[:start] + b''.join(segments) + data[start:]
+    return data
+
+def jpeg_segments(prefix: bytes, data: bytes) -> list[bytes]:
+    """COM segments of prefix + data, split into as many as the segment length allows."""
+    size = JPEG_SEGMENT_MAX - len(prefix)
+    return [b'\xff\xfe' + struct.pack('>H', len(prefix) + len(part) + 2) + prefix + part
+                for part in (data[i:i + size] for i in range(0, max(len(data), 1), size))]
+
+def read_chunks(path: Union[str, Path]) -> (Union[str, None], Union[str, None], dict):
+    """
+    Scan the headers of a PNG or JPEG for our metadata without decoding pixels.
+    Returns (json params, legacy 'parameters' text, {key: latent blob}).
+    """
+    info, legacy, latents, latent_text = None, None, {}, None
+    with open(path, 'rb') as f:
+        head = f.read(8)
+        if head == PNG_SIGNATURE:
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    break
+                length, cid = struct.unpack('>I4s', header)
+                if cid in (b'IDAT', b'IEND'):
+                    break
+                if cid == b'tEXt':
+                    key, _, text = f.read(length).partition(b'\0')
+                    if key == EXTENSION.encode('ascii'):
+                        info = text.decode('latin-1')
+                    elif key == b'parameters':
+                        legacy = text.decode('latin-1')
+                    elif key == PNG_LATENT_TEXT.encode('ascii'):
+                        latent_text = text.decode('latin-1')
+                    f.seek(4, 1)
+                elif cid == PNG_LATENT_CHUNK:
+                    key, _, blob = f.read(length).partition(b'\0')
+                    latents[key.decode('ascii')] = blob
+                    f.seek(4, 1)
+                else:
+                    f.seek(length + 4, 1)
+        elif head[:2] == b'\xff\xd8':
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF or marker[1] in (0xDA, 0xD9): # start of scan / end
+                    break
+                if 0xD0 <= marker[1] <= 0xD7 or marker[1] == 0x01: # no length field
+                    continue
+                length, = struct.unpack('>H', f.read(2))
+                if marker[1] == 0xFE:
+                    payload = f.read(length - 2)
+                    if payload.startswith(JPEG_PARAMS_PREFIX):
+                        info = (info or b'') + payload[len(JPEG_PARAMS_PREFIX):]
+                    elif payload.startswith(JPEG_LATENT_PREFIX):
+                        key, _, blob = payload[len(JPEG_LATENT_PREFIX):].partition(b'\0')
+                        latents[key.decode('ascii')] = latents.get(key.decode('ascii'), b'') + blob
+                else:
+                    f.seek(length - 2, 1)
+            info = info.decode('utf-8') if info is not None else None
+    if info is None and is_params_json(legacy):
+        info, legacy = legacy, None
+    if not latents and latent_text is not None:
+        latents = latent_blobs(latent_text)
+    return info, legacy, latents
+
+def is_params_json(text: Union[str, None]) -> bool:
+    # JSON params start with '{"', legacy geninfo is a python literal starting with "{'"
+    return text is not None and text.startswith('{"')
+
+def latent_blobs(text: str) -> dict:
+    """{key: blob} from the text copy of the latents."""
+    try:
+        return {key: str_utils.str2bytes(value) for key, value in json.loads(text).items()}
+    except (ValueError, AttributeError):
+        return {}
+
+def image_path(img: Union[str, Path, Image.Image, None]) -> Union[str, None]:
+    if isinstance(img, (str, Path)):
+        return str(img)
+    return getattr(img, 'filename', None) or None
 
 def parse_params_from_image(img: Union[str,Image.Image]) -> dict:
-    if isinstance(img, str):
+    """Params of an image made by this extension, with latents as str_utils strings (or {})."""
+    p, latents = parse_image(img)
+    for key, blob in latents.items():
+        p[key] = str_utils.bytes2str(blob)
+    return p
+
+def parse_latents_from_image(img: Union[str,Image.Image]) -> dict[str, torch.Tensor]:
+    """Latents of an image made by this extension, decoded to tensors."""
+    with stage('metadata'):
+        p, latents = parse_image(img)
+    with stage('decode'):
+        latents = {key: str_utils.bytes2tensor(blob) for key, blob in latents.items()}
+        for key in LATENT_KEYS: # legacy files keep latents inside the params
+            if key not in latents and isinstance(p.get(key), str):
+                latents[key] = str_utils.str2tensor(p[key])
+    return latents
+
+def parse_image(img: Union[str,Image.Image]) -> (dict, dict):
+    path = image_path(img)
+    if path is not None and Path(path).exists():
+        info, legacy, latents = read_chunks(path)
+        if info is not None:
+            return json.loads(info), latents
+        if legacy is not None:
+            return parse_legacy_geninfo(legacy), {}
+    return parse_legacy_params(img)
+
+def parse_legacy_params(img: Union[str,Image.Image]) -> (dict, dict):
+    """Params and latent blobs from the text chunks PIL keeps in img.info."""
+    if img is None:
+        return {}, {}
+    if isinstance(img, (str, Path)):
         img = Image.open(img)
-    geninfo,_ = read_info_from_image(img)
-    if geninfo is not None:
-        p = ast.literal_eval(geninfo)
-        while 'parameters' in p:
-            p = p.pop('parameters',None)
-        # logger(f"loaded {img.format} params: {repr(p)}")
-        if p['extension'] == 'gan-generator':
-            return p
+    latents = latent_blobs(img.info[PNG_LATENT_TEXT]) if PNG_LATENT_TEXT in img.info else {}
+    for info in (img.info.get(EXTENSION), img.info.get('parameters')):
+        if is_params_json(info):
+            return json.loads(info), latents
+    if read_info_from_image is not None:
+        geninfo,_ = read_info_from_image(img)
     else:
+        geninfo = img.info.get('parameters')
+    return parse_legacy_geninfo(geninfo), latents
+
+def parse_legacy_geninfo(geninfo: Union[str, None]) -> dict:
+    if geninfo is None:
+        return {}
+    try:
+        p = ast.literal_eval(geninfo)
+    except (ValueError, SyntaxError):
         return {}
+    while isinstance(p, dict) and 'parameters' in p:
+        p = p.pop('parameters',None)
+    # logger(f"loaded legacy params: {repr(p)}")
+    if isinstance(p, dict) and p.get('extension') == EXTENSION:
+        return p
+    return {}
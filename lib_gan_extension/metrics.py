@@ -0,0 +1,152 @@
+from __future__ import annotations
+from typing import Callable, Iterable
+import bisect
+import math
+import threading
+
+# In-process metrics in the Prometheus text format (served by api.py at /metrics). Counters and
+# histograms keep one shard per thread, so the render path updates plain dicts without taking a
+# lock; a scrape sums the shards. Gauges are callbacks evaluated at scrape time.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0) # seconds
+
+def _snapshot(d: dict) -> list:
+    # a shard may gain a key while it is read from another thread
+    while True:
+        try:
+            return list(d.items())
+        except RuntimeError:
+            pass
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names: tuple[str, ...], values: tuple, le: str=None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock() # only taken when a thread creates its shard
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount: float=1) -> None:
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self) -> dict[tuple, float]:
+        totals = {}
+        for shard in self._shards:
+            for labels, value in _snapshot(shard):
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self) -> list[str]:
+        return self.header() + [f"{self.name}{_labels(self.labels, labels)} {value:g}" for labels, value in sorted(self.values().items())]
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]=(), buckets: tuple[float, ...]=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels) -> None:
+        shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0] # per bucket, +Inf, sum
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def values(self) -> dict[tuple, list]:
+        totals = {}
+        for shard in self._shards:
+            for labels, counts in _snapshot(shard):
+                total = totals.setdefault(labels, [0] * len(counts))
+                for i, n in enumerate(list(counts)):
+                    total[i] += n
+        return totals
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for labels, counts in sorted(self.values().items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                le = '+Inf' if bound == math.inf else f'{bound:g}'
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {counts[-1]:g}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...]=(), fn: Callable[[], dict]=None):
+        super().__init__(name, help, labels)
+        self.fn = fn # returns {label values: value}
+
+    def render(self) -> list[str]:
+        try:
+            values = self.fn() if self.fn is not None else {}
+        except Exception: # a broken gauge must not take the whole scrape down
+            values = {}
+        return self.header() + [f"{self.name}{_labels(self.labels, labels)} {value:g}" for labels, value in sorted(values.items()) if value is not None]
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, metric: _Metric) -> _Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str]=()) -> Counter:
+        return self.add(Counter(name, help, tuple(labels)))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str]=(), buckets: tuple[float, ...]=LATENCY_BUCKETS) -> Histogram:
+        return self.add(Histogram(name, help, tuple(labels), buckets))
+
+    def gauge(self, name: str, help: str, labels: Iterable[str]=(), fn: Callable[[], dict]=None) -> Gauge:
+        return self.add(Gauge(name, help, tuple(labels), fn))
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics.values() for line in metric.render()) + "\n"
+
+registry = Registry()
+
+images_rendered = registry.counter('gan_images_rendered_total', "Images synthesized", ['model'])
+synthesis_seconds = registry.histogram('gan_synthesis_seconds', "Synthesis time per batch", ['model'])
+request_seconds = registry.histogram('gan_request_seconds', "Time of UI requests, including the queue wait", ['method'])
+cache_requests = registry.counter('gan_cache_requests_total', "Lookups of cached images and latents by result", ['cache', 'result'])
+cache_written_bytes = registry.counter('gan_cache_written_bytes_total', "Bytes of images written to the cache")
+cache_evicted = registry.counter('gan_cache_evicted_total', "Images evicted from the cache")
+cache_evicted_bytes = registry.counter('gan_cache_evicted_bytes_total', "Bytes of images evicted from the cache")
+model_loads = registry.counter('gan_model_loads_total', "Models loaded", ['model'])
+model_load_seconds = registry.histogram('gan_model_load_seconds', "Time to load a model", ['model'])
+model_unloads = registry.counter('gan_model_unloads_total', "Models replaced by another one", ['model'])
+seed_search_seconds = registry.histogram('gan_seed_search_seconds', "Time of seed bank searches", ['model'])
+
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
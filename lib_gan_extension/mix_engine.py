@@ -0,0 +1,105 @@
+from __future__ import annotations
+from typing import Union, Sequence
+
+import torch
+
+from . import str_utils
+
+MASK_BITS = 16 # masks are written as 16-bit layer patterns, most significant bit = first (coarsest) layer
+NAMED_MASKS = {
+    "coarse": 0xFF00,
+    "mid": 0x0FF0,
+    "fine": 0x00FF,
+    "total": 0xFFFF,
+}
+MASK_LABELS = { # the mask choices of the UI; cached mixes are named after them
+    0xFFFF: "total (0xFFFF)",
+    0xFF00: "coarse (0xFF00)",
+    0x0FF0: "mid (0x0FF0)",
+    0x00FF: "fine (0x00FF)",
+    0xF0F0: "alt1 (0xF0F0)",
+    0x0F0F: "alt2 (0x0F0F)",
+    0xF00F: "alt3 (0xF00F)",
+}
+
+class MixEngine:
+    """
+    Style mixing for a given model. Layer masks are derived from the model's num_ws and cached as
+    device tensors, so a batch of (amount, mask) pairs is mixed in one broadcasted operation.
+    """
+    def __init__(self, num_ws: int, device: str='cpu'):
+        self.num_ws = num_ws
+        self.device = device
+        self._masks = {}
+
+    @classmethod
+    def parse_mask(cls, mask: Union[str,int]) -> int:
+        if isinstance(mask, str):
+            mask = NAMED_MASKS.get(mask, None) or str_utils.str2num(mask)
+        if mask is None or not 0 <= mask < (1 << MASK_BITS):
+            raise ValueError(f"Invalid layer mask: {mask}")
+        return mask
+
+    @classmethod
+    def mask_label(cls, mask: Union[str,int]) -> str:
+        """The UI's name for a mask ("coarse", 0xFF00 and "coarse (0xFF00)" all give "coarse (0xFF00)")."""
+        mask = cls.parse_mask(mask)
+        return MASK_LABELS.get(mask, f"0x{mask:04X}")
+
+    @classmethod
+    def is_total(cls, mask: int) -> bool:
+        return mask == (1 << MASK_BITS) - 1
+
+    def layer_mask(self, mask: Union[str,int]) -> torch.Tensor:
+        """Boolean [num_ws] tensor on the device. Each of the num_ws layers maps onto the mask bit
+        covering the same relative depth, so 16-bit masks also work for 14 or 18 ws models."""
+        mask = self.parse_mask(mask)
+        if mask not in self._masks:
+            bits = [(mask >> (MASK_BITS - 1 - i * MASK_BITS // self.num_ws)) & 1 for i in range(self.num_ws)]
+            self._masks[mask] = torch.tensor(bits, dtype=torch.bool, device=self.device)
+        return self._masks[mask]
+
+    @classmethod
+    def coefficients(cls, amt: float, mask: int) -> (float, float, bool):
+        """Returns the (w1, w2) crossfade weights for the masked layers, and whether the unmasked
+        layers come from w2."""
+        if cls.is_total(mask):
+            amt = (amt + 1.0) / 2.0 # make unipolar
+            return 1.0 - amt, amt, False
+        if amt > 0: # transfer L onto R
+            return 1.0 - amt, amt, True
+        amt = abs(amt) # transfer R onto L
+        return amt, 1.0 - amt, False
+
+    def mix(self, w1: torch.Tensor, w2: torch.Tensor, amounts: Union[float, Sequence[float]],
+                masks: Union[str, int, Sequence[Union[str,int]]]) -> torch.Tensor:
+        """
+        Mix w1 and w2 ([..., num_ws, w_dim], leading dims broadcast) for every (amount, mask) pair.
+        A single amount or mask is repeated to match the other. Returns [B, ..., num_ws, w_dim].
+        """
+        if isinstance(amounts, (int, float)):
+            amounts = [amounts]
+        if isinstance(masks, (str, int)):
+            masks = [masks]
+        if len(masks) == 1:
+            masks = list(masks) * len(amounts)
+        elif len(amounts) == 1:
+            amounts = list(amounts) * len(masks)
+        assert len(amounts) == len(masks), f"got {len(amounts)} amounts and {len(masks)} masks"
+
+        masks = [self.parse_mask(mask) for mask in masks]
+        coeffs = [self.coefficients(amt, mask) for amt, mask in zip(amounts, masks)]
+        shape = (len(masks),) + (1,) * max(w1.ndim, w2.ndim)
+        c1, c2, from_w2 = (torch.tensor(x, device=w1.device) for x in zip(*coeffs))
+        c1, c2 = c1.to(w1.dtype).view(shape), c2.to(w1.dtype).view(shape)
+        layers = torch.stack([self.layer_mask(mask) for mask in masks]).view(*shape[:-2], self.num_ws, 1)
+
+        w1, w2 = w1.unsqueeze(0), w2.unsqueeze(0)
+        w_base = torch.where(from_w2.view(shape), w2, w1)
+        return torch.where(layers, w1 * c1 + w2 * c2, w_base)
+
+    def mix_sweep(self, w1: torch.Tensor, w2: torch.Tensor, steps: int,
+                    mask: Union[str,int]="total") -> torch.Tensor:
+        """Mix amounts evenly spaced over [-1, 1] with a single mask."""
+        amounts = torch.linspace(-1.0, 1.0, steps).tolist()
+        return self.mix(w1, w2, amounts, mask)
@@ -0,0 +1,280 @@
+from __future__ import annotations
+from typing import Union
+import hashlib
+import json
+import math
+import os
+import pickle
+import threading
+from pathlib import Path
+
+from . import file_utils
+from .global_state import logger
+
+CATALOG_FILE = '.gan-catalog.json'
+CATALOG_VERSION = 2
+GENERATOR_KEYS = ('z_dim', 'c_dim', 'w_dim', 'img_resolution', 'img_channels') # positional init args of G
+FINGERPRINT_CHUNK = 1 << 22
+
+class _Stub(dict):
+    # stands in for every object of the pickle that is not needed for the metadata
+    def __new__(cls, *args, **kwargs):
+        return super().__new__(cls)
+    def __init__(self, *args, **kwargs):
+        pass
+    def __setstate__(self, state):
+        pass
+    def __call__(self, *args, **kwargs):
+        return _Stub()
+
+class _Persistent(dict):
+    def __init__(self, meta: dict):
+        super().__init__(meta)
+
+class _MetadataUnpickler(pickle.Unpickler):
+    """Unpickles a checkpoint without importing or executing anything: tensors become stubs and
+    torch_utils.persistence objects become their meta dicts (class name, module source, state)."""
+    def find_class(self, module: str, name: str):
+        if (module, name) == ('torch_utils.persistence', '_reconstruct_persistent_obj'):
+            return _Persistent
+        if (module, name) == ('collections', 'OrderedDict'):
+            return dict
+        return _Stub
+
+class _HashingReader:
+    # file wrapper feeding everything the unpickler reads into a hash
+    def __init__(self, f, h):
+        self.f = f
+        self.h = h
+    def read(self, n: int=-1) -> bytes:
+        data = self.f.read(n)
+        self.h.update(data)
+        return data
+    def readline(self) -> bytes:
+        data = self.f.readline()
+        self.h.update(data)
+        return data
+    def readinto(self, buffer) -> int:
+        n = self.f.readinto(buffer)
+        self.h.update(memoryview(buffer)[:n])
+        return n
+
+def read_metadata(path: Union[str, Path]) -> dict:
+    """Generator properties of a StyleGAN2/3 pickle, read from the persistent-object init kwargs."""
+    with open(path, 'rb') as f:
+        return parse_metadata(f)
+
+def parse_metadata(f) -> dict:
+    data = _MetadataUnpickler(f).load()
+    G = data.get('G_ema') if isinstance(data, dict) else None
+    if not isinstance(G, _Persistent):
+        raise ValueError("No persistent G_ema in the pickle")
+    state = G.get('state') or {}
+    kwargs = dict(zip(GENERATOR_KEYS, state.get('_init_args') or ()))
+    kwargs.update(state.get('_init_kwargs') or {})
+    src = G.get('module_src') or ''
+    resolution = kwargs.get('img_resolution')
+    if 'class SynthesisInput' in src:
+        architecture = 'stylegan3'
+        num_ws = kwargs.get('num_layers', 14) + 2
+    else:
+        architecture = 'stylegan2'
+        num_ws = int(math.log2(resolution)) * 2 - 2 if resolution else None
+    return {
+        'architecture': architecture,
+        'class_name': G.get('class_name'),
+        'z_dim': kwargs.get('z_dim'),
+        'c_dim': kwargs.get('c_dim'),
+        'w_dim': kwargs.get('w_dim'),
+        'num_ws': num_ws,
+        'img_resolution': resolution,
+        'img_channels': kwargs.get('img_channels'),
+    }
+
+def file_fingerprint(path: Union[str, Path]) -> str:
+    """Content hash of a checkpoint (hex), streamed so large files are never held in memory."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while chunk := f.read(FINGERPRINT_CHUNK):
+            h.update(chunk)
+    return h.hexdigest()
+
+def inspect_model(path: Union[str, Path]) -> (dict, str):
+    """Metadata and fingerprint of a checkpoint in a single pass over the file."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        try:
+            info = parse_metadata(_HashingReader(f, h))
+        except Exception as e: # not a StyleGAN pickle
+            info = {'error': str(e) or type(e).__name__}
+        while chunk := f.read(FINGERPRINT_CHUNK):
+            h.update(chunk)
+    return info, h.hexdigest()
+
+class ModelCatalog:
+    """
+    Index of the checkpoints in a folder. Metadata and a content fingerprint are computed once per
+    (name, size, mtime, inode) in a background thread and kept in a JSON file next to the models, so
+    listing and describing models never unpickles a network nor rehashes it.
+    """
+    _shared = None
+
+    def __init__(self, folder: Union[str, Path]=file_utils.model_path):
+        self.folder = Path(folder)
+        self.path = self.folder / CATALOG_FILE
+        self.cond = threading.Condition()
+        self.entries = self.load()
+        self.pending = set() # names queued for indexing
+        self.paths = {} # resolved path -> (size, mtime, inode, fingerprint) of models outside the folder
+        self.worker = None
+
+    @classmethod
+    def shared(cls) -> ModelCatalog:
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def load(self) -> dict:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == CATALOG_VERSION:
+                return data['models']
+        except (OSError, ValueError):
+            pass
+        return {}
+
+    def save(self) -> None:
+        with self.cond:
+            data = json.dumps({'version': CATALOG_VERSION, 'models': self.entries}, indent=1).encode('utf-8')
+        try:
+            file_utils.atomic_write(self.path, data, fsync=False)
+        except OSError as e:
+            logger(f"Could not save the model catalog: {e}")
+
+    def scan(self) -> dict[str, (int, float, int)]:
+        """{name: (size, mtime, inode)} of the model files."""
+        if not self.folder.is_dir():
+            return {}
+        files = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name.endswith('.pkl') and entry.is_file():
+                    st = entry.stat()
+                    files[entry.name] = (st.st_size, st.st_mtime, entry.inode())
+        return files
+
+    @classmethod
+    def key(cls, entry: dict) -> (int, float, int):
+        return entry['size'], entry['mtime'], entry['ino']
+
+    def models(self) -> list[str]:
+        """Model file names, most recently used first. Queues indexing for new or changed files."""
+        files = self.scan()
+        stale = []
+        with self.cond:
+            for name, key in files.items():
+                entry = self.entries.get(name)
+                if entry is None or self.key(entry) != key:
+                    self.entries[name] = {'size': key[0], 'mtime': key[1], 'ino': key[2], 'info': None, 'fingerprint': None}
+                    stale.append(name)
+                elif entry['info'] is None: # only fingerprinted so far
+                    stale.append(name)
+            for name in set(self.entries) - set(files):
+                del self.entries[name]
+        if stale:
+            self.index(stale)
+        return [name for name, key in sorted(files.items(), key=lambda kv: (kv[1][1], kv[0]), reverse=True)]
+
+    def index(self, names: list[str]) -> None:
+        with self.cond:
+            names = [name for name in names if name not in self.pending]
+            self.pending.update(names)
+        def work():
+            for name in names:
+                try:
+                    info, fingerprint = inspect_model(self.folder / name)
+                except OSError as e:
+                    info, fingerprint = {'error': str(e)}, None
+                with self.cond:
+                    if name in self.entries:
+                        self.entries[name].update(info=info, fingerprint=fingerprint)
+                    self.pending.discard(name)
+                    self.cond.notify_all()
+            self.save()
+            logger(f"Indexed {len(names)} models")
+        if names:
+            self.worker = threading.Thread(target=work, name='gan-model-catalog', daemon=True)
+            self.worker.start()
+
+    def fingerprint(self, name: Union[str, Path]) -> str:
+        """
+        Content fingerprint of a model file, memoized on (size, mtime, inode). Waits for the indexer
+        if it is hashing the file already, hashes inline otherwise. Files outside the folder (given
+        as paths) are memoized in memory only.
+        """
+        name = str(name)
+        path = self.folder / name
+        st = os.stat(path)
+        key = (st.st_size, st.st_mtime, st.st_ino)
+        if Path(name).name != name:
+            resolved = str(path.resolve())
+            with self.cond:
+                memo = self.paths.get(resolved)
+            if memo is not None and memo[:3] == key:
+                return memo[3]
+            fingerprint = file_fingerprint(path)
+            with self.cond:
+                self.paths[resolved] = (*key, fingerprint)
+            return fingerprint
+        with self.cond:
+            while name in self.pending:
+                self.cond.wait()
+            entry = self.entries.get(name)
+            if entry is not None and entry['fingerprint'] is not None and self.key(entry) == key:
+                return entry['fingerprint']
+        fingerprint = file_fingerprint(path)
+        with self.cond:
+            entry = self.entries.get(name)
+            if entry is None or self.key(entry) != key:
+                entry = self.entries[name] = {'size': key[0], 'mtime': key[1], 'ino': key[2], 'info': None}
+            entry['fingerprint'] = fingerprint
+        self.save()
+        return fingerprint
+
+    def info(self, name: str) -> Union[dict, None]:
+        """Metadata of a model, or None while it is still being indexed."""
+        with self.cond:
+            entry = self.entries.get(name)
+            return entry and entry['info'] and {**entry['info'], 'size': entry['size']}
+
+    def touch(self, name: str) -> None:
+        """Mark a model as most recently used without invalidating its metadata."""
+        path = self.folder / name
+        before = os.stat(path)
+        file_utils.touch(path)
+        st = path.stat()
+        with self.cond:
+            entry = self.entries.get(name)
+            if entry is None:
+                stale = False
+            elif self.key(entry) == (before.st_size, before.st_mtime, before.st_ino):
+                entry.update(mtime=st.st_mtime, ino=st.st_ino)
+                stale = False
+            else: # replaced since it was indexed, e.g. a same-size copy over it
+                self.entries[name] = {'size': st.st_size, 'mtime': st.st_mtime, 'ino': st.st_ino, 'info': None, 'fingerprint': None}
+                stale = True
+        if stale:
+            self.index([name])
+        self.save()
+
+    def describe(self, name: Union[str, None]) -> str:
+        if not name:
+            return ""
+        info = self.info(name)
+        if info is None:
+            return "Reading model info…"
+        if 'error' in info:
+            return f"{info['size'] / (1 << 20):.0f} MB"
+        architecture = {'stylegan2': 'StyleGAN2', 'stylegan3': 'StyleGAN3'}[info['architecture']]
+        return f"{architecture} · {info['img_resolution']} px · {info['num_ws']} ws × {info['w_dim']} · {info['size'] / (1 << 20):.0f} MB"
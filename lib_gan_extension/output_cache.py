@@ -0,0 +1,239 @@
+from __future__ import annotations
+from typing import Callable, Union
+import os
+import struct
+import threading
+import time
+import zlib
+from pathlib import Path
+
+from . import global_state, file_utils, metadata, metrics, str_utils
+from .global_state import logger
+
+# Each checkpoint gets a folder named after its content fingerprint, so replacing a .pkl never serves
+# stale images and renaming one keeps its cache; a .model file in it lists the file names it had.
+# Rendered images live in 256 hashed subfolders of each model folder (<model>/<xx>/<filename>), so no
+# single directory grows to millions of entries. When the cache exceeds the disk budget, the least
+# recently used images are evicted; their latent chunks are kept in <model>/latents/<xx>/<filename>.gwl.
+# Explicit exports go to <model>/exports and are never evicted. Previews are sharded the same way
+# under <model>/previews and share the budget. <model>/seedbank holds the seed bank (see seed_bank.py).
+LAYOUT_MARKER = '.layout'
+MODEL_LABEL = '.model'
+LAYOUT_VERSION = 'sharded-1'
+LATENT_DIR = 'latents'
+EXPORT_DIR = 'exports'
+PREVIEW_DIR = 'previews'
+SEED_BANK_DIR = 'seedbank'
+LATENT_SUFFIX = '.gwl'
+IMAGE_SUFFIXES = ('.png', '.jpg', '.jpeg')
+TMP_PREFIX = '.tmp-'
+TMP_MAX_AGE = 3600 # seconds before a leftover atomic_write temp file is considered abandoned
+TOUCH_INTERVAL = 60 # seconds, access times are only refreshed when older than this
+LOW_WATER = 0.9 # evict down to this fraction of the budget
+ADOPT_SAMPLES = 4 # images checked against the model before a legacy folder is taken over
+
+def shard_name(filename: str) -> str:
+    return f"{zlib.crc32(filename.encode('utf-8')) & 0xFF:02x}"
+
+def shard_path(folder: Path, filename: str) -> Path:
+    return folder / shard_name(filename) / filename
+
+def latent_path(folder: Path, filename: str) -> Path:
+    return folder / LATENT_DIR / shard_name(filename) / (filename + LATENT_SUFFIX)
+
+def touch(path: Path) -> None:
+    """Record a cache hit in the access time (explicitly, relatime/noatime mounts would not)."""
+    try:
+        st = path.stat()
+        now = time.time()
+        if now - st.st_atime > TOUCH_INTERVAL:
+            os.utime(path, (now, st.st_mtime))
+    except OSError:
+        pass
+
+def migrate(folder: Path) -> None:
+    """Move the images of a flat (pre-sharding) model folder into its shards, once."""
+    marker = folder / LAYOUT_MARKER
+    if marker.exists():
+        return
+    with file_utils.file_lock(folder / (LAYOUT_MARKER + '.lock')):
+        if marker.exists():
+            return
+        moved = 0
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                if entry.name.startswith(TMP_PREFIX):
+                    remove(Path(entry.path))
+                elif entry.name.lower().endswith(IMAGE_SUFFIXES):
+                    target = shard_path(folder, entry.name)
+                    target.parent.mkdir(exist_ok=True)
+                    try:
+                        os.replace(entry.path, target)
+                        moved += 1
+                    except FileNotFoundError:
+                        pass
+        marker.write_text(LAYOUT_VERSION)
+        if moved:
+            logger(f"Moved {moved} images of {folder.name} into hashed subfolders")
+
+def adopt(folder: Path, legacy: Path, check: Callable[[Path], Union[bool, None]]) -> None:
+    """
+    Take over the folder a model had before fingerprints (named after the file) if it has none yet.
+    A few of its images go through check (True: made by this model, False: by another one, None:
+    can't tell); the folder is only moved when some match and none differ, it stays put otherwise.
+    """
+    if not legacy.is_dir() or folder.exists():
+        return
+    verdicts = []
+    for path in legacy.rglob('*'):
+        if path.suffix.lower() in IMAGE_SUFFIXES and not path.name.startswith(TMP_PREFIX):
+            verdict = check(path)
+            if verdict is not None:
+                verdicts.append(verdict)
+                if not verdict or len(verdicts) == ADOPT_SAMPLES:
+                    break
+    if not verdicts or not all(verdicts):
+        reason = "made by another model" if verdicts else "could not be verified"
+        logger(f"Leaving cached images of {legacy.name} in place: {reason}")
+        return
+    try:
+        os.replace(legacy, folder)
+        logger(f"Moved cached images of {legacy.name} to {folder.name}")
+    except OSError as e: # e.g. another process adopted it first
+        logger(f"Could not move {legacy.name} to {folder.name}: {e}")
+
+def label(folder: Path, model_name: str) -> None:
+    """Record a file name of the model in its folder, for people browsing the outputs."""
+    path = folder / MODEL_LABEL
+    try:
+        names = path.read_text(encoding='utf-8').splitlines()
+    except FileNotFoundError:
+        names = []
+    if model_name not in names:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(model_name + '\n')
+
+def remove(path: Path) -> None:
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+def save_latents(folder: Path, filename: str, latents: dict[str, bytes]) -> None:
+    path = latent_path(folder, filename)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = b''.join(key.encode('ascii') + b'\0' + struct.pack('<I', len(blob)) + blob for key, blob in latents.items())
+    file_utils.atomic_write(path, data, fsync=False)
+
+def load_latents(folder: Path, filename: str) -> dict[str, bytes]:
+    """The latent blobs kept for an evicted image, or {}."""
+    try:
+        data = latent_path(folder, filename).read_bytes()
+    except FileNotFoundError:
+        return {}
+    latents, pos = {}, 0
+    while pos < len(data):
+        end = data.index(b'\0', pos)
+        length, = struct.unpack_from('<I', data, end + 1)
+        latents[data[pos:end].decode('ascii')] = data[end + 5:end + 5 + length]
+        pos = end + 5 + length
+    return latents
+
+class OutputCache:
+    """
+    Disk budget for all model folders under root, enforced with least-recently-used eviction. Scans and
+    evictions run in a background thread, so a render that crosses the budget never waits for a walk
+    over the whole cache.
+    """
+    def __init__(self, root: Union[str, Path]):
+        self.root = Path(root)
+        self.size = None # bytes, estimated from writes between scans
+        self.written = 0 # bytes added since startup, to account for writes made during a scan
+        self.lock = threading.Lock()
+        self.worker = None
+        self.refresh()
+
+    def budget(self) -> int:
+        return int(global_state.cache_budget * (1 << 30))
+
+    def added(self, nbytes: int) -> None:
+        """Account for a written image and start an eviction if the budget is exceeded."""
+        with self.lock:
+            self.written += nbytes
+            if self.size is not None:
+                self.size += nbytes
+            over = self.size is None or self.size > self.budget()
+        if over:
+            self.refresh()
+
+    def refresh(self) -> Union[threading.Thread, None]:
+        """Scan (and evict down to the budget) in the background, unless a scan is running or there is no budget."""
+        budget = self.budget()
+        if budget <= 0:
+            return None
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.evict, args=(budget,), name='gan-cache-evict', daemon=True)
+                self.worker.start()
+            return self.worker
+
+    def scan(self) -> list[(float, int, Path)]:
+        """(access time, size, path) of every cached image, removing abandoned temp files on the way."""
+        files = []
+        now = time.time()
+        for model in self.root.iterdir():
+            if not model.is_dir():
+                continue
+            shards = [shard for shard in model.iterdir() if shard.is_dir() and shard.name not in (LATENT_DIR, EXPORT_DIR, PREVIEW_DIR, SEED_BANK_DIR)]
+            if (model / PREVIEW_DIR).is_dir():
+                shards += [shard for shard in (model / PREVIEW_DIR).iterdir() if shard.is_dir()]
+            for shard in shards:
+                with os.scandir(shard) as entries:
+                    for entry in entries:
+                        try:
+                            st = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        if entry.name.startswith(TMP_PREFIX):
+                            if now - st.st_mtime > TMP_MAX_AGE:
+                                remove(Path(entry.path))
+                        elif entry.name.lower().endswith(IMAGE_SUFFIXES):
+                            files.append((st.st_atime, st.st_size, Path(entry.path)))
+        return files
+
+    def evict(self, budget: int) -> int:
+        """Remove least recently used images until the cache is below LOW_WATER * budget. Returns bytes freed."""
+        with self.lock:
+            written = self.written
+        files = self.scan()
+        total = sum(size for _, size, _ in files)
+        target = int(budget * LOW_WATER)
+        freed = 0
+        if total > budget:
+            for _, size, path in sorted(files):
+                if total - freed <= target:
+                    break
+                self.keep_latents(path)
+                remove(path)
+                freed += size
+                metrics.cache_evicted.inc()
+        with self.lock: # images written while scanning were not seen by it
+            self.size = total - freed + self.written - written
+        if not freed:
+            return 0
+        metrics.cache_evicted_bytes.inc(amount=freed)
+        logger(f"Evicted {freed / (1 << 20):.1f} MB of cached images (budget {budget / (1 << 30):.2f} GB)")
+        return freed
+
+    def keep_latents(self, path: Path) -> None:
+        # latents are a few KB per image, and those of mixes from pasted vectors cannot be rederived
+        try:
+            _, _, latents = metadata.read_chunks(path)
+            if not latents: # written before the latent chunks, the tensors are in the params text
+                latents = {key: str_utils.tensor2bytes(w) for key, w in metadata.parse_latents_from_image(path).items()}
+        except (OSError, ValueError):
+            return
+        if latents:
+            save_latents(path.parents[1], path.name, latents)
@@ -0,0 +1,101 @@
+from __future__ import annotations
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from .global_state import logger
+
+# Low resolution previews that run only the start of the synthesis network.
+#   StyleGAN2 (skip architecture): stop after the first block at or above the preview size; the
+#     image accumulated by the torgb layers so far is the preview.
+#   StyleGAN3: stop after the first layer whose sampling rate reaches the preview size, crop its
+#     margins and map its channels to RGB with a linear projection. The projection is fitted once
+#     per model and size against full renders of fixed seeds, so previews are reproducible.
+#   Anything else: full synthesis, downsampled.
+# Previews only approximate the full render (fine detail comes from the skipped layers), which is
+# why they are cached apart from it.
+CALIBRATION_SEEDS = range(8)
+CALIBRATION_PSI = 0.7
+RIDGE = 1e-4 # relative to the mean feature energy, keeps the projection fit well conditioned
+
+def resize(img: torch.Tensor, size: int) -> torch.Tensor:
+    if img.shape[-1] == size and img.shape[-2] == size:
+        return img
+    return F.interpolate(img, size=(size, size), mode='bilinear', align_corners=False, antialias=True)
+
+class Preview:
+    """Synthesis of [N, num_ws, w_dim] into [N, C, size, size] previews, for one network and size."""
+    def __init__(self, G: torch.nn.Module, size: int):
+        self.G = G
+        self.size = size = min(size, G.img_resolution)
+        self.kind = 'full'
+        S = G.synthesis
+        if hasattr(S, 'block_resolutions'):
+            blocks = [getattr(S, f'b{res}') for res in S.block_resolutions]
+            resolution = next((res for res in S.block_resolutions if res >= size), S.block_resolutions[-1])
+            if resolution < S.block_resolutions[-1] and all(getattr(block, 'architecture', 'skip') == 'skip' for block in blocks):
+                self.kind = 'skip'
+                self.num_blocks = S.block_resolutions.index(resolution) + 1
+        elif hasattr(S, 'layer_names') and hasattr(S, 'input'):
+            rates = [int(np.max(getattr(S, name).out_sampling_rate)) for name in S.layer_names]
+            k = next((i for i, rate in enumerate(rates) if rate >= size), len(rates) - 1)
+            if rates[k] < G.img_resolution:
+                self.kind = 'project'
+                self.num_layers = k + 1
+                self.projection = None # [C + 1, img_channels], fitted on first use
+        if self.kind == 'full' and size < G.img_resolution:
+            logger(f"Previews of this network need a full render ({size}px)")
+
+    @torch.no_grad()
+    def __call__(self, ws: torch.Tensor, noise_mode: str='const', force_fp32: bool=False) -> torch.Tensor:
+        match self.kind:
+            case 'skip':
+                img = self.skip(ws, noise_mode=noise_mode, force_fp32=force_fp32)
+            case 'project':
+                if self.projection is None:
+                    self.projection = self.calibrate(ws.device, noise_mode=noise_mode, force_fp32=force_fp32)
+                x = self.features(ws, noise_mode=noise_mode, force_fp32=force_fp32)
+                img = torch.einsum('nchw,cd->ndhw', x, self.projection[:-1]) + self.projection[-1].reshape(1, -1, 1, 1)
+            case _:
+                img = self.G.synthesis(ws, noise_mode=noise_mode, force_fp32=force_fp32)
+        return resize(img.float(), self.size)
+
+    def skip(self, ws: torch.Tensor, **block_kwargs) -> torch.Tensor:
+        # same ws slicing as SynthesisNetwork.forward, over the first blocks only
+        S = self.G.synthesis
+        x = img = None
+        w_idx = 0
+        for res in S.block_resolutions[:self.num_blocks]:
+            block = getattr(S, f'b{res}')
+            x, img = block(x, img, ws.narrow(1, w_idx, block.num_conv + block.num_torgb), **block_kwargs)
+            w_idx += block.num_conv
+        return img
+
+    def features(self, ws: torch.Tensor, **layer_kwargs) -> torch.Tensor:
+        """Output of the last kept layer, margins cropped: [N, C, rate, rate]."""
+        S = self.G.synthesis
+        ws = ws.to(torch.float32).unbind(dim=1)
+        x = S.input(ws[0])
+        for name, w in zip(S.layer_names[:self.num_layers], ws[1:]):
+            x = getattr(S, name)(x, w, **layer_kwargs)
+        rate = int(np.max(getattr(S, S.layer_names[self.num_layers - 1]).out_sampling_rate))
+        top, left = (x.shape[2] - rate) // 2, (x.shape[3] - rate) // 2
+        return x[:, :, top:top + rate, left:left + rate].float()
+
+    def calibrate(self, device, **kwargs) -> torch.Tensor:
+        """Least squares fit of the full renders of the calibration seeds from the kept layer's features."""
+        G = self.G
+        A = B = None
+        for seed in CALIBRATION_SEEDS:
+            z = torch.from_numpy(np.random.RandomState(seed).randn(1, G.z_dim).astype(np.float32)).to(device)
+            w = G.mapping(z, None)
+            w = G.mapping.w_avg + (w - G.mapping.w_avg) * CALIBRATION_PSI
+            x = self.features(w, **kwargs)
+            target = resize(G.synthesis(w, **kwargs).float(), x.shape[-1])
+            x = torch.cat([x[0], torch.ones_like(x[0, :1])]).flatten(1) # [C + 1, pixels]
+            y = target[0].flatten(1)
+            A = (x @ x.T).double() + (A if A is not None else 0)
+            B = (x @ y.T).double() + (B if B is not None else 0)
+        A += torch.eye(len(A), dtype=A.dtype, device=A.device) * RIDGE * A.diagonal().mean()
+        logger(f"Fitted the preview projection of layer {G.synthesis.layer_names[self.num_layers - 1]} ({self.size}px)")
+        return torch.linalg.solve(A, B).float()
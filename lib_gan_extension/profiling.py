@@ -0,0 +1,73 @@
+from __future__ import annotations
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+import threading
+import time
+import torch
+from torch.profiler import ProfilerActivity
+
+from . import global_state, timing
+from .global_state import logger
+
+# On-demand torch.profiler captures of single requests. arm(n) profiles the next n renders (the
+# setting), render(..., force=True) one specific request (the API's profile flag). Each capture
+# writes <outputRoot>/profiles/<time>-<label>.json, a Chrome trace (chrome://tracing or
+# ui.perfetto.dev), and a .txt summary of the top ops by time and by memory. The extension's stages
+# show up as 'Stage/<name>' ranges next to the profiled_function tags of torch_utils.
+PROFILE_DIR = 'profiles'
+TOP_K = 25
+_NULL = nullcontext()
+_lock = threading.Lock()
+_busy = threading.Lock() # the profiler is process wide, so one capture at a time
+remaining = 0
+
+def arm(n: int) -> None:
+    global remaining
+    with _lock:
+        remaining = max(int(n), 0)
+    if remaining:
+        logger(f"Profiling the next {remaining} renders")
+
+def render(folder: Path, label: str, force: bool=False):
+    """Profile the block if armed or forced. Yields the base path of the capture, or None."""
+    if not (force or remaining):
+        return _NULL
+    return _profiled(Path(folder), label, force)
+
+def _take(force: bool) -> bool:
+    global remaining
+    with _lock:
+        if not (force or remaining) or not _busy.acquire(blocking=False):
+            return False
+        if not force:
+            remaining -= 1
+        return True
+
+@contextmanager
+def _profiled(folder: Path, label: str, force: bool):
+    if not _take(force):
+        yield None
+        return
+    try:
+        base = folder / f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time() * 1000) % 1000:03d}-{label}"
+        cuda = 'cuda' in global_state.device and torch.cuda.is_available()
+        activities = [ProfilerActivity.CPU] + ([ProfilerActivity.CUDA] if cuda else [])
+        timing.tagging = True
+        with torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True) as prof:
+            yield base
+        timing.tagging = False
+        export(prof, base, cuda)
+    finally:
+        timing.tagging = False
+        _busy.release()
+
+def export(prof, base: Path, cuda: bool=False) -> None:
+    base.parent.mkdir(parents=True, exist_ok=True)
+    prof.export_chrome_trace(str(base.with_suffix('.json')))
+    averages = prof.key_averages()
+    sections = [('Top ops by self cpu time', 'self_cpu_time_total'), ('Top ops by self cpu memory', 'self_cpu_memory_usage')]
+    if cuda:
+        sections.insert(1, ('Top ops by self cuda time', 'self_cuda_time_total'))
+    text = "\n\n".join(f"{title}\n{averages.table(sort_by=key, row_limit=TOP_K)}" for title, key in sections)
+    base.with_suffix('.txt').write_text(text, encoding='utf-8')
+    logger(f"Profile written to {base.with_suffix('.json')}")
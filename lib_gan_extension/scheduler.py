@@ -0,0 +1,121 @@
+from __future__ import annotations
+from typing import Callable, Iterator
+from contextlib import contextmanager
+import heapq
+import itertools
+import threading
+import time
+
+from . import global_state
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+PRIORITIES = {INTERACTIVE: 0, BULK: 1} # lower goes first
+RECENT_INTERACTIVE = 30.0 # seconds after an interactive request during which bulk batches stay short
+EMA_ALPHA = 0.3
+
+class ClassStats:
+    def __init__(self):
+        self.count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.service_total = 0.0
+        self.service_max = 0.0
+
+    def add(self, wait: float, service: float) -> None:
+        self.count += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        self.service_total += service
+        self.service_max = max(self.service_max, service)
+
+    def as_dict(self) -> dict:
+        n = max(self.count, 1)
+        return {
+            'count': self.count,
+            'wait_mean': self.wait_total / n,
+            'wait_max': self.wait_max,
+            'service_mean': self.service_total / n,
+            'service_max': self.service_max,
+        }
+
+class Scheduler:
+    """
+    Priority gate in front of synthesis. One holder at a time (reentrant per thread); when it is
+    released the oldest waiter of the most urgent class goes next, so an interactive click waits for
+    at most the bulk batch in progress. Bulk jobs size each batch with batch_size(), which keeps a
+    batch within global_state.interactive_target seconds while interactive requests are recent.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._owner = None
+        self._depth = 0
+        self._waiting = [] # heap of (priority, ticket)
+        self._tickets = itertools.count()
+        self._stats = {name: ClassStats() for name in PRIORITIES}
+        self._last_interactive = float('-inf')
+        self._item_time = None # EMA of bulk seconds per item
+
+    @contextmanager
+    def slot(self, priority: str=INTERACTIVE, items: int=1):
+        me = threading.get_ident()
+        with self._cond:
+            if self._owner == me:
+                self._depth += 1
+                outer = False
+            else:
+                entry = (PRIORITIES[priority], next(self._tickets))
+                queued = time.perf_counter()
+                if priority == INTERACTIVE:
+                    self._last_interactive = time.monotonic()
+                heapq.heappush(self._waiting, entry)
+                while self._owner is not None or self._waiting[0] != entry:
+                    self._cond.wait()
+                heapq.heappop(self._waiting)
+                self._owner, self._depth = me, 1
+                outer = True
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._depth -= 1
+                if outer:
+                    service = time.perf_counter() - start
+                    self._stats[priority].add(start - queued, service)
+                    if priority == BULK:
+                        per_item = service / max(items, 1)
+                        self._item_time = per_item if self._item_time is None else (1 - EMA_ALPHA) * self._item_time + EMA_ALPHA * per_item
+                    self._owner = None
+                    self._cond.notify_all()
+
+    def batch_size(self, requested: int) -> int:
+        """The bulk batch size to use next: requested, or fewer if interactive latency is at risk."""
+        with self._cond:
+            if self._item_time is None or time.monotonic() - self._last_interactive > RECENT_INTERACTIVE:
+                return requested
+            return max(1, min(requested, int(global_state.interactive_target / self._item_time)))
+
+    def batches(self, items: list, size: int, render: Callable[[list], object]) -> Iterator[(list, object)]:
+        """
+        Run render(group) over consecutive groups of items, each in its own bulk slot. Yields
+        (group, result) after the slot is released, so consumers may stream without holding it.
+        """
+        i = 0
+        while i < len(items):
+            group = items[i:i + self.batch_size(size)]
+            with self.slot(BULK, len(group)):
+                result = render(group)
+            i += len(group)
+            yield group, result
+
+    def stats(self) -> dict:
+        with self._cond:
+            waiting = [0] * len(PRIORITIES)
+            for priority, _ in self._waiting:
+                waiting[priority] += 1
+            return {
+                **{name: {**self._stats[name].as_dict(), 'waiting': waiting[p]} for name, p in PRIORITIES.items()},
+                'bulk_item_time': self._item_time,
+                'bulk_batch_size': self.batch_size(global_state.batch_size),
+            }
@@ -0,0 +1,288 @@
+"""Seed bank: the mapped w of a contiguous seed range in a memory-mapped file, with an approximate
+nearest-neighbour index over it, to find the seeds that look like a given w. Run from the extension root:
+
+    python -m lib_gan_extension.seed_bank build --model stylegan3-r-ffhq.pkl --start 0 --count 1000000
+    python -m lib_gan_extension.seed_bank search --model stylegan3-r-ffhq.pkl --seed 42 --psi 0.7 --k 10
+
+The bank lives in <model>/seedbank of the output folder: bank.json (range, progress, w_avg), w.npy
+(one untruncated float32 w row per seed, memory-mapped) and index.npz. Building is resumable: rerun
+the same command after an interruption. The index is built when the mapping is done.
+
+Seed latents repeat one row over num_ws and truncation is affine, so for a query w [num_ws, w_dim],
+layer weights l and truncation psi, the weighted distance to seed s truncated with psi is
+    sum_i l_i |w_i - avg - psi (b_s - avg)|^2 / sum_i l_i = psi^2 |t - b_s|^2 + const,
+    t = avg + sum_i l_i (w_i - avg) / (psi sum_i l_i)
+where b_s is the bank row. Any query is one w_dim target t, and one index serves every psi and mask.
+The index is an IVF (k-means lists) with product quantized residuals; the best candidates of the
+probed lists are re-ranked with exact distances from w.npy.
+"""
+from __future__ import annotations
+from typing import Union
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from . import file_utils
+from .global_state import logger
+
+BANK_VERSION = 1
+BANK_FILE = 'bank.json'
+W_FILE = 'w.npy'
+INDEX_FILE = 'index.npz'
+CHUNK = 4096 # seeds mapped and checkpointed at a time
+TRAIN_SAMPLE = 65536 # vectors the k-means of the index lists are trained on
+PQ_TRAIN_SAMPLE = 16384 # and those of the sub-quantizers, 64 per centroid
+KMEANS_ITERATIONS = 20
+PQ_BITS = 8 # 256 centroids per sub-quantizer, codes are uint8
+NPROBE = 32 # lists searched per query by default
+
+def squared_distances(x: np.ndarray, centroids: np.ndarray, centroid_norms: np.ndarray=None) -> np.ndarray:
+    """[N, K] squared L2 distances, from |x|^2 - 2 x.c + |c|^2."""
+    if centroid_norms is None:
+        centroid_norms = (centroids * centroids).sum(1)
+    d = (x * x).sum(1, keepdims=True) - 2 * x @ centroids.T + centroid_norms
+    return np.maximum(d, 0, out=d)
+
+def assign(x: np.ndarray, centroids: np.ndarray, chunk: int=CHUNK) -> np.ndarray:
+    norms = (centroids * centroids).sum(1)
+    return np.concatenate([squared_distances(np.asarray(x[i:i + chunk], dtype=np.float32), centroids, norms).argmin(1)
+                           for i in range(0, len(x), chunk)])
+
+def kmeans(x: np.ndarray, k: int, iterations: int=KMEANS_ITERATIONS, seed: int=0) -> np.ndarray:
+    """Lloyd's k-means of [N, D] float32 rows, initialized from random rows. Returns [k, D] centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = assign(x, centroids)
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        order = np.argsort(labels, kind='stable')
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[~empty]
+        centroids[~empty] = np.add.reduceat(x[order], starts) / counts[~empty, None]
+        centroids[empty] = x[rng.choice(len(x), int(empty.sum()), replace=False)] # restart empty clusters
+    return centroids
+
+def sub_quantizers(w_dim: int) -> int:
+    """Number of PQ sub-vectors: the largest divisor of w_dim up to w_dim / 16."""
+    return max(m for m in range(1, max(1, w_dim // 16) + 1) if w_dim % m == 0)
+
+class SeedIndex:
+    """IVF-PQ over the bank rows: nlist k-means lists, residuals coded with m uint8 sub-quantizers."""
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, ids: np.ndarray, codebooks: np.ndarray, codes: np.ndarray):
+        self.centroids = centroids # [nlist, D]
+        self.offsets = offsets # [nlist + 1], list i holds ids[offsets[i]:offsets[i + 1]]
+        self.ids = ids # [N] bank rows, in list order
+        self.codebooks = codebooks # [m, ksub, D / m]
+        self.codes = codes # [N, m], in list order
+        self.centroid_norms = (centroids * centroids).sum(1)
+
+    @classmethod
+    def build(cls, x: np.ndarray, nlist: int=None, m: int=None, seed: int=0) -> SeedIndex:
+        count, w_dim = x.shape
+        nlist = nlist or max(1, min(4096, int(np.sqrt(count))))
+        m = m or sub_quantizers(w_dim)
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(count, min(count, max(TRAIN_SAMPLE, nlist)), replace=False))
+        train = np.asarray(x[sample], dtype=np.float32)
+        centroids = kmeans(train, nlist, seed=seed)
+        residuals = (train - centroids[assign(train, centroids)]).reshape(len(train), m, -1)
+        residuals = residuals[rng.permutation(len(residuals))[:PQ_TRAIN_SAMPLE]]
+        ksub = min(1 << PQ_BITS, len(residuals))
+        codebooks = np.stack([kmeans(residuals[:, j], ksub, seed=seed + 1 + j) for j in range(m)])
+
+        labels = np.empty(count, dtype=np.int64)
+        codes = np.empty((count, m), dtype=np.uint8)
+        for i in range(0, count, CHUNK):
+            chunk = np.asarray(x[i:i + CHUNK], dtype=np.float32)
+            labels[i:i + CHUNK] = assign(chunk, centroids)
+            residuals = (chunk - centroids[labels[i:i + CHUNK]]).reshape(len(chunk), m, -1)
+            for j in range(m):
+                codes[i:i + CHUNK, j] = assign(residuals[:, j], codebooks[j])
+        ids = np.argsort(labels, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=nlist))])
+        return cls(centroids, offsets, ids, codebooks, codes[ids])
+
+    @classmethod
+    def load(cls, path: Path) -> SeedIndex:
+        with np.load(path) as f:
+            return cls(f['centroids'], f['offsets'], f['ids'], f['codebooks'], f['codes'])
+
+    def save(self, path: Path) -> None:
+        tmp = path.with_name(path.stem + '.tmp.npz')
+        np.savez(tmp, centroids=self.centroids, offsets=self.offsets, ids=self.ids, codebooks=self.codebooks, codes=self.codes)
+        tmp.replace(path)
+
+    def candidates(self, target: np.ndarray, count: int, nprobe: int) -> np.ndarray:
+        """Bank rows of the count best approximate matches of target in the nprobe closest lists."""
+        coarse = squared_distances(target[None], self.centroids, self.centroid_norms)[0]
+        nprobe = min(nprobe, len(coarse))
+        probe = np.argpartition(coarse, nprobe - 1)[:nprobe]
+        m, ksub, _ = self.codebooks.shape
+        ids, dists = [], []
+        for l in probe:
+            start, end = self.offsets[l], self.offsets[l + 1]
+            if start == end:
+                continue
+            residual = (target - self.centroids[l]).reshape(m, 1, -1)
+            tables = ((self.codebooks - residual) ** 2).sum(-1) # [m, ksub]
+            dists.append(tables[np.arange(m), self.codes[start:end]].sum(1))
+            ids.append(self.ids[start:end])
+        if not ids:
+            return np.empty(0, dtype=np.int64)
+        ids, dists = np.concatenate(ids), np.concatenate(dists)
+        if len(ids) > count:
+            ids = ids[np.argpartition(dists, count - 1)[:count]]
+        return ids
+
+class SeedBank:
+    def __init__(self, folder: Union[str, Path]):
+        self.folder = Path(folder)
+        self.info = json.loads((self.folder / BANK_FILE).read_text(encoding='utf-8'))
+        self.w = np.load(self.folder / W_FILE, mmap_mode='r')
+        self.w_avg = np.array(self.info['w_avg'], dtype=np.float32)
+        index = self.folder / INDEX_FILE
+        self.index = SeedIndex.load(index) if index.exists() else None
+
+    @classmethod
+    def exists(cls, folder: Union[str, Path]) -> bool:
+        return (Path(folder) / BANK_FILE).exists()
+
+    @classmethod
+    def stamp(cls, folder: Union[str, Path]) -> tuple:
+        """Modification times of the bank files, they change whenever a build makes progress."""
+        return tuple(path.stat().st_mtime_ns if path.exists() else 0 for path in (Path(folder) / BANK_FILE, Path(folder) / INDEX_FILE))
+
+    def __len__(self) -> int:
+        return self.info['done']
+
+    @property
+    def seeds(self) -> (int, int):
+        """First and last seed in the bank."""
+        return self.info['start'], self.info['start'] + len(self) - 1
+
+    def target(self, w: np.ndarray, psi: float, weights: np.ndarray=None) -> (np.ndarray, float):
+        """The untruncated row t nearest to w, and the constant part of the squared distance (see above)."""
+        if psi == 0:
+            raise ValueError("Every seed is the average w at psi 0")
+        w = np.asarray(w, dtype=np.float32).reshape(-1, self.w_avg.shape[0])
+        weights = np.ones(len(w), dtype=np.float32) if weights is None else np.asarray(weights, dtype=np.float32).reshape(-1)
+        if weights.sum() <= 0:
+            raise ValueError("No layer is weighted")
+        weights = weights.astype(np.float64) / weights.sum()
+        r = w - self.w_avg.astype(np.float64) # float64, the spread cancels out for seed queries
+        u = weights @ r
+        spread = float(weights @ (r * r).sum(1) - u @ u)
+        return (self.w_avg + u / psi).astype(np.float32), max(spread, 0.0)
+
+    def search(self, w: np.ndarray, psi: float, k: int=10, weights: np.ndarray=None, nprobe: int=NPROBE,
+                    rerank: int=None, exact: bool=False) -> list[(int, float)]:
+        """
+        The k seeds whose w truncated with psi is nearest to w ([w_dim] or [num_ws, w_dim]), with
+        per-layer weights. Returns (seed, distance) pairs, the distance being the RMS over layers of
+        the L2 distance. Without an index (or with exact), the whole bank is scanned.
+        """
+        target, spread = self.target(w, psi, weights)
+        count = len(self)
+        if exact or self.index is None:
+            rows = np.arange(count)
+        else:
+            rows = np.sort(self.index.candidates(target, rerank or max(10 * k, 256), nprobe))
+            rows = rows[rows < count]
+        dists = np.concatenate([((np.asarray(self.w[rows[i:i + CHUNK]]) - target) ** 2).sum(1)
+                                for i in range(0, len(rows), CHUNK)] or [np.empty(0, dtype=np.float32)])
+        best = np.argsort(dists)[:k]
+        return [(self.info['start'] + int(rows[i]), float(np.sqrt(psi * psi * dists[i] + spread))) for i in best]
+
+## building
+
+def seed_z(seeds: range, z_dim: int) -> np.ndarray:
+    """The z of GanModel.random_z_dim for each seed, reseeding one RandomState instead of creating one per seed."""
+    rs = np.random.RandomState()
+    z = np.empty((len(seeds), z_dim), dtype=np.float32)
+    for i, seed in enumerate(seeds):
+        rs.seed(seed)
+        z[i] = rs.randn(z_dim)
+    return z
+
+def build(folder: Union[str, Path], GAN, fingerprint: str, start: int, count: int, nlist: int=None,
+            chunk: int=CHUNK) -> SeedBank:
+    """Map seeds start..start+count-1 into folder, resuming a previous run, then index them."""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    spec = {'version': BANK_VERSION, 'fingerprint': fingerprint, 'start': start, 'count': count, 'w_dim': GAN.w_dim}
+    info = json.loads((folder / BANK_FILE).read_text(encoding='utf-8')) if SeedBank.exists(folder) else None
+    if info is not None and any(info.get(key) != value for key, value in spec.items()):
+        raise ValueError(f"{folder} holds another bank (seeds {info['start']}+{info['count']}), remove it to start over")
+    if info is None or not (folder / W_FILE).exists():
+        info = dict(spec, done=0, w_avg=GAN.G.mapping.w_avg.cpu().tolist())
+        np.lib.format.open_memmap(folder / W_FILE, mode='w+', dtype=np.float32, shape=(count, GAN.w_dim)).flush()
+        file_utils.atomic_write(folder / BANK_FILE, json.dumps(info).encode('utf-8'))
+    w = np.load(folder / W_FILE, mmap_mode='r+')
+    if info['done'] < count:
+        logger(f"Mapping seeds {start + info['done']}-{start + count - 1} into {folder}")
+    begin = time.perf_counter()
+    mapped = 0
+    with torch.no_grad():
+        for i in range(info['done'], count, chunk):
+            seeds = range(start + i, start + min(i + chunk, count))
+            z = torch.from_numpy(seed_z(seeds, GAN.G.z_dim)).to(GAN.device)
+            w[i:i + len(seeds)] = GAN.G.mapping(z, None)[:, 0].cpu().numpy()
+            w.flush()
+            info['done'] = i + len(seeds)
+            file_utils.atomic_write(folder / BANK_FILE, json.dumps(info).encode('utf-8'), fsync=False)
+            mapped += len(seeds)
+    if mapped:
+        logger(f"Mapped {mapped} seeds in {time.perf_counter() - begin:.1f}s")
+    del w
+
+    begin = time.perf_counter()
+    index = SeedIndex.build(np.load(folder / W_FILE, mmap_mode='r'), nlist)
+    index.save(folder / INDEX_FILE)
+    logger(f"Indexed {count} seeds into {len(index.centroids)} lists of {index.codes.shape[1]} byte codes in {time.perf_counter() - begin:.1f}s")
+    return SeedBank(folder)
+
+def main(argv: list[str]=None):
+    from lib_gan_extension import global_state, GanGenerator
+
+    parser = argparse.ArgumentParser(description="Map a seed range into a seed bank and search it.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help="map (or resume mapping) a seed range, then index it")
+    build_parser.add_argument('--start', type=int, default=0)
+    build_parser.add_argument('--count', type=int, default=1000000)
+    build_parser.add_argument('--lists', type=int, default=None, help="IVF lists (default: sqrt of the count)")
+    search_parser = commands.add_parser('search', help="seeds nearest to a seed or a latent string")
+    search_parser.add_argument('--seed', type=int, default=None)
+    search_parser.add_argument('--w', default=None, help="latent string, e.g. from the Seed Mixer tab")
+    search_parser.add_argument('--psi', type=float, default=0.7)
+    search_parser.add_argument('--k', type=int, default=10)
+    search_parser.add_argument('--mask', default='total', help="layers to compare, like the mix masks")
+    search_parser.add_argument('--nprobe', type=int, default=NPROBE)
+    search_parser.add_argument('--exact', action='store_true', help="scan the whole bank")
+    for sub in (build_parser, search_parser):
+        sub.add_argument('--model', required=True, help="checkpoint in the models folder, or a path to one")
+        sub.add_argument('--output', default=None, help="output root (default: the webui's stylegan-images folder)")
+        sub.add_argument('--device', default=global_state.device)
+    args = parser.parse_args(argv)
+
+    global_state.device = args.device
+    generator = GanGenerator(args.output)
+    generator.set_model(args.model)
+    if args.command == 'build':
+        build(generator.seed_bank_path(), generator.GAN, generator.fingerprint, args.start, args.count, args.lists)
+        return
+    if (args.seed is None) == (args.w is None):
+        parser.error("give either --seed or --w")
+    from lib_gan_extension import str_utils
+    w = generator.GAN.get_w_from_seed(args.seed, args.psi) if args.w is None else str_utils.str2tensor(args.w)
+    start = time.perf_counter()
+    results = generator.find_similar_seeds(w, args.psi, args.k, args.mask, nprobe=args.nprobe, exact=args.exact)
+    logger(f"Searched in {(time.perf_counter() - start) * 1000:.1f} ms")
+    for seed, distance in results:
+        print(f"{seed}\t{distance:.4f}")
+
+if __name__ == '__main__':
+    main()
@@ -3,6 +3,7 @@ import re
 import io
 import base64
 import zlib
+import struct
 import hashlib
 import torch
 import numpy as np
@@ -20,13 +21,154 @@ def str2num(string) -> Union[int, None]:
     else:
         return None
 
+def str2seeds(string: str) -> list[int]:
+    # parse a list of seeds such as "1, 5, 0x10, 20-25" (ranges are inclusive)
+    seeds = []
+    for item in re.split(r'[,\s]+', string.strip()):
+        if item == "":
+            continue
+        range_match = re.fullmatch(r'(?i)(0x[0-9a-f]+|\d+)-(0x[0-9a-f]+|\d+)', item)
+        if range_match:
+            start, end = (str2num(x) for x in range_match.groups())
+            seeds += range(start, end + 1)
+        else:
+            seed = str2num(item)
+            if seed is None:
+                raise ValueError(f"Invalid seed: {item}")
+            seeds.append(seed)
+    return seeds
+
 def num2hex(num: int ) -> str:
     return str(hex(num)) #.upper().replace('0X', '0x')
 
 def num2base(num: int, base: int=36) -> str:
     return np.base_repr(number, base)
 
-def tensor2str(tensor: Union[torch.Tensor, np.ndarray]) -> str:
+# Compact latent codec (version 1)
+#   header: magic 'GW', version u8, dtype u8, flags u8, ndim u8, shape u16[ndim], model fingerprint (8 bytes)
+#   if FLAG_DEDUPE: u16 unique row count, u16 row index per row (rows = all dims but the last)
+#   if int8: f32 scale per stored row
+#   payload: stored rows, little-endian
+# Version 2 is the same with u32 shape, row count and row indices. It is only written when a dim or
+# the row count does not fit in u16 (large latent batches), so common latents keep their v1 bytes.
+# Text form is LATENT_PREFIX + base64 (C-speed, unlike base85). Legacy strings (base64 of zlib'd np.save) have no prefix.
+LATENT_MAGIC = b'GW'
+LATENT_VERSION = 1
+LATENT_VERSIONS = {1: 'H', 2: 'I'} # version -> struct format of shape, row count and row indices
+LATENT_PREFIX = "GW1:"
+LATENT_DTYPES = {'float32': 0, 'float16': 1, 'int8': 2}
+FLAG_DEDUPE = 1
+
+def tensor2bytes(tensor: Union[torch.Tensor, np.ndarray], dtype: str='float32',
+                    fingerprint: Union[str, bytes, None]=None, dedupe: bool=True) -> bytes:
+    if isinstance(tensor, torch.Tensor):
+        tensor = tensor.detach().cpu().numpy()
+    tensor = np.asarray(tensor, dtype=np.float32)
+    shape = tensor.shape if tensor.ndim > 0 else (1,)
+    rows = tensor.reshape(-1, shape[-1])
+    version = LATENT_VERSION if max(*shape, len(rows)) <= 0xFFFF else 2
+    fmt = LATENT_VERSIONS[version]
+
+    flags = 0
+    index = b''
+    if dedupe and len(rows) > 1:
+        # StyleGAN broadcasts w over num_ws, so seed latents have a single unique row (mixes have two)
+        row_bytes = np.ascontiguousarray(rows).view(np.dtype((np.void, rows.itemsize * rows.shape[1]))).ravel()
+        _, first, inverse = np.unique(row_bytes, return_index=True, return_inverse=True)
+        rows = rows[first]
+        flags |= FLAG_DEDUPE
+        index = struct.pack(f'<{fmt}', len(rows)) + inverse.reshape(-1).astype(f'<{fmt}').tobytes()
+
+    match dtype:
+        case 'float32':
+            payload = rows.astype('<f4').tobytes()
+        case 'float16':
+            payload = rows.astype('<f2').tobytes()
+        case 'int8':
+            scale = np.abs(rows).max(axis=1) / 127.0
+            scale[scale == 0] = 1.0
+            quantized = np.clip(np.rint(rows / scale[:, None]), -127, 127).astype(np.int8)
+            payload = scale.astype('<f4').tobytes() + quantized.tobytes()
+        case _:
+            raise ValueError(f"Unsupported latent dtype: {dtype}")
+
+    header = LATENT_MAGIC + struct.pack(f'<BBBB{len(shape)}{fmt}', version, LATENT_DTYPES[dtype], flags, len(shape), *shape)
+    return header + fingerprint2bytes(fingerprint) + index + payload
+
+def latent_header(blob: bytes) -> dict:
+    if blob[:2] != LATENT_MAGIC:
+        raise ValueError("Not a latent blob")
+    version, dtype, flags, ndim = struct.unpack_from('<BBBB', blob, 2)
+    if version not in LATENT_VERSIONS:
+        raise ValueError(f"Unsupported latent version: {version}")
+    fmt = LATENT_VERSIONS[version]
+    shape = struct.unpack_from(f'<{ndim}{fmt}', blob, 6)
+    offset = 6 + struct.calcsize(f'<{ndim}{fmt}')
+    return {
+        'version': version,
+        'index_format': fmt,
+        'dtype': {v: k for k, v in LATENT_DTYPES.items()}[dtype],
+        'flags': flags,
+        'shape': shape,
+        'fingerprint': blob[offset:offset + 8].hex(),
+        'offset': offset + 8,
+    }
+
+def bytes2tensor(blob: bytes) -> torch.Tensor:
+    header = latent_header(blob)
+    shape, offset = header['shape'], header['offset']
+    num_rows, width = int(np.prod(shape[:-1])), shape[-1]
+
+    inverse = None
+    if header['flags'] & FLAG_DEDUPE:
+        fmt = '<' + header['index_format']
+        size = struct.calcsize(fmt)
+        num_stored, = struct.unpack_from(fmt, blob, offset)
+        inverse = np.frombuffer(blob, dtype=f'<u{size}', count=num_rows, offset=offset + size)
+        offset += size + size * num_rows
+    else:
+        num_stored = num_rows
+
+    match header['dtype']:
+        case 'float32':
+            rows = np.frombuffer(blob, dtype='<f4', count=num_stored * width, offset=offset)
+        case 'float16':
+            rows = np.frombuffer(blob, dtype='<f2', count=num_stored * width, offset=offset).astype(np.float32)
+        case 'int8':
+            scale = np.frombuffer(blob, dtype='<f4', count=num_stored, offset=offset)
+            quantized = np.frombuffer(blob, dtype=np.int8, count=num_stored * width, offset=offset + 4 * num_stored)
+            rows = (quantized.reshape(num_stored, width) * scale[:, None]).astype(np.float32)
+    rows = rows.reshape(num_stored, width)
+    if inverse is not None:
+        rows = rows[inverse]
+
+    return torch.from_numpy(rows.reshape(shape).copy())
+
+def fingerprint2bytes(fingerprint: Union[str, bytes, None]) -> bytes:
+    # 8 bytes identifying the model a latent belongs to (zeros if unknown)
+    if fingerprint is None:
+        return bytes(8)
+    if isinstance(fingerprint, str):
+        fingerprint = bytes.fromhex(fingerprint[:16])
+    return fingerprint[:8].ljust(8, b'\0')
+
+def tensor2str(tensor: Union[torch.Tensor, np.ndarray], dtype: str='float32',
+                fingerprint: Union[str, bytes, None]=None) -> str:
+    return bytes2str(tensor2bytes(tensor, dtype=dtype, fingerprint=fingerprint))
+
+def str2tensor(encoded: str) -> torch.Tensor:
+    encoded = encoded.strip()
+    if encoded.startswith(LATENT_PREFIX):
+        return bytes2tensor(str2bytes(encoded))
+    return legacy_str2tensor(encoded)
+
+def bytes2str(blob: bytes) -> str:
+    return LATENT_PREFIX + base64.b64encode(blob).decode("ascii")
+
+def str2bytes(encoded: str) -> bytes:
+    return base64.b64decode(encoded.strip()[len(LATENT_PREFIX):])
+
+def legacy_tensor2str(tensor: Union[torch.Tensor, np.ndarray]) -> str:
     if isinstance(tensor, torch.Tensor):
         # logger("converting to numpy")
         tensor = tensor.cpu().numpy()
@@ -38,7 +180,7 @@ def tensor2str(tensor: Union[torch.Tensor, np.ndarray]) -> str:
 
     return encoded_bytes.decode('utf-8')
 
-def str2tensor(encoded: str) -> torch.Tensor:
+def legacy_str2tensor(encoded: str) -> torch.Tensor:
     # if not str.startswith("eJzt1"):
     #     logger("Vector is malformed: ", encoded[:5], "... ignoring")
     #     return torch.Tensor(0)
@@ -54,5 +196,12 @@ def crc_hash(string: str) -> str:  # 8 characters
     crc = zlib.crc32(string.encode())
     return format(crc & 0xFFFFFFFF, '08x')
 
+def latent_hash(tensor: Union[torch.Tensor, np.ndarray]) -> str: # 8 characters
+    # names renders of latents in file names. Hashes the legacy string form, which does not depend on
+    # the codec, so file names stay the same as those cached before the compact codec.
+    if isinstance(tensor, torch.Tensor):
+        tensor = tensor.detach().cpu().numpy()
+    return crc_hash(legacy_tensor2str(np.asarray(tensor, dtype=np.float32)))
+
 def sha_hash(string: str) -> str:    # 64 characters
     return hashlib.sha256(string.encode()).hexdigest()
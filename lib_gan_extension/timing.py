@@ -0,0 +1,71 @@
+from __future__ import annotations
+from contextlib import contextmanager, nullcontext
+import threading
+import time
+import torch
+
+from . import global_state
+
+# Stage timers of the render path, reported through torch_utils.training_stats under 'Stage/<name>'.
+# While a profiler capture runs (see profiling.py), stages are also tagged with record_function.
+# When both are off, stage() returns a shared no-op context and nothing else runs, and
+# training_stats (which pulls in dnnlib) is not even imported.
+PREFIX = 'Stage/'
+STAGES = ('load', 'mapping', 'synthesis', 'to_pil', 'encode', 'save', 'metadata', 'decode') # table order
+_NULL = nullcontext()
+_lock = threading.Lock() # report() and Collector.update() share the global counters
+_collector = None
+tagging = False # set by profiling while it captures
+
+def stage(name: str, device: torch.device | str | None=None):
+    """Time the block as a stage. Pass the device of asynchronous cuda work to time its completion."""
+    if not (global_state.stage_timing or tagging):
+        return _NULL
+    return _timed(name, device)
+
+@contextmanager
+def _timed(name: str, device):
+    timed = global_state.stage_timing
+    with torch.profiler.record_function(PREFIX + name) if tagging else _NULL:
+        if timed:
+            synchronize(device)
+            start = time.perf_counter()
+        yield
+        if timed:
+            synchronize(device)
+            report(name, time.perf_counter() - start)
+
+def synchronize(device) -> None:
+    if device is not None and str(device).startswith('cuda'):
+        torch.cuda.synchronize(device)
+
+def report(name: str, seconds: float) -> None:
+    from torch_utils import training_stats
+    collector() # a Collector only sees what is reported after it is created
+    with _lock:
+        training_stats.report(PREFIX + name, seconds)
+
+def collector():
+    global _collector
+    from torch_utils import training_stats
+    with _lock:
+        if _collector is None:
+            _collector = training_stats.Collector(regex=PREFIX + '.*')
+    return _collector
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+def table() -> list[list]:
+    """[stage, count, mean ms, std ms, p50, p95, p99 ms] of the stages timed since the previous call (or the last ones seen)."""
+    c = collector()
+    with _lock:
+        c.update()
+    names = [name[len(PREFIX):] for name in c.names()]
+    names = sorted(names, key=lambda name: (STAGES.index(name) if name in STAGES else len(STAGES), name))
+    rows = []
+    for name in names:
+        key = PREFIX + name
+        if c.num(key):
+            ms = [c.mean(key), float(c.std(key)), *c.quantiles(key, QUANTILES)]
+            rows.append([name, c.num(key), *(round(seconds * 1000, 2) for seconds in ms)])
+    return rows
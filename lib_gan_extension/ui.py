@@ -11,15 +11,20 @@ import gradio as gr
 from modules import script_callbacks, shared, ui, ui_components
 from modules.ui_components import ToolButton
 
-from lib_gan_extension import global_state, file_utils, str_utils, metadata, GanGenerator, logger
+from lib_gan_extension import global_state, file_utils, str_utils, metadata, timing, profiling, GanGenerator, logger
+from lib_gan_extension.model_catalog import ModelCatalog
+from lib_gan_extension.mix_engine import MASK_LABELS
 ui.swap_symbol = "\U00002194"  # ↔️
 ui.lucky_symbol = "\U0001F340"  # 🍀
 ui.folder_symbol = "\U0001F4C1"  # 📁
 
-model = GanGenerator()
+model = GanGenerator.shared()
+catalog = ModelCatalog.shared()
 
 DEBUG_VECTORS = False
 
+MASK_CHOICES = list(MASK_LABELS.values())
+
 DESCRIPTION = '''# StyleGAN Image Generator
 
 Use this tool to generate random images with a pretrained StyleGAN3 network of your choice. 
@@ -38,6 +43,10 @@ def on_ui_tabs():
             model_refreshButton = ToolButton(value=ui.refresh_symbol, tooltip="Refresh")
             model_refreshButton.click(fn=lambda: gr.Dropdown.update(choices=update_model_list()),outputs=modelDrop)
 
+            modelInfo = gr.Markdown(value=lambda: catalog.describe(default_model()), elem_id="model-info")
+            modelDrop.change(fn=catalog.describe, inputs=[modelDrop], outputs=[modelInfo], show_progress=False)
+            model_refreshButton.click(fn=catalog.describe, inputs=[modelDrop], outputs=[modelInfo], show_progress=False)
+
             with gr.Group():
                 with gr.Column():
                     gr.Markdown(label='Output Folder', value="Output folder", elem_id="output-folder")
@@ -78,12 +87,18 @@ def on_ui_tabs():
                         with gr.Row():
                             seed1_to_mixButton = gr.Button('Send to Seed Mixer › Left')
                             seed2_to_mixButton = gr.Button('Send to Seed Mixer › Right')
+                        with gr.Row():
+                            exportButton = gr.Button('Export', elem_id="simple_export")
+                            exportTxt = gr.Markdown(label='Export', value="")
 
             seed_recycleButton.click(fn=copy_seed,show_progress=False,inputs=[seedTxt],outputs=[seedNum])
 
             simple_runButton.click(fn=model.generate_image_from_ui,
                             inputs=[modelDrop, seedNum, psiSlider],
                             outputs=[resultImg, seedTxt])
+            exportButton.click(fn=model.export_image_from_ui,
+                            inputs=[modelDrop, seedTxt, psiSlider],
+                            outputs=[exportTxt])
 
             with gr.TabItem('Seed Mixer', elem_id="mix-tab"):
                 with gr.Row():
@@ -109,7 +124,7 @@ def on_ui_tabs():
 
                 with gr.Row():
                     mix_maskDrop = gr.Dropdown(
-                        choices=[ "total (0xFFFF)", "coarse (0xFF00)", "mid (0x0FF0)", "fine (0x00FF)", "alt1 (0xF0F0)", "alt2 (0x0F0F)", "alt3 (0xF00F)"], label="Interpolation Mask", value=lambda:"total (0xFFFF)"
+                        choices=MASK_CHOICES, label="Interpolation Mask", value=lambda:"total (0xFFFF)"
                     )
                     mix_Slider = gr.Slider(-1,1,
                                     step=0.01,
@@ -117,6 +132,7 @@ def on_ui_tabs():
                                     label='Seed Mix (Crossfade)')
 
                     mix_runButton = gr.Button('Generate Style Mix', variant="primary", elem_id="mix_generate")
+                    mix_exportButton = gr.Button('Export', elem_id="mix_export")
 
                 with gr.Row(elem_id="mix-row"):
                     with gr.Column(elem_classes="mix-item"):
@@ -133,6 +149,7 @@ def on_ui_tabs():
 
                     with gr.Column(elem_classes="mix-item"):
                         mix_styleImg = gr.Image(label='Style Mixed Image', sources=['upload','clipboard'], interactive=True, type="filepath", elem_classes="gan-output")
+                        mix_exportTxt = gr.Markdown(label='Export', value="")
                         mix_vector_result = gr.Textbox(label='Vector Result', type="text", visible=DEBUG_VECTORS)
 
                     with gr.Column(elem_classes="mix-item"):
@@ -167,9 +184,126 @@ def on_ui_tabs():
                     mix_runButton.click(fn=model.generate_mix_from_ui,
                                     inputs=[modelDrop, mix_seed1_Num, mix_psi1_Slider, mix_seed2_Num, mix_psi2_Slider, mix_maskDrop, mix_Slider, mix_vector1, mix_vector2],
                                     outputs=[mix_seed1_Img, mix_seed2_Img, mix_styleImg, mix_seed1_Txt, mix_seed2_Txt, mix_vector1, mix_vector2, mix_vector_result])
+                    mix_exportButton.click(fn=model.export_mix_from_ui,
+                                    inputs=[modelDrop, mix_seed1_Txt, mix_psi1_Slider, mix_seed2_Txt, mix_psi2_Slider, mix_maskDrop, mix_Slider, mix_vector1, mix_vector2],
+                                    outputs=[mix_exportTxt])
+
+                with gr.Accordion('Similar Seeds', open=False, elem_id="similar-accordion"):
+                    with gr.Row():
+                        similar_sourceRadio = gr.Radio(choices=["Seed 1", "Style Mixed", "Seed 2"], value="Style Mixed", label="Find Seeds Like")
+                        similar_maskDrop = gr.Dropdown(
+                            choices=MASK_CHOICES, label="Compared Layers", value=lambda:"total (0xFFFF)"
+                        )
+                        similar_kSlider = gr.Slider(4,32,
+                                        step=4,
+                                        value=8,
+                                        label='Number of Seeds')
+                        similar_psi_Slider = gr.Slider(-1,1,
+                                        step=0.05,
+                                        value=0.7,
+                                        label='Truncation (psi)')
+                        similar_runButton = gr.Button('Find Similar Seeds', elem_id="similar_generate")
+                    similar_Txt = gr.Markdown(label='Similar Seeds', value="Searches the seed bank of the model, see `python -m lib_gan_extension.seed_bank`.")
+                    similar_Gallery = gr.Gallery(label='Similar Seeds', columns=8, allow_preview=False, elem_classes="gan-output")
+                    similar_seeds = gr.State([])
+                    with gr.Row():
+                        similar_seedNum = gr.Number(label='Selected Seed', value=None, min_width=150, precision=0, interactive=False)
+                        similar_to_mix1Button = gr.Button('Send to Seed Mixer › Left')
+                        similar_to_mix2Button = gr.Button('Send to Seed Mixer › Right')
+
+                    similar_runButton.click(fn=model.find_similar_from_ui,
+                                    inputs=[modelDrop, similar_sourceRadio, mix_seed1_Num, mix_psi1_Slider, mix_seed2_Num, mix_psi2_Slider, mix_vector1, mix_vector2, mix_vector_result, similar_maskDrop, similar_kSlider, similar_psi_Slider],
+                                    outputs=[similar_Gallery, similar_seeds, similar_Txt])
+                    similar_Gallery.select(fn=select_gallery_seed, inputs=[similar_seeds], outputs=[similar_seedNum], show_progress=False)
+                    similar_to_mix1Button.click(fn=lambda seed, psi: (seed, psi, None), inputs=[similar_seedNum, similar_psi_Slider], outputs=[mix_seed1_Num, mix_psi1_Slider, mix_vector1])
+                    similar_to_mix2Button.click(fn=lambda seed, psi: (seed, psi, None), inputs=[similar_seedNum, similar_psi_Slider], outputs=[mix_seed2_Num, mix_psi2_Slider, mix_vector2])
+
+            with gr.TabItem('Mix Grid', elem_id="grid-tab"):
+                with gr.Row():
+                    grid_seeds1_Txt = gr.Textbox(label='Row Seeds', value="1, 2, 3", info="Comma-separated seeds or ranges, e.g. 1, 5, 10-12")
+                    grid_seeds2_Txt = gr.Textbox(label='Column Seeds', value="4, 5, 6", info="Comma-separated seeds or ranges, e.g. 1, 5, 10-12")
+
+                with gr.Row():
+                    grid_psi_Slider = gr.Slider(-1,1,
+                                    step=0.05,
+                                    value=0.7,
+                                    label='Truncation (psi)')
+                    grid_maskDrop = gr.Dropdown(
+                        choices=MASK_CHOICES, label="Interpolation Mask", value=lambda:"coarse (0xFF00)"
+                    )
+                    grid_Slider = gr.Slider(-1,1,
+                                    step=0.01,
+                                    value=1,
+                                    label='Seed Mix (Crossfade)')
+
+                    grid_runButton = gr.Button('Generate Mix Grid', variant="primary", elem_id="grid_generate")
+
+                with gr.Row():
+                    with gr.Column():
+                        grid_sheetImg = gr.Image(label='Contact Sheet', interactive=False, type="pil", elem_classes="gan-output")
+                        grid_Txt = gr.Markdown(label='Grid', value="")
+                    with gr.Column():
+                        grid_Gallery = gr.Gallery(label='Mixed Images', columns=4, elem_classes="gan-output")
+
+                grid_runButton.click(fn=model.generate_mix_grid_from_ui,
+                                inputs=[modelDrop, grid_seeds1_Txt, grid_seeds2_Txt, grid_psi_Slider, grid_maskDrop, grid_Slider],
+                                outputs=[grid_sheetImg, grid_Gallery, grid_Txt])
+
+            with gr.TabItem('Seed Gallery', elem_id="gallery-tab"):
+                with gr.Row():
+                    gallery_modeRadio = gr.Radio(choices=["Range", "Random"], value="Range", label="Seeds", info="Consecutive seeds from the start seed, or random seeds keyed by it")
+                    gallery_startNum = gr.Number(label='Start Seed / Key', value=0, min_width=150, precision=0)
+                    gallery_luckyButton = ToolButton(ui.lucky_symbol, tooltip="Random pages with a new key")
+                    gallery_sizeSlider = gr.Slider(4,64,
+                                    step=4,
+                                    value=24,
+                                    label='Seeds per Page')
+                    gallery_psi_Slider = gr.Slider(-1,1,
+                                    step=0.05,
+                                    value=0.7,
+                                    label='Truncation (psi)')
+
+                with gr.Row():
+                    gallery_prevButton = gr.Button('◀ Previous Page', elem_id="gallery_prev")
+                    gallery_pageNum = gr.Number(label='Page', value=0, precision=0, visible=False)
+                    gallery_runButton = gr.Button('Generate Gallery', variant="primary", elem_id="gallery_generate")
+                    gallery_nextButton = gr.Button('Next Page ▶', elem_id="gallery_next")
+
+                gallery_Txt = gr.Markdown(label='Gallery', value="")
+                gallery_Gallery = gr.Gallery(label='Seeds', columns=8, allow_preview=False, elem_classes="gan-output")
+                gallery_seeds = gr.State([])
+                with gr.Row():
+                    gallery_seedNum = gr.Number(label='Selected Seed', value=None, min_width=150, precision=0, interactive=False)
+                    gallery_to_simpleButton = gr.Button('Send to Simple Image Gen')
+                    gallery_to_mix1Button = gr.Button('Send to Seed Mixer › Left')
+                    gallery_to_mix2Button = gr.Button('Send to Seed Mixer › Right')
+
+                # previews are cached, so paging back and forth only renders pages never seen before
+                gallery_inputs = [modelDrop, gallery_startNum, gallery_pageNum, gallery_sizeSlider, gallery_psi_Slider, gallery_modeRadio]
+                gallery_outputs = [gallery_Gallery, gallery_seeds, gallery_Txt]
+                gallery_runButton.click(fn=model.generate_gallery_from_ui, inputs=gallery_inputs, outputs=gallery_outputs)
+                gallery_prevButton.click(fn=lambda page: max(int(page or 0) - 1, 0), inputs=[gallery_pageNum], outputs=[gallery_pageNum], show_progress=False).then(
+                                fn=model.generate_gallery_from_ui, inputs=gallery_inputs, outputs=gallery_outputs)
+                gallery_nextButton.click(fn=lambda page: int(page or 0) + 1, inputs=[gallery_pageNum], outputs=[gallery_pageNum], show_progress=False).then(
+                                fn=model.generate_gallery_from_ui, inputs=gallery_inputs, outputs=gallery_outputs)
+                gallery_luckyButton.click(fn=lambda: (model.newSeed(), 0, "Random"), inputs=[], outputs=[gallery_startNum, gallery_pageNum, gallery_modeRadio], show_progress=False).then(
+                                fn=model.generate_gallery_from_ui, inputs=gallery_inputs, outputs=gallery_outputs)
+                gallery_Gallery.select(fn=select_gallery_seed, inputs=[gallery_seeds], outputs=[gallery_seedNum], show_progress=False)
+
+            with gr.TabItem('Stage Timings', elem_id="timing-tab"):
+                with gr.Row():
+                    timing_Txt = gr.Markdown(value=timing_status)
+                    timing_refreshButton = ToolButton(value=ui.refresh_symbol, tooltip="Refresh")
+                timing_Table = gr.Dataframe(headers=TIMING_HEADERS, value=timing_table, interactive=False)
+                timing_refreshButton.click(fn=lambda: (timing_status(), timing_table()), outputs=[timing_Txt, timing_Table], show_progress=False)
 
             seed1_to_mixButton.click(fn=copy_seed, inputs=[seedTxt],outputs=[mix_seed1_Num])
             seed2_to_mixButton.click(fn=copy_seed, inputs=[seedTxt],outputs=[mix_seed2_Num])
+            # the full render of a seed seen before comes from the output cache
+            gallery_to_simpleButton.click(fn=lambda seed, psi: (seed, psi), inputs=[gallery_seedNum, gallery_psi_Slider], outputs=[seedNum, psiSlider]).then(
+                            fn=model.generate_image_from_ui, inputs=[modelDrop, seedNum, psiSlider], outputs=[resultImg, seedTxt])
+            gallery_to_mix1Button.click(fn=lambda seed, psi: (seed, psi, None), inputs=[gallery_seedNum, gallery_psi_Slider], outputs=[mix_seed1_Num, mix_psi1_Slider, mix_vector1])
+            gallery_to_mix2Button.click(fn=lambda seed, psi: (seed, psi, None), inputs=[gallery_seedNum, gallery_psi_Slider], outputs=[mix_seed2_Num, mix_psi2_Slider, mix_vector2])
 
         gui = ui_component
         return [(ui_component, "GAN Generator", "gan_generator_tab")]
@@ -189,26 +323,65 @@ def on_ui_settings():
     shared.opts.onchange('gan_generator_image_format', update_image_format)
 
     shared.opts.add_option('gan_generator_image_pad',
-        shared.OptionInfo(1.0, "Image padding factor", gr.Slider, {"minimum":1,"maximum":2,"step":0.05,"info":"Resizes image. If > 1, will pad with black border. Useful for zoomed-in faces."}, section=section))
+        shared.OptionInfo(1.0, "Image padding factor", gr.Slider, {"minimum":1,"maximum":2,"step":0.05,"info":"Resizes image. If > 1, will pad with black border. Useful for zoomed-in faces. Applied on display, saved with the Export buttons."}, section=section))
     shared.opts.onchange('gan_generator_image_pad', update_image_padding)
+
+    shared.opts.add_option('gan_generator_batch_size',
+        shared.OptionInfo(4, "Batch size", gr.Slider, {"minimum":1,"maximum":64,"step":1,"info":"Number of images synthesized at once in grid and batch modes. Lower it if you run out of memory."}, section=section))
+    shared.opts.onchange('gan_generator_batch_size', update_batch_size)
+
+    shared.opts.add_option('gan_generator_preview_size',
+        shared.OptionInfo(256, "Preview size", gr.Slider, {"minimum":64,"maximum":512,"step":64,"info":"Previews run only the first layers of the network up to about this resolution. They approximate the full render and are cached separately."}, section=section))
+    shared.opts.onchange('gan_generator_preview_size', update_preview_size)
+
+    shared.opts.add_option('gan_generator_interactive_target',
+        shared.OptionInfo(0.5, "Interactive wait target (seconds)", gr.Slider, {"minimum":0.1,"maximum":5,"step":0.1,"info":"Bulk API jobs shrink their batches so a click in the tab waits at most about this long."}, section=section))
+    shared.opts.onchange('gan_generator_interactive_target', update_interactive_target)
+
+    shared.opts.add_option('gan_generator_cache_budget',
+        shared.OptionInfo(0.0, "Image cache budget (GB)", gr.Number, {"info":"Least recently used images are deleted beyond this size, their latents are kept. 0 for no limit."}, section=section))
+    shared.opts.onchange('gan_generator_cache_budget', update_cache_budget)
+
+    shared.opts.add_option('gan_generator_warm_up',
+        shared.OptionInfo(False, "Warm up the model at startup", gr.Checkbox, {"info":"Loads the most recently used model and renders a test batch in the background when the WebUI starts, so the first click is fast."}, section=section))
+    shared.opts.onchange('gan_generator_warm_up', update_warm_up)
+
+    shared.opts.add_option('gan_generator_stage_timing',
+        shared.OptionInfo(False, "Time render stages", gr.Checkbox, {"info":"Measures model load, mapping, synthesis, conversion, saving and metadata parsing for the Stage Timings tab. Slightly slows down cuda renders."}, section=section))
+    shared.opts.onchange('gan_generator_stage_timing', update_stage_timing)
+
+    shared.opts.add_option('gan_generator_profile_renders',
+        shared.OptionInfo(0, "Profile the next N renders", gr.Number, {"precision":0,"info":"Captures each of the next N renders with torch.profiler when changed and applied. A Chrome trace and a summary of the slowest ops go to the profiles output folder."}, section=section))
+    shared.opts.onchange('gan_generator_profile_renders', update_profile_renders, call=False)
     
 script_callbacks.on_ui_settings(on_ui_settings)
 
+def on_app_started(demo, app):
+    if global_state.warm_up:
+        model_name = default_model()
+        if model_name is not None:
+            model.start_warm_up(model_name)
+
+script_callbacks.on_app_started(on_app_started)
+
 def copy_seed(seedTxt) -> (Union[int, None]):
     return str_utils.str2num(seedTxt)
 
 def copy_seed_and_clear_vector(seedTxt) -> (Union[int, None], None):
     return str_utils.str2num(seedTxt), None
 
+def select_gallery_seed(seeds: list[int], evt: gr.SelectData) -> Union[int, None]:
+    return seeds[evt.index] if evt.index < len(seeds) else None
+
 def update_model_list() -> tuple[str]:
-    files = file_utils.model_path.glob("*.pkl")
-    return [os.path.basename(file) for file in sorted(files, key=lambda file: (os.stat(file).st_mtime, file), reverse=True)]
+    return catalog.models()
 
 def default_model() -> Union[str, None]:
-    return update_model_list()[0] if update_model_list() else None
+    models = update_model_list()
+    return models[0] if models else None
 
 def touch_model_file(modelDrop) -> None:
-    file_utils.touch( file_utils.model_path / modelDrop )
+    catalog.touch(modelDrop)
 
 def default_device() -> str:
     if torch.backends.mps.is_available():
@@ -238,6 +411,45 @@ def update_image_padding():
     global_state.image_pad = shared.opts.data.get('gan_generator_image_pad', '1.0')
     logger(f"Output padding: {global_state.image_pad}")
 
+def update_batch_size():
+    global_state.batch_size = int(shared.opts.data.get('gan_generator_batch_size', 4))
+    logger(f"Batch size: {global_state.batch_size}")
+
+def update_preview_size():
+    global_state.preview_size = int(shared.opts.data.get('gan_generator_preview_size', 256))
+    logger(f"Preview size: {global_state.preview_size}")
+
+def update_interactive_target():
+    global_state.interactive_target = float(shared.opts.data.get('gan_generator_interactive_target', 0.5))
+    logger(f"Interactive wait target: {global_state.interactive_target}s")
+
+def update_cache_budget():
+    global_state.cache_budget = float(shared.opts.data.get('gan_generator_cache_budget', 0.0))
+    logger(f"Image cache budget: {global_state.cache_budget} GB")
+    model.cache.refresh()
+
+def update_warm_up():
+    global_state.warm_up = bool(shared.opts.data.get('gan_generator_warm_up', False))
+
+def update_stage_timing():
+    global_state.stage_timing = bool(shared.opts.data.get('gan_generator_stage_timing', False))
+
+def update_profile_renders():
+    profiling.arm(shared.opts.data.get('gan_generator_profile_renders', 0) or 0)
+
+TIMING_HEADERS = ["Stage", "Count", "Mean (ms)", "Std (ms)", "p50 (ms)", "p95 (ms)", "p99 (ms)"]
+
+def timing_status() -> str:
+    if not global_state.stage_timing:
+        status = "Enable `Time render stages` in settings to collect timings."
+    else:
+        status = "Stages timed since the previous refresh (or their last measurements)."
+    if profiling.remaining:
+        status += f" Profiling the next {profiling.remaining} renders into `{model.profile_path()}`."
+    return status
+
+def timing_table() -> list[list]:
+    return timing.table() or [["", 0] + [None] * (len(TIMING_HEADERS) - 2)]
 
 # fetch metadata from drag-and-drop (gr.Image.upload callback)
 def get_simple_params_from_image(img) -> (int, float, Union[Image.Image,None], str ):
@@ -0,0 +1,43 @@
+from __future__ import annotations
+from typing import Union
+from PIL import Image
+
+# Derived views are cheap post-ops applied to a cached render when it is served. They are never
+# written to the cache; GanGenerator.export_image persists one on request. A view is a dict of
+# {op: argument}, applied in order, e.g. {'pad': 1.2, 'resize': 512}.
+
+def pad(image: Image.Image, factor: float) -> Image.Image:
+    """Center the image on a black square canvas factor times its size."""
+    new_size = int(image.width * factor)
+    padded = Image.new(image.mode, (new_size, new_size), (0, 0, 0))
+    padding = int((new_size - image.width) / 2)
+    padded.paste(image, box=(padding, padding))
+    return padded
+
+def resize(image: Image.Image, size: int) -> Image.Image:
+    return image.resize((size, size), Image.LANCZOS)
+
+def crop(image: Image.Image, box: tuple[int, int, int, int]) -> Image.Image:
+    return image.crop(tuple(box))
+
+OPS = {
+    'pad': pad,
+    'resize': resize,
+    'crop': crop,
+}
+IDENTITY = {
+    'pad': 1.0,
+}
+
+def normalize(view: Union[dict, None]) -> dict:
+    """The view without no-op entries, so {'pad': 1.0} and {} are the same view."""
+    view = {op: arg for op, arg in (view or {}).items() if arg is not None and IDENTITY.get(op) != arg}
+    for op in view:
+        if op not in OPS:
+            raise ValueError(f"Unknown view op: {op}")
+    return view
+
+def apply(image: Image.Image, view: Union[dict, None]) -> Image.Image:
+    for op, arg in normalize(view).items():
+        image = OPS[op](image, arg)
+    return image
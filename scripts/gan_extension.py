@@ -1,5 +1,5 @@
 from modules import scripts #, shared
-import lib_gan_extension
+from lib_gan_extension import ui, api # register the tab, settings and API routes
 
 # class GanExtensionScript(scripts.Script):
 #     def __init__(self):
@@ -0,0 +1,17 @@
+from pathlib import Path
+
+import pytest
+
+from benchmarks import synthetic
+
+def tiny_model(folder: Path, name: str, seed: int=0) -> Path:
+    """A randomly initialized 32 px StyleGAN2 checkpoint, small enough to render on a cpu in milliseconds."""
+    return synthetic.save(synthetic.build('stylegan2', 32, channel_base=512, channel_max=32, w_dim=64, seed=seed), folder / name)
+
+@pytest.fixture(scope='session')
+def model_file(tmp_path_factory) -> Path:
+    return tiny_model(tmp_path_factory.mktemp('models'), 'tiny.pkl')
+
+@pytest.fixture(scope='session')
+def other_model_file(tmp_path_factory) -> Path:
+    return tiny_model(tmp_path_factory.mktemp('models'), 'other.pkl', seed=1)
@@ -0,0 +1,125 @@
+import io
+
+import pytest
+import torch
+from PIL import Image
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from lib_gan_extension import GanGenerator, api, metadata, str_utils
+
+@pytest.fixture(scope='module')
+def generator(tmp_path_factory) -> GanGenerator:
+    return GanGenerator(tmp_path_factory.mktemp('outputs'))
+
+@pytest.fixture(scope='module')
+def client(generator) -> TestClient:
+    app = FastAPI()
+    app.include_router(api.create_router(generator))
+    return TestClient(app)
+
+def post(client: TestClient, path: str, **body):
+    return client.post(api.API_PREFIX + path, json=body)
+
+def params_of(data: bytes) -> dict:
+    return metadata.parse_image(Image.open(io.BytesIO(data)))[0]
+
+def multipart(response) -> list[(dict, bytes)]:
+    """(headers, body) of each part of a multipart/mixed response."""
+    boundary = response.headers['content-type'].split('boundary=')[1].encode('latin-1')
+    parts = []
+    for chunk in response.content.split(b'--' + boundary)[1:-1]:
+        head, body = chunk.lstrip(b'\r\n').split(b'\r\n\r\n', 1)
+        headers = dict(line.split(': ', 1) for line in head.decode('latin-1').split('\r\n'))
+        parts.append((headers, body[:-2]))
+    return parts
+
+def test_generate(client, model_file):
+    r = post(client, '/generate', model=str(model_file), seed=3, psi=0.5)
+    assert r.status_code == 200 and r.headers['content-type'] == api.PNG_TYPE
+    assert r.headers['X-Seed'] == '3'
+    assert Image.open(io.BytesIO(r.content)).size == (32, 32)
+    assert {'seed': 3, 'psi': 0.5}.items() <= params_of(r.content).items()
+
+def test_generate_random_seed(client, model_file):
+    r = post(client, '/generate', model=str(model_file), seed=-1)
+    assert r.status_code == 200
+    assert 0 <= int(r.headers['X-Seed']) <= 0xFFFFFFFF
+
+def test_generate_latent_round_trip(client, model_file, generator):
+    r = post(client, '/generate', model=str(model_file), seed=3, format='latent')
+    assert r.status_code == 200 and r.headers['content-type'] == api.LATENT_TYPE
+    w = str_utils.bytes2tensor(r.content)
+    assert list(w.shape) == [1, generator.GAN.num_ws, generator.GAN.w_dim]
+    assert torch.allclose(w, generator.GAN.get_w_from_seed(3, 0.7).cpu())
+    r = post(client, '/generate', model=str(model_file), w=str_utils.tensor2str(w))
+    assert r.status_code == 200
+    assert params_of(r.content)['seed'] == f"V{str_utils.latent_hash(w)}"
+
+def test_mix(client, model_file):
+    r = post(client, '/mix', model=str(model_file), seed1=1, seed2=2, mask='coarse', mix=0.5)
+    assert r.status_code == 200 and r.headers['content-type'] == api.PNG_TYPE
+    assert {'seed1': 1, 'seed2': 2, 'interp': "coarse (0xFF00)"}.items() <= params_of(r.content).items()
+
+def test_mix_random_seed(client, model_file):
+    r = post(client, '/mix', model=str(model_file), seed1=-1, seed2=None)
+    assert r.status_code == 200
+    seed1, seed2 = int(r.headers['X-Seed1']), int(r.headers['X-Seed2'])
+    assert (params_of(r.content)['seed1'], params_of(r.content)['seed2']) == (seed1, seed2)
+
+def test_mix_shares_the_ui_cache(client, model_file, generator):
+    generator.set_model(str(model_file))
+    generator.generate_image_mix(4, 0.7, 5, 0.7, "mid (0x0FF0)", -0.25, 1.0, None, None)
+    files = sorted(generator.output_path().rglob('mix*'))
+    r = post(client, '/mix', model=str(model_file), seed1=4, seed2=5, mask=0x0FF0, mix=-0.25)
+    assert r.status_code == 200
+    assert sorted(generator.output_path().rglob('mix*')) == files
+    assert r.content in [path.read_bytes() for path in files]
+
+def test_batch(client, model_file, generator):
+    w = str_utils.tensor2str(generator.GAN.get_w_from_seed(9, 0.7))
+    r = post(client, '/batch', model=str(model_file), seeds='0-4', ws=[w], batch_size=2)
+    assert r.status_code == 200 and r.headers['content-type'].startswith('multipart/mixed')
+    parts = multipart(r)
+    assert [headers['Content-Disposition'].split('"')[1] for headers, _ in parts] == [f"seed-{i}" for i in range(5)] + ["w-0"]
+    assert [int(params_of(data)['seed']) for _, data in parts[:5]] == list(range(5))
+
+def test_batch_keeps_its_model(client, model_file, other_model_file, generator, monkeypatch):
+    batches = generator.scheduler.batches
+    loaded = [] # the model of the tab after each batch
+    def switching(*args):
+        for group, result in batches(*args):
+            loaded.append(generator.model_name)
+            generator.set_model(str(other_model_file)) # the tab loads another model between two batches
+            yield group, result
+    monkeypatch.setattr(generator.scheduler, 'batches', switching)
+    r = post(client, '/batch', model=str(model_file), seeds=[10, 11, 12], batch_size=1)
+    fingerprints = {params_of(data)['fingerprint'] for _, data in multipart(r)}
+    monkeypatch.undo()
+    assert loaded == [str(model_file), str(other_model_file), str(other_model_file)] # the stream never switched back
+    generator.set_model(str(model_file))
+    assert fingerprints == {generator.fingerprint}
+
+def test_interpolate(client, model_file):
+    r = post(client, '/interpolate', model=str(model_file), seed1=1, seed2=2, steps=5, batch_size=2, mask='fine')
+    assert r.status_code == 200
+    parts = multipart(r)
+    assert [float(headers['X-Mix']) for headers, _ in parts] == [-1.0, -0.5, 0.0, 0.5, 1.0]
+    assert {params_of(data)['interp'] for _, data in parts} == {"fine (0x00FF)"}
+    r = post(client, '/interpolate', model=str(model_file), seed1=1, seed2=2, steps=5, format='latent')
+    assert list(str_utils.bytes2tensor(r.content).shape[:1]) == [5]
+
+@pytest.mark.parametrize('path, body, status', [
+    ('/generate', {'model': 'missing.pkl', 'seed': 1}, 404),
+    ('/generate', {'model': None, 'seed': 1}, 422),
+    ('/generate', {'seed': 1 << 32}, 422),
+    ('/generate', {'w': [[0.0] * 3]}, 422),
+    ('/mix', {'seed1': -2, 'seed2': 1}, 422),
+    ('/mix', {'seed1': 1, 'seed2': 2, 'mask': 'nope'}, 422),
+    ('/batch', {'seeds': []}, 422),
+    ('/batch', {'seeds': 'a-b'}, 422),
+    ('/interpolate', {'seed1': 1, 'seed2': 2, 'steps': 1}, 422),
+])
+def test_errors(client, model_file, path, body, status):
+    body = {'model': str(model_file), **body}
+    assert post(client, path, **body).status_code == status
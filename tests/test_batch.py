@@ -0,0 +1,22 @@
+from pathlib import Path
+
+from lib_gan_extension import batch, global_state, output_cache
+
+def cached_files(root: Path) -> dict[str, bytes]:
+    return {str(path.relative_to(root)): path.read_bytes()
+                for path in root.rglob('*') if path.suffix in output_cache.IMAGE_SUFFIXES}
+
+def test_shared_weights_match_single_process(model_file, tmp_path, monkeypatch):
+    for name in ('device', 'image_format', 'batch_size'): # init_worker sets them for this process too
+        monkeypatch.setattr(global_state, name, getattr(global_state, name))
+    monkeypatch.setattr(batch, '_generator', None)
+    items = batch.job_items(list(range(6)), [0.7], [batch.MixSpec.parse('0-1:2-3:coarse:-0.5,0.5')])
+
+    batch.init_worker(str(model_file), str(tmp_path / 'single'), 'cpu', 1, 'png', 2)
+    batch.render_group(items)
+    batch.run(items, str(model_file), str(tmp_path / 'shared'), workers=2, threads=1, batch_size=2, shard_size=3,
+              share_weights=True)
+
+    expected = cached_files(tmp_path / 'single')
+    assert len(expected) == len(items)
+    assert cached_files(tmp_path / 'shared') == expected
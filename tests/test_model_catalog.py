@@ -0,0 +1,46 @@
+import os
+import shutil
+
+from lib_gan_extension import model_catalog
+from lib_gan_extension.model_catalog import ModelCatalog
+
+def counting(monkeypatch) -> list:
+    calls = []
+    hash_file = model_catalog.file_fingerprint
+    def file_fingerprint(path):
+        calls.append(path)
+        return hash_file(path)
+    monkeypatch.setattr(model_catalog, 'file_fingerprint', file_fingerprint)
+    return calls
+
+def test_fingerprints_of_paths_are_memoized(model_file, other_model_file, tmp_path, monkeypatch):
+    path = tmp_path / 'model.pkl'
+    shutil.copy(model_file, path)
+    catalog = ModelCatalog(tmp_path / 'models')
+    calls = counting(monkeypatch)
+    first = catalog.fingerprint(str(path))
+    assert all(catalog.fingerprint(name) == first for name in (str(path), path, str(tmp_path / '.' / 'model.pkl')))
+    assert len(calls) == 1
+    assert not catalog.path.exists() # paths are not written to the catalog file
+
+    shutil.copy(other_model_file, path)
+    os.utime(path, ns=(0, 10 ** 9))
+    assert catalog.fingerprint(str(path)) != first
+    assert len(calls) == 2
+
+def test_touch_after_same_size_replacement_reindexes(model_file, other_model_file, tmp_path):
+    assert model_file.stat().st_size == other_model_file.stat().st_size
+    folder = tmp_path / 'models'
+    folder.mkdir()
+    shutil.copy(model_file, folder / 'x.pkl')
+    catalog = ModelCatalog(folder)
+    catalog.models()
+    first = catalog.fingerprint('x.pkl')
+    shutil.copy(other_model_file, folder / 'new.pkl')
+    os.replace(folder / 'new.pkl', folder / 'x.pkl')
+    catalog.touch('x.pkl')
+    replaced = catalog.fingerprint('x.pkl')
+    assert replaced != first
+    assert replaced == model_catalog.file_fingerprint(other_model_file)
+    catalog.touch('x.pkl')
+    assert catalog.fingerprint('x.pkl') == replaced and catalog.info('x.pkl') is not None
@@ -0,0 +1,53 @@
+import threading
+
+import pytest
+import torch
+from PIL import Image, PngImagePlugin
+
+from lib_gan_extension import GanGenerator, global_state, metadata, output_cache, str_utils
+
+@pytest.fixture
+def generator(model_file, tmp_path) -> GanGenerator:
+    generator = GanGenerator(tmp_path / 'outputs')
+    generator.set_model(str(model_file))
+    return generator
+
+def save_legacy_image(path, params: dict) -> None:
+    """An image as written before the latent chunks: the params, latents included, as a dict repr."""
+    info = PngImagePlugin.PngInfo()
+    info.add_text('parameters', repr({**params, 'extension': metadata.EXTENSION}))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new('RGB', (32, 32)).save(path, pnginfo=info)
+
+def test_eviction_keeps_latents_of_legacy_vector_mixes(generator, monkeypatch):
+    shape = (1, generator.GAN.num_ws, generator.GAN.w_dim)
+    latents = {key: torch.randn(shape) for key in ('tensor', 'tensor1', 'tensor2')}
+    params, _ = generator.mix_params(None, 0.7, None, 0.7, "total (0xFFFF)", 0.0, latents['tensor1'], latents['tensor2'])
+    filename = generator.image_path_with_params(params, base="mix")
+    path = generator.image_file(filename)
+    save_legacy_image(path, {**params, **{key: str_utils.legacy_tensor2str(w) for key, w in latents.items()}})
+
+    monkeypatch.setattr(global_state, 'cache_budget', 1e-9) # one byte, evicts everything
+    generator.cache.refresh().join()
+
+    assert not path.exists()
+    found = generator.find_latents(filename)
+    assert found.keys() == latents.keys()
+    assert all(torch.equal(found[key].reshape(shape), w) for key, w in latents.items())
+
+def test_scans_run_in_the_background(generator, monkeypatch):
+    generator.generate_image(1, 0.7)
+    release = threading.Event()
+    scan = output_cache.OutputCache.scan
+    def slow_scan(self):
+        release.wait(10)
+        return scan(self)
+    monkeypatch.setattr(output_cache.OutputCache, 'scan', slow_scan)
+    monkeypatch.setattr(global_state, 'cache_budget', 1.0)
+
+    cache = output_cache.OutputCache(generator.outputRoot) # starts the first scan
+    cache.added(100) # returns while the scan is blocked
+    assert cache.size is None and cache.worker.is_alive()
+    release.set()
+    cache.worker.join()
+    assert cache.size == sum(path.stat().st_size for path in generator.output_path().rglob('*.png'))
@@ -11,7 +11,10 @@ arbitrarily high order gradients with zero performance penalty."""
 
 import contextlib
 import torch
-from pkg_resources import parse_version
+try:
+    from pkg_resources import parse_version
+except ImportError: # pkg_resources was removed from recent setuptools
+    from packaging.version import parse as parse_version
 
 # pylint: disable=redefined-builtin
 # pylint: disable=arguments-differ
@@ -21,6 +21,9 @@ from . import misc
 #----------------------------------------------------------------------------
 
 _num_moments    = 3             # [num_scalars, sum_of_scalars, sum_of_squares]
+_hist_edges     = np.logspace(-6, 4, 101) # Log-spaced histogram bucket edges, 10 per decade from 1e-6 to 1e4.
+_num_buckets    = len(_hist_edges) + 1  # [below first edge, ..., at or above last edge]
+_num_counters   = _num_moments + _num_buckets
 _reduce_dtype   = torch.float32 # Data type to use for initial per-tensor reduction.
 _counter_dtype  = torch.float64 # Data type to use for the internal counters.
 _rank           = 0             # Rank of the current process.
@@ -28,6 +31,7 @@ _sync_device    = None          # Device to use for multiprocess communication.
 _sync_called    = False         # Has _sync() been called yet?
 _counters       = dict()        # Running counters on each device, updated by report(): name => device => torch.Tensor
 _cumulative     = dict()        # Cumulative counters on the CPU, updated by _sync(): name => torch.Tensor
+_edges          = dict()        # Histogram edges on each device: device => torch.Tensor
 
 #----------------------------------------------------------------------------
 
@@ -61,6 +65,11 @@ def report(name, value):
     called from anywhere in the training loop, loss function, or inside a
     `torch.nn.Module`.
 
+    Besides the moments, the scalars are counted in a histogram of
+    log-spaced buckets, from which `Collector.quantile()` estimates
+    quantiles. The buckets are meant for positive values such as latencies;
+    zero and negative values all land in the lowest bucket.
+
     Warning: The current implementation expects the set of unique names to
     be consistent across processes. Please make sure that `report()` is
     called at least once for each unique name by each process, and in the
@@ -90,12 +99,15 @@ def report(name, value):
         elems.square().sum(),
     ])
     assert moments.ndim == 1 and moments.shape[0] == _num_moments
-    moments = moments.to(_counter_dtype)
-
     device = moments.device
+    if device not in _edges:
+        _edges[device] = torch.as_tensor(_hist_edges, dtype=_reduce_dtype, device=device)
+    buckets = torch.bincount(torch.bucketize(elems, _edges[device], right=True), minlength=_num_buckets)
+    counters = torch.cat([moments.to(_counter_dtype), buckets[:_num_buckets].to(_counter_dtype)])
+
     if device not in _counters[name]:
-        _counters[name][device] = torch.zeros_like(moments)
-    _counters[name][device].add_(moments)
+        _counters[name][device] = torch.zeros_like(counters)
+    _counters[name][device].add_(counters)
     return value
 
 #----------------------------------------------------------------------------
@@ -112,13 +124,13 @@ def report0(name, value):
 
 class Collector:
     r"""Collects the scalars broadcasted by `report()` and `report0()` and
-    computes their long-term averages (mean and standard deviation) over
-    user-defined periods of time.
+    computes their long-term averages (mean and standard deviation) and
+    quantiles over user-defined periods of time.
 
     The averages are first collected into internal counters that are not
     directly visible to the user. They are then copied to the user-visible
     state as a result of calling `update()` and can then be queried using
-    `mean()`, `std()`, `as_dict()`, etc. Calling `update()` also resets the
+    `mean()`, `std()`, `quantile()`, `as_dict()`, etc. Calling `update()` also resets the
     internal counters for the next round, so that the user-visible state
     effectively reflects averages collected between the last two calls to
     `update()`.
@@ -161,7 +173,7 @@ class Collector:
             self._moments.clear()
         for name, cumulative in _sync(self.names()):
             if name not in self._cumulative:
-                self._cumulative[name] = torch.zeros([_num_moments], dtype=_counter_dtype)
+                self._cumulative[name] = torch.zeros([_num_counters], dtype=_counter_dtype)
             delta = cumulative - self._cumulative[name]
             self._cumulative[name].copy_(cumulative)
             if float(delta[0]) != 0:
@@ -174,7 +186,7 @@ class Collector:
         """
         assert self._regex.fullmatch(name)
         if name not in self._moments:
-            self._moments[name] = torch.zeros([_num_moments], dtype=_counter_dtype)
+            self._moments[name] = torch.zeros([_num_counters], dtype=_counter_dtype)
         return self._moments[name]
 
     def num(self, name):
@@ -209,6 +221,53 @@ class Collector:
         raw_var = float(delta[2] / delta[0])
         return np.sqrt(max(raw_var - np.square(mean), 0))
 
+    def quantile(self, name, q):
+        r"""Returns an estimate of the q-quantile (0 <= q <= 1) of the scalars
+        that were accumulated for the given statistic between the last two
+        calls to `update()`, or NaN if no scalars were collected.
+
+        The estimate interpolates geometrically within the histogram bucket
+        containing the quantile, so its relative error is at most the bucket
+        width (a factor of 10**0.1, about 26%) and typically much less.
+        Quantiles in the lowest or highest bucket are clamped to the first or
+        last edge.
+        """
+        return self.quantiles(name, [q])[0]
+
+    def quantiles(self, name, qs):
+        r"""Returns `quantile(name, q)` for each q in the given list,
+        computed from a single copy of the histogram.
+        """
+        counts = self._get_delta(name)[_num_moments:].numpy()
+        total = counts.sum()
+        if total == 0:
+            return [float('nan')] * len(qs)
+        cumulative = np.cumsum(counts)
+        results = []
+        for q in qs:
+            target = min(max(q, 0), 1) * total
+            idx = min(int(np.searchsorted(cumulative, target)), _num_buckets - 1)
+            while counts[idx] == 0: # q = 0 lands before the first non-empty bucket
+                idx += 1
+            if idx == 0:
+                results.append(float(_hist_edges[0]))
+            elif idx == _num_buckets - 1:
+                results.append(float(_hist_edges[-1]))
+            else:
+                lo, hi = _hist_edges[idx - 1], _hist_edges[idx]
+                frac = (target - (cumulative[idx] - counts[idx])) / counts[idx]
+                results.append(float(lo * (hi / lo) ** frac))
+        return results
+
+    def histogram(self, name):
+        r"""Returns the bucket counts of the given statistic between the last
+        two calls to `update()`, as a NumPy array of `len(edges) + 1`
+        counts, together with the bucket edges: `(counts, edges)`. Bucket i
+        holds the scalars in `[edges[i - 1], edges[i])`; the first and last
+        buckets are open-ended.
+        """
+        return self._get_delta(name)[_num_moments:].numpy().copy(), _hist_edges.copy()
+
     def as_dict(self):
         r"""Returns the averages accumulated between the last two calls to
         `update()` as an `dnnlib.EasyDict`. The contents are as follows:
@@ -244,7 +303,7 @@ def _sync(names):
     deltas = []
     device = _sync_device if _sync_device is not None else torch.device('cpu')
     for name in names:
-        delta = torch.zeros([_num_moments], dtype=_counter_dtype, device=device)
+        delta = torch.zeros([_num_counters], dtype=_counter_dtype, device=device)
         for counter in _counters[name].values():
             delta.add_(counter.to(device))
             counter.copy_(torch.zeros_like(counter))
@@ -259,7 +318,7 @@ def _sync(names):
     deltas = deltas.cpu()
     for idx, name in enumerate(names):
         if name not in _cumulative:
-            _cumulative[name] = torch.zeros([_num_moments], dtype=_counter_dtype)
+            _cumulative[name] = torch.zeros([_num_counters], dtype=_counter_dtype)
         _cumulative[name].add_(deltas[idx])
 
     # Return name-value pairs.